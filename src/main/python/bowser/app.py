@@ -10,11 +10,12 @@ import logging
 from bowser.timer import Timer
 from bowser.systems.resource import ResourceLoader
 from bowser.systems.focus import FocusSystem
-from bowser.systems.key_and_frame import KeyAndFrameEngine
-from bowser.systems.audio import AudioSystem, SoundLibrary
+from bowser.systems.key_and_frame import KeyAndFrameEngine, NullDisplay
+from bowser.systems.audio import AudioSystem, SoundLibrary, NullSound, DecodedEffectCache
 from bowser.systems.renderer import RenderingSystem
-from bowser.systems.event import EventDispatcher
+from bowser.systems.event import EventDispatcher, GLOBAL_DISPATCHER
 from bowser.systems.http import HttpService
+from bowser.session import InputRecorder, InputReplayer
 from bowser import xmlparse, rom
 from bowser.rom import RomElement, Window
 from bowser.xmlparse import XmlParser
@@ -54,33 +55,91 @@ class Bowser(object):
 
     def __create_sound_library(self):
         effects_dir = os.path.realpath(os.path.join(os.path.dirname(__file__), "sounds/effects"))
-        library = SoundLibrary(effects_dir)
+        if self.headless:
+            library = SoundLibrary(effects_dir, sound_factory=NullSound)
+        else:
+            #Effects are decoded once and kept on disk in the mixer's format
+            library = SoundLibrary(effects_dir, sound_factory=DecodedEffectCache().load)
         return library
     
-    def __init__(self):
+    def __init__(self, headless=False, frames_per_second=30, incremental_loading=False, speculative_tts=False,
+                 speech_settle_interval=None, tts_process=False):
+        '''
+        headless
+            If True bowser runs without a display, audio device or speech engine.  Input
+            must be injected (e.g. by replaying a session) and speech is recorded by the
+            TTS channel instead of being spoken.
+        frames_per_second
+            How often the loop runs, None runs the loop as fast as possible
+        incremental_loading
+            If True pages are parsed incrementally and published as soon as they contain
+            something which can be focused, see :class:`ResourceLoader`
+        speculative_tts
+            If True speech is synthesized to memory and the speech of the elements likely to
+            be focused next is synthesized ahead of time, see :class:`AudioSystem`
+        speech_settle_interval
+            If not None focus changes are only spoken once focus has stayed put for this many
+            seconds, quicker focus changes play an effect instead, see :class:`RenderingSystem`
+        tts_process
+            If True the speech engine runs in a separate process so that synthesis never delays
+            key handling, see :class:`AudioSystem`
+        '''
+        self.headless = headless
         self.__initialize_logging()
         self.logger = logging.getLogger(__name__)
         self.logger.info("Initializing bowser")
         self.loop_task = BowserLoopTask()
-        self.app_thread = Timer(self.loop_task.iterate, 1/30, self.loop_task.initialize)
+        frame_duration = 0 if frames_per_second is None else 1 / frames_per_second
+        self.app_thread = Timer(self.loop_task.iterate, frame_duration, self.loop_task.initialize)
         self.window = Window()
         self.xml_parser = XmlParser(rom.create_processors_list(), RomElement)
         self.http_service = HttpService()
-        self.resource_loader = ResourceLoader(self.window, self.xml_parser, self.http_service)
+        self.resource_loader = ResourceLoader(self.window, self.xml_parser, self.http_service,
+                                              incremental=incremental_loading)
         self.focus_system = FocusSystem(self.window)
-        self.key_and_frame = KeyAndFrameEngine(self.focus_system, self.window)
-        self.audio_system = AudioSystem(self.window)
+        display = NullDisplay() if headless else None
+        self.key_and_frame = KeyAndFrameEngine(self.focus_system, self.window, display)
+        self.audio_system = AudioSystem(self.window, headless, speculative_tts, tts_process=tts_process)
         self.sound_library = self.__create_sound_library()
-        self.renderer = RenderingSystem(self.window, self.audio_system)
+        self.renderer = RenderingSystem(self.window, self.audio_system, settle_interval=speech_settle_interval,
+                                        sound_library=self.sound_library)
         self.loop_task.add_engine(self.key_and_frame, self.key_and_frame.initialize)
         self.loop_task.add_engine(self.audio_system, self.audio_system.initialize)
+        self.loop_task.add_engine(GLOBAL_DISPATCHER)
+        self.loop_task.add_engine(self.resource_loader)
+        self.loop_task.add_engine(self.renderer)
         self.loop_task.add_init_task(self.sound_library.load)
     
-    def start(self, initial_location):
+    def record_session(self, session_file):
+        '''
+        Records the session (starting location and user input) to session_file.  This must be
+        called before :meth:`start`.
+        '''
+        self.key_and_frame.input_recorder = InputRecorder(session_file)
+    
+    def replay_session(self, session_file, real_time=True):
+        '''
+        Starts bowser at the recorded starting location and replays the recorded input, either
+        with its recorded timing or as fast as possible.  Returns the replayer, its finished
+        future is fulfilled once all input has been replayed.
+        '''
+        replayer = InputReplayer(session_file, self.key_and_frame, real_time)
+        self.loop_task.add_engine(replayer)
+        self.__start_loop()
+        self.window.location = replayer.location
+        replayer.start()
+        return replayer
+    
+    def __start_loop(self):
         self.logger.info("Starting bowser")
         self.app_thread.start()
         self.app_thread.wait_for_initialized()
+    
+    def start(self, initial_location):
+        self.__start_loop()
         self.window.location = initial_location
+        if self.key_and_frame.input_recorder is not None:
+            self.key_and_frame.input_recorder.start(initial_location)
     
     def join(self):
         self.app_thread.join()
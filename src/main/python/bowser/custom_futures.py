@@ -1,65 +1,307 @@
-from concurrent.futures.thread import ThreadPoolExecutor
-from threading import Condition
+import asyncio
+import concurrent.futures
+from threading import Condition, Lock
 import logging
 
-# pylint: disable=invalid-name
-common_pool = ThreadPoolExecutor(max_workers=1)
+class CancelledError(Exception):
+    '''
+    Raised by :meth:`Future.result` when the future was cancelled
+    '''
+    pass
+
+class InlineExecutor(object):
+    '''
+    Runs submitted callables immediately on the calling thread
+    '''
+
+    def submit(self, function, *args, **kwargs):
+        function(*args, **kwargs)
+
+INLINE_EXECUTOR = InlineExecutor()
+
+_default_executor = INLINE_EXECUTOR
+
+def set_default_callback_executor(executor):
+    '''
+    Sets the executor (anything with a submit(function, *args) method) which runs the
+    callbacks of futures created without one.  Callbacks run inline, on the thread completing
+    the future, unless told otherwise.
+    '''
+    #pylint: disable=global-statement
+    global _default_executor
+    _default_executor = executor
+
+def get_default_callback_executor():
+    return _default_executor
 
 class Future(object):
-    
+    '''
+    The eventual result of some work.  A future is completed exactly once, by :meth:`fulfill`,
+    :meth:`cancel` or :meth:`fail`, later attempts are ignored.
+
+    Callbacks (see :meth:`add_callback`) are submitted to callback_executor (the default
+    executor, see :func:`set_default_callback_executor`, if None) after the future's lock has
+    been released, so a slow callback never holds up whoever completes the future nor anyone
+    waiting in :meth:`join`.
+
+    finished
+        True once the future has been completed in any way
+    cancelled
+        True if the future was cancelled
+    exception
+        The exception the future failed with, if it failed
+    '''
+
     class CallbackRecord(object):
-        
+
         def __init__(self, callback, trigger_on_cancel):
             self.callback = callback
             self.trigger_on_cancel = trigger_on_cancel
-    
-    def __init__(self):
+
+    def __init__(self, callback_executor=None):
         self.__result = None
         self.finished = False
         self.cancelled = False
+        self.exception = None
         self.__callbacks = []
         self.__lock = Condition()
+        self.__callback_executor = callback_executor
         self.logger = logging.getLogger(__name__)
-    
-    def fulfill(self, result=None):
+
+    def __complete(self, result=None, cancelled=False, exception=None):
         with self.__lock:
+            if self.finished:
+                return False
             self.__result = result
-            self.__do_finish()
-        
-    def __do_finish(self):
-        self.finished = True
-        self.__fire_callbacks()
-        self.__lock.notify_all()
-        
-    def cancel(self):
-        with self.__lock:
-            self.cancelled = True
-            self.__do_finish()
-        
-    def __fire_callbacks(self):
-        for callback_record in self.__callbacks:
+            self.cancelled = cancelled
+            self.exception = exception
+            self.finished = True
+            callbacks = self.__callbacks
+            self.__callbacks = []
+            self.__lock.notify_all()
+        for callback_record in callbacks:
             self.__fire_callback(callback_record)
-            
+        return True
+
+    def fulfill(self, result=None):
+        '''
+        Completes the future with result, returns False if it was already complete
+        '''
+        return self.__complete(result=result)
+
+    def cancel(self):
+        '''
+        Cancels the future, returns False if it was already complete
+        '''
+        return self.__complete(cancelled=True)
+
+    def fail(self, exception):
+        '''
+        Completes the future with an exception, returns False if it was already complete
+        '''
+        return self.__complete(exception=exception)
+
+    @property
+    def succeeded(self):
+        return self.finished and not self.cancelled and self.exception is None
+
     def __do_fire(self, callback):
         #pylint: disable=bare-except
         try:
             callback(self.__result)
         except:
             self.logger.exception("Exception occurred running future callback")
-            
+
     def __fire_callback(self, callback_record):
-        if callback_record.trigger_on_cancel or not self.cancelled:
-            common_pool.submit(self.__do_fire(callback_record.callback))
-        
-    def join(self):
+        if callback_record.trigger_on_cancel or self.succeeded:
+            executor = self.__callback_executor or get_default_callback_executor()
+            executor.submit(self.__do_fire, callback_record.callback)
+
+    def join(self, timeout=None):
+        '''
+        Waits for the future to complete, at most timeout seconds if timeout is not None.
+        Returns True if the future is complete.
+        '''
         with self.__lock:
-            while not self.finished:
-                self.__lock.wait()
-        
+            return self.__lock.wait_for(lambda: self.finished, timeout)
+
+    def result(self, timeout=None):
+        '''
+        Waits for the future to complete and returns its result.  Raises :class:`CancelledError`
+        if it was cancelled, the exception it failed with if it failed and TimeoutError if it
+        did not complete within timeout seconds.
+        '''
+        if not self.join(timeout):
+            raise TimeoutError("The future did not complete within {0} seconds".format(timeout))
+        if self.cancelled:
+            raise CancelledError()
+        if self.exception is not None:
+            raise self.exception
+        return self.__result
+
     def add_callback(self, callback, trigger_on_cancel=True):
+        '''
+        Calls callback(result) once the future is complete.  Unless trigger_on_cancel is True
+        the callback is only called if the future was fulfilled (not cancelled or failed), a
+        cancelled or failed future calls back with None.
+        '''
         callback_record = Future.CallbackRecord(callback, trigger_on_cancel)
         with self.__lock:
-            if self.finished:
-                self.__fire_callback(callback_record)
-            else:
+            if not self.finished:
                 self.__callbacks.append(callback_record)
+                return
+        self.__fire_callback(callback_record)
+
+    def forward_to(self, other):
+        '''
+        Completes other the same way this future completes
+        '''
+        def forward(result):
+            if self.cancelled:
+                other.cancel()
+            elif self.exception is not None:
+                other.fail(self.exception)
+            else:
+                other.fulfill(result)
+        self.add_callback(forward)
+
+    def then(self, function, callback_executor=None):
+        '''
+        Returns a future fulfilled with function(result) once this future is fulfilled.  If
+        function returns a future the returned future completes with it instead.  Cancellation
+        and failure (including function raising) are passed on.
+        '''
+        chained = Future(callback_executor or self.__callback_executor)
+        def on_complete(result):
+            if not self.succeeded:
+                self.forward_to(chained)
+                return
+            #pylint: disable=broad-except
+            try:
+                value = function(result)
+            except Exception as ex:
+                chained.fail(ex)
+                return
+            if isinstance(value, Future):
+                value.forward_to(chained)
+            else:
+                chained.fulfill(value)
+        self.add_callback(on_complete)
+        return chained
+
+    @staticmethod
+    def all(futures, callback_executor=None):
+        '''
+        Returns a future fulfilled with the list of results of futures once they are all
+        fulfilled.  It is cancelled (or failed) as soon as any of them is.
+        '''
+        futures = list(futures)
+        combined = Future(callback_executor)
+        results = [None] * len(futures)
+        remaining = [len(futures)]
+        lock = Lock()
+        def on_complete(index, future, result):
+            if not future.succeeded:
+                future.forward_to(combined)
+                return
+            with lock:
+                results[index] = result
+                remaining[0] -= 1
+                done = remaining[0] == 0
+            if done:
+                combined.fulfill(results)
+        if not futures:
+            combined.fulfill([])
+        for index, future in enumerate(futures):
+            future.add_callback(lambda result, index=index, future=future: on_complete(index, future, result))
+        return combined
+
+    @staticmethod
+    def any(futures, callback_executor=None):
+        '''
+        Returns a future fulfilled with the result of whichever of futures is fulfilled first.
+        It is cancelled if none of them is fulfilled.
+        '''
+        futures = list(futures)
+        combined = Future(callback_executor)
+        remaining = [len(futures)]
+        lock = Lock()
+        def on_complete(future, result):
+            if future.succeeded:
+                combined.fulfill(result)
+                return
+            with lock:
+                remaining[0] -= 1
+                done = remaining[0] == 0
+            if done:
+                combined.cancel()
+        if not futures:
+            combined.cancel()
+        for future in futures:
+            future.add_callback(lambda result, future=future: on_complete(future, result))
+        return combined
+
+    @staticmethod
+    def from_concurrent(concurrent_future, callback_executor=None):
+        '''
+        Returns a future which completes when the concurrent.futures.Future does
+        '''
+        future = Future(callback_executor)
+        def on_done(done):
+            if done.cancelled():
+                future.cancel()
+            elif done.exception() is not None:
+                future.fail(done.exception())
+            else:
+                future.fulfill(done.result())
+        concurrent_future.add_done_callback(on_done)
+        return future
+
+    def to_concurrent(self):
+        '''
+        Returns a concurrent.futures.Future which completes when this future does
+        '''
+        concurrent_future = concurrent.futures.Future()
+        concurrent_future.set_running_or_notify_cancel()
+        def on_complete(result):
+            if self.cancelled:
+                #A running concurrent future cannot be cancelled
+                concurrent_future.set_exception(CancelledError())
+            elif self.exception is not None:
+                concurrent_future.set_exception(self.exception)
+            else:
+                concurrent_future.set_result(result)
+        self.add_callback(on_complete)
+        return concurrent_future
+
+    @staticmethod
+    def from_awaitable(awaitable, loop, callback_executor=None):
+        '''
+        Runs awaitable on the (running, usually on another thread) asyncio loop and returns a
+        future which completes when it does
+        '''
+        async def run():
+            return await awaitable
+        return Future.from_concurrent(asyncio.run_coroutine_threadsafe(run(), loop), callback_executor)
+
+    def to_asyncio(self, loop=None):
+        '''
+        Returns an asyncio future (of loop, the running loop by default) which completes when
+        this future does
+        '''
+        loop = loop or asyncio.get_running_loop()
+        asyncio_future = loop.create_future()
+        def settle(result):
+            if asyncio_future.done():
+                return
+            if self.cancelled:
+                asyncio_future.cancel()
+            elif self.exception is not None:
+                asyncio_future.set_exception(self.exception)
+            else:
+                asyncio_future.set_result(result)
+        self.add_callback(lambda result: loop.call_soon_threadsafe(settle, result))
+        return asyncio_future
+
+    def __await__(self):
+        return self.to_asyncio().__await__()
@@ -3,16 +3,47 @@ Created on Mar 29, 2015
 
 @author: Pace
 '''
-import sys
+import argparse
 from bowser.app import Bowser
 
+def parse_args():
+    parser = argparse.ArgumentParser(prog="bowser")
+    parser.add_argument("location", nargs="?", help="The RAM page to open")
+    parser.add_argument("--record", metavar="SESSION_FILE", help="Record the session to SESSION_FILE")
+    parser.add_argument("--replay", metavar="SESSION_FILE", help="Replay a recorded session instead of opening a location")
+    parser.add_argument("--fast", action="store_true", help="Replay the session as fast as possible")
+    parser.add_argument("--headless", action="store_true", help="Run without a display, audio device or speech engine")
+    parser.add_argument("--speculative-tts", action="store_true",
+                        help="Synthesize the speech of the likely next focus targets ahead of time (requires espeak)")
+    parser.add_argument("--tts-process", action="store_true",
+                        help="Run the speech engine in a separate process so it cannot stall input handling")
+    parser.add_argument("--speech-settle-interval", metavar="SECONDS", type=float,
+                        help="Only speak focus changes once focus has stayed put for SECONDS, play an effect for quicker ones")
+    args = parser.parse_args()
+    if (args.location is None) == (args.replay is None):
+        parser.error("Exactly one of location or --replay must be given")
+    return args
+
 def main():
-    if len(sys.argv) != 2:
-        print("Usage: bowser [input-ram-file]")
-        sys.exit(-1)
-    bowser = Bowser()
-    bowser.start(sys.argv[1])
-    bowser.join()
+    args = parse_args()
+    if args.headless:
+        bowser = Bowser(headless=True, frames_per_second=None, speech_settle_interval=args.speech_settle_interval)
+    else:
+        bowser = Bowser(speculative_tts=args.speculative_tts, speech_settle_interval=args.speech_settle_interval,
+                        tts_process=args.tts_process)
+    if args.replay is not None:
+        with open(args.replay) as session_file:
+            bowser.replay_session(session_file, real_time=not args.fast)
+        bowser.join()
+    elif args.record is not None:
+        #Kept open until bowser exits so the whole session is written out
+        with open(args.record, 'w') as session_file:
+            bowser.record_session(session_file)
+            bowser.start(args.location)
+            bowser.join()
+    else:
+        bowser.start(args.location)
+        bowser.join()
     
 
 if __name__ == '__main__':
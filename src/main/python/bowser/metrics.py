@@ -0,0 +1,453 @@
+'''
+Lightweight, thread safe metric primitives which systems use to expose their
+performance characteristics at runtime.
+'''
+from bisect import bisect_left
+from collections import deque
+from threading import Lock
+import json
+import logging
+
+class Histogram(object):
+    '''
+    Records a distribution of durations (in seconds) into exponentially sized buckets.
+
+    bucket_bounds
+        The (inclusive) upper bound of each bucket.  Values larger than the last bound are
+        counted in an overflow bucket.
+    '''
+
+    #: 1us, 2us, 4us ... ~8.4s
+    DEFAULT_BUCKET_BOUNDS = [0.000001 * (2 ** exponent) for exponent in range(24)]
+
+    def __init__(self, bucket_bounds=None):
+        self.bucket_bounds = bucket_bounds or Histogram.DEFAULT_BUCKET_BOUNDS
+        self.buckets = [0] * (len(self.bucket_bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.minimum = None
+        self.maximum = None
+
+    def record(self, value):
+        self.buckets[bisect_left(self.bucket_bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if self.minimum is None or value < self.minimum:
+            self.minimum = value
+        if self.maximum is None or value > self.maximum:
+            self.maximum = value
+
+    def get_mean(self):
+        if self.count == 0:
+            return None
+        return self.total / self.count
+
+    def get_percentile(self, percentile):
+        '''
+        Returns the upper bound of the bucket containing the given percentile (0-100).  This is
+        an approximation, the true value is no larger than the returned value.
+        '''
+        if self.count == 0:
+            return None
+        threshold = self.count * percentile / 100.0
+        seen = 0
+        for index, bucket_count in enumerate(self.buckets):
+            seen += bucket_count
+            if seen >= threshold and bucket_count > 0:
+                if index < len(self.bucket_bounds):
+                    return self.bucket_bounds[index]
+                return self.maximum
+        return self.maximum
+
+    def snapshot(self):
+        buckets = {}
+        for index, bucket_count in enumerate(self.buckets):
+            if bucket_count == 0:
+                continue
+            if index < len(self.bucket_bounds):
+                buckets["<={0:g}".format(self.bucket_bounds[index])] = bucket_count
+            else:
+                buckets[">{0:g}".format(self.bucket_bounds[-1])] = bucket_count
+        return {
+            'count': self.count,
+            'total': self.total,
+            'min': self.minimum,
+            'max': self.maximum,
+            'mean': self.get_mean(),
+            'p50': self.get_percentile(50),
+            'p99': self.get_percentile(99),
+            'buckets': buckets
+        }
+
+class DispatchMetrics(object):
+    '''
+    Collects timing information about event dispatch.  See
+    :meth:`bowser.systems.event.EventDispatcher.enable_metrics`.
+
+    slow_listener_threshold
+        Listener calls taking longer than this many seconds are logged and recorded as slow
+    max_slow_listener_records
+        How many of the most recent slow listener calls to remember
+    '''
+
+    PHASE_NAMES = {1: 'capture', 2: 'target', 3: 'bubble'}
+
+    def __init__(self, slow_listener_threshold=0.05, max_slow_listener_records=100):
+        self.slow_listener_threshold = slow_listener_threshold
+        self.logger = logging.getLogger(__name__)
+        self.__lock = Lock()
+        self.__max_slow_listener_records = max_slow_listener_records
+        self.reset()
+
+    def reset(self):
+        '''
+        Discards everything recorded so far
+        '''
+        with self.__lock:
+            self.__events = {}
+            self.__phases = {}
+            self.__listeners = {}
+            self.__slow_listeners = deque(maxlen=self.__max_slow_listener_records)
+
+    @staticmethod
+    def describe_listener(listener):
+        '''
+        Returns a stable, human readable name for a listener callable
+        '''
+        name = getattr(listener, '__qualname__', None) or getattr(listener, '__name__', None)
+        if name is None:
+            return repr(listener)
+        module = getattr(listener, '__module__', None)
+        if module is None:
+            return name
+        return "{0}.{1}".format(module, name)
+
+    @staticmethod
+    def __get_histogram(histograms, key):
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = Histogram()
+            histograms[key] = histogram
+        return histogram
+
+    def record_event(self, event_name, elapsed):
+        with self.__lock:
+            self.__get_histogram(self.__events, event_name).record(elapsed)
+
+    def record_phase(self, event_name, phase, elapsed):
+        with self.__lock:
+            self.__get_histogram(self.__phases, (event_name, phase)).record(elapsed)
+
+    def record_listener(self, listener, event, elapsed):
+        listener_name = DispatchMetrics.describe_listener(listener)
+        with self.__lock:
+            self.__get_histogram(self.__listeners, listener_name).record(elapsed)
+            if elapsed >= self.slow_listener_threshold:
+                self.__slow_listeners.append({
+                    'listener': listener_name,
+                    'event': event.name,
+                    'phase': DispatchMetrics.PHASE_NAMES.get(event.event_phase),
+                    'elapsed': elapsed,
+                    'timestamp': event.timestamp
+                })
+                slow = True
+            else:
+                slow = False
+        if slow:
+            self.logger.warning("Slow listener %s took %.3fs handling %s", listener_name, elapsed, event)
+
+    def get_event_stats(self, event_name):
+        with self.__lock:
+            histogram = self.__events.get(event_name)
+            return None if histogram is None else histogram.snapshot()
+
+    def get_phase_stats(self, event_name, phase):
+        '''
+        phase is one of 'capture', 'target' or 'bubble'
+        '''
+        with self.__lock:
+            for (name, phase_id), histogram in self.__phases.items():
+                if name == event_name and DispatchMetrics.PHASE_NAMES[phase_id] == phase:
+                    return histogram.snapshot()
+            return None
+
+    def get_listener_stats(self, listener):
+        '''
+        listener may either be the listener callable itself or its description
+        '''
+        if callable(listener):
+            listener = DispatchMetrics.describe_listener(listener)
+        with self.__lock:
+            histogram = self.__listeners.get(listener)
+            return None if histogram is None else histogram.snapshot()
+
+    def get_slow_listeners(self):
+        with self.__lock:
+            return list(self.__slow_listeners)
+
+    def snapshot(self):
+        '''
+        Returns everything recorded so far as a dict of plain values
+        '''
+        with self.__lock:
+            phases = {}
+            for (event_name, phase_id), histogram in self.__phases.items():
+                phases.setdefault(event_name, {})[DispatchMetrics.PHASE_NAMES[phase_id]] = histogram.snapshot()
+            return {
+                'events': dict((name, histogram.snapshot()) for name, histogram in self.__events.items()),
+                'phases': phases,
+                'listeners': dict((name, histogram.snapshot()) for name, histogram in self.__listeners.items()),
+                'slow_listeners': list(self.__slow_listeners),
+                'slow_listener_threshold': self.slow_listener_threshold
+            }
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.snapshot(), **kwargs)
+
+class SpeculationMetrics(object):
+    '''
+    Measures how well speculative work (e.g. synthesizing speech for the elements likely to be
+    focused next) pays off.
+
+    predictions
+        How many items were speculatively prepared
+    hits
+        How many requests found their item already prepared (or being prepared)
+    misses
+        How many requests had to start from scratch
+    wasted
+        How many prepared items were discarded without being requested
+    '''
+
+    def __init__(self):
+        self.__lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self.__lock:
+            self.predictions = 0
+            self.hits = 0
+            self.misses = 0
+            self.wasted = 0
+            self.__latency_saved = Histogram()
+            self.__wait = Histogram()
+
+    def record_prediction(self):
+        with self.__lock:
+            self.predictions += 1
+
+    def record_hit(self, latency_saved):
+        with self.__lock:
+            self.hits += 1
+            self.__latency_saved.record(latency_saved)
+
+    def record_miss(self):
+        with self.__lock:
+            self.misses += 1
+
+    def record_wasted(self):
+        with self.__lock:
+            self.wasted += 1
+
+    def record_wait(self, elapsed):
+        '''
+        Records how long a request waited before its item was ready
+        '''
+        with self.__lock:
+            self.__wait.record(elapsed)
+
+    def get_hit_rate(self):
+        with self.__lock:
+            requests = self.hits + self.misses
+            if requests == 0:
+                return None
+            return self.hits / float(requests)
+
+    def get_total_latency_saved(self):
+        with self.__lock:
+            return self.__latency_saved.total
+
+    def snapshot(self):
+        hit_rate = self.get_hit_rate()
+        with self.__lock:
+            return {
+                'predictions': self.predictions,
+                'hits': self.hits,
+                'misses': self.misses,
+                'wasted': self.wasted,
+                'hit_rate': hit_rate,
+                'latency_saved': self.__latency_saved.snapshot(),
+                'wait': self.__wait.snapshot()
+            }
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.snapshot(), **kwargs)
+
+class CacheMetrics(object):
+    '''
+    Counts the hits, misses and evictions of a (possibly multi tier) cache.  Hits and evictions
+    are counted per tier (e.g. 'memory' and 'disk').
+    '''
+
+    def __init__(self):
+        self.__lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self.__lock:
+            self.misses = 0
+            self.__hits = {}
+            self.__evictions = {}
+
+    def record_hit(self, tier):
+        with self.__lock:
+            self.__hits[tier] = self.__hits.get(tier, 0) + 1
+
+    def record_miss(self):
+        with self.__lock:
+            self.misses += 1
+
+    def record_eviction(self, tier):
+        with self.__lock:
+            self.__evictions[tier] = self.__evictions.get(tier, 0) + 1
+
+    def get_hits(self, tier=None):
+        '''
+        Returns the hits in the given tier or, if tier is None, in all tiers
+        '''
+        with self.__lock:
+            if tier is None:
+                return sum(self.__hits.values())
+            return self.__hits.get(tier, 0)
+
+    def get_evictions(self, tier):
+        with self.__lock:
+            return self.__evictions.get(tier, 0)
+
+    def get_hit_rate(self):
+        hits = self.get_hits()
+        with self.__lock:
+            lookups = hits + self.misses
+            if lookups == 0:
+                return None
+            return hits / float(lookups)
+
+    def snapshot(self):
+        hit_rate = self.get_hit_rate()
+        with self.__lock:
+            return {
+                'hits': dict(self.__hits),
+                'misses': self.misses,
+                'evictions': dict(self.__evictions),
+                'hit_rate': hit_rate
+            }
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.snapshot(), **kwargs)
+
+class RenderMetrics(object):
+    '''
+    Counts how many focus changes were spoken and how many were suppressed (e.g. because focus
+    moved on again before it settled) by the rendering system.
+    '''
+
+    def __init__(self):
+        self.__lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self.__lock:
+            self.spoken = 0
+            self.suppressed = 0
+            self.__settle_delay = Histogram()
+
+    def record_spoken(self, settle_delay=None):
+        '''
+        settle_delay is how long the render waited for focus to settle, if it waited at all
+        '''
+        with self.__lock:
+            self.spoken += 1
+            if settle_delay is not None:
+                self.__settle_delay.record(settle_delay)
+
+    def record_suppressed(self):
+        with self.__lock:
+            self.suppressed += 1
+
+    def get_suppression_rate(self):
+        with self.__lock:
+            renders = self.spoken + self.suppressed
+            if renders == 0:
+                return None
+            return self.suppressed / float(renders)
+
+    def snapshot(self):
+        suppression_rate = self.get_suppression_rate()
+        with self.__lock:
+            return {
+                'spoken': self.spoken,
+                'suppressed': self.suppressed,
+                'suppression_rate': suppression_rate,
+                'settle_delay': self.__settle_delay.snapshot()
+            }
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.snapshot(), **kwargs)
+
+class HttpPoolMetrics(object):
+    '''
+    Measures how well a pool of HTTP connections is used
+
+    requests
+        How many requests were made
+    reused
+        How many requests went over a connection kept alive from an earlier request
+    connections_opened
+        How many new connections were needed
+    '''
+
+    def __init__(self):
+        self.__lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self.__lock:
+            self.requests = 0
+            self.reused = 0
+            self.connections_opened = 0
+            self.__wait = Histogram()
+
+    def record_request(self, reused):
+        with self.__lock:
+            self.requests += 1
+            if reused:
+                self.reused += 1
+            else:
+                self.connections_opened += 1
+
+    def record_wait(self, elapsed):
+        '''
+        Records how long a request waited for a free connection
+        '''
+        with self.__lock:
+            self.__wait.record(elapsed)
+
+    def get_reuse_rate(self):
+        with self.__lock:
+            if self.requests == 0:
+                return None
+            return self.reused / float(self.requests)
+
+    def snapshot(self):
+        reuse_rate = self.get_reuse_rate()
+        with self.__lock:
+            return {
+                'requests': self.requests,
+                'reused': self.reused,
+                'connections_opened': self.connections_opened,
+                'reuse_rate': reuse_rate,
+                'wait': self.__wait.snapshot()
+            }
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.snapshot(), **kwargs)
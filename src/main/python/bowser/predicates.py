@@ -0,0 +1,117 @@
+'''
+Predicates for the searches of :class:`bowser.rom.TreeNode` which lxml can evaluate in C.
+'''
+from lxml import etree
+
+class XPathPredicate(object):
+    '''
+    A node predicate which lxml can evaluate.  It can be called like any other predicate but
+    when it is passed to one of :class:`bowser.rom.RomElement`'s searches the whole search is performed
+    by XPath, in C, instead of calling back into Python for every node.
+
+    condition
+        An XPath expression which is true when evaluated on a matching element
+    variables
+        Values for the variables ($name) referenced by condition
+    '''
+
+    def __init__(self, condition, **variables):
+        self.condition = condition
+        self.variables = variables
+        self.__matches = etree.XPath("self::*[{0}]".format(condition))
+        self.__first_descendant_or_self = etree.XPath("descendant-or-self::*[{0}][1]".format(condition))
+        self.__first_descendant = etree.XPath("descendant::*[{0}][1]".format(condition))
+        self.__first_ancestor_or_self = etree.XPath("ancestor-or-self::*[{0}][1]".format(condition))
+        self.__first_ancestor = etree.XPath("ancestor::*[{0}][1]".format(condition))
+        self.__matching_children = etree.XPath("$level/*[{0}][1]".format(condition))
+
+    def __call__(self, node):
+        #Subclasses may override this with an equivalent check in Python, which is quicker
+        #than evaluating an XPath for a single node
+        if not isinstance(node, etree.ElementBase):
+            return False
+        return len(self.__matches(node, **self.variables)) > 0
+
+    @staticmethod
+    def __first(results):
+        if results:
+            return results[0]
+        return None
+
+    def find_first_descendant(self, element, include_self=True):
+        if include_self:
+            return self.__first(self.__first_descendant_or_self(element, **self.variables))
+        return self.__first(self.__first_descendant(element, **self.variables))
+
+    def find_first_ancestor(self, element, include_self=True):
+        if include_self:
+            return self.__first(self.__first_ancestor_or_self(element, **self.variables))
+        return self.__first(self.__first_ancestor(element, **self.variables))
+
+    def find_first_in_breadth_order(self, element, include_self=True):
+        '''
+        Searches one level at a time, each level is searched (and the next level found) in C
+        '''
+        if include_self and self(element):
+            return element
+        level = [element]
+        while level:
+            match = self.__first(self.__matching_children(element, level=level, **self.variables))
+            if match is not None:
+                return match
+            level = _NEXT_LEVEL(element, level=level)
+        return None
+
+_NEXT_LEVEL = etree.XPath("$level/*")
+
+class TagPredicate(XPathPredicate):
+    '''
+    Matches elements with the given tag
+    '''
+
+    def __init__(self, tag):
+        XPathPredicate.__init__(self, "name() = $tag", tag=tag)
+        self.tag = tag
+
+    def __call__(self, node):
+        return isinstance(node, etree.ElementBase) and node.tag == self.tag
+
+class AttributePredicate(XPathPredicate):
+    '''
+    Matches elements which have the given attribute or, if value is given, which have the
+    attribute set to value
+    '''
+
+    def __init__(self, attr_name, value=None):
+        if value is None:
+            XPathPredicate.__init__(self, "@*[name() = $attr_name]", attr_name=attr_name)
+        else:
+            XPathPredicate.__init__(self, "@*[name() = $attr_name] = $value", attr_name=attr_name, value=value)
+        self.attr_name = attr_name
+        self.value = value
+
+    def __call__(self, node):
+        if not isinstance(node, etree.ElementBase):
+            return False
+        if self.value is None:
+            return node.get(self.attr_name) is not None
+        return node.get(self.attr_name) == self.value
+
+class BoolAttributePredicate(XPathPredicate):
+    '''
+    Matches elements for which :meth:`RomElement.get_bool` would return True
+    '''
+
+    def __init__(self, attr_name, default_value=False):
+        XPathPredicate.__init__(self,
+            "(not(@*[name() = $attr_name]) and $default_value) or "
+            "@*[name() = $attr_name][not(contains(., '|'))]"
+            "[contains('|true|t|yes|1|y|', concat('|', translate(., 'TRUEYS', 'trueys'), '|'))]",
+            attr_name=attr_name, default_value=default_value)
+        self.attr_name = attr_name
+        self.default_value = default_value
+
+    def __call__(self, node):
+        if not isinstance(node, etree.ElementBase):
+            return False
+        return node.get_bool(self.attr_name, self.default_value)
@@ -3,64 +3,85 @@ Created on Mar 25, 2015
 
 @author: Pace
 '''
-from bowser.systems.event import EventTarget, Event
-from bowser.systems.focus import FocusRequestEvent, FocusEvent
+from bowser.systems.event import EventTarget, Event, SubtreeModifiedEvent, TextModifiedEvent,\
+    GLOBAL_DISPATCHER
+from bowser.systems.focus import FocusRequestEvent, FocusEvent, FocusPredictionEvent
 from bowser.systems.key_and_frame import create_navigation_controller, NavigationTheme,\
     KeyEvent
+from collections import deque
+import itertools
+
+from lxml import etree
 from lxml.etree import ElementBase
 from bowser import Attributes, Tags
+from bowser.predicates import XPathPredicate
 
 class TreeNode(object):
     '''
     Adds some tree behavior to something that seems like a node in a tree
+
+    The searches are iterative (they do not recurse per level so they work on trees of any
+    depth) and evaluate the predicate at most once per node.  Children which are not tree
+    nodes themselves (e.g. comments) are skipped.
     '''
 
+    def _get_child_nodes(self):
+        return [child for child in self if isinstance(child, TreeNode)]
+
+    def _iter_subtree(self):
+        '''
+        Yields this node and all of its descendants in depth first (document) order
+        '''
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node._get_child_nodes()))
+
     def bfs(self, predicate, include_self=True):
         '''
         Performs a breadth first search, returning the first node that matches the predicate
         '''
         if include_self and predicate(self):
             return self
-        for child in self:
-            if predicate(child):
-                return child
-        for child in self:
-            child_result = child.bfs(predicate)
-            if child_result is not None:
-                return child_result
+        queue = deque(self._get_child_nodes())
+        while queue:
+            node = queue.popleft()
+            if predicate(node):
+                return node
+            queue.extend(node._get_child_nodes())
         return None
     
     def dfs(self, predicate, include_self=True):
         '''
         Performs a depth first search, returning the first node that matches the predicate
         '''
-        if include_self and predicate(self):
-            return self
-        for child in self:
-            child_result = child.dfs(predicate)
-            if child_result is not None:
-                return child_result
+        nodes = self._iter_subtree()
+        if not include_self:
+            next(nodes)
+        for node in nodes:
+            if predicate(node):
+                return node
         return None
     
     def dfs_do(self, expression, *args, **kwargs):
         '''
         Performs expression on each of the nodes (including this one) in a DFS manner
         '''
-        expression(self, *args, **kwargs)
-        for child in self:
-            child.dfs_do(expression, *args, **kwargs)
+        for node in self._iter_subtree():
+            expression(node, *args, **kwargs)
 
     def find_first_ancestor(self, predicate, include_self=True):
         '''
         Performs a search up the ancestor chain, finding the first ancestor that matches
         the predicate
         '''
-        if include_self and predicate(self):
-            return self
-        if self.getparent() is None:
-            return None
-        return self.getparent().find_first_ancestor(predicate)
-
+        node = self if include_self else self.getparent()
+        while isinstance(node, TreeNode):
+            if predicate(node):
+                return node
+            node = node.getparent()
+        return None
 
 class LocationChangedEvent(Event):
     
@@ -78,8 +99,17 @@ class RomElement(ElementBase, EventTarget, TreeNode):
     def __str__(self):
         return "{0}({1})".format(self.tag, self.get(Attributes.Id))
     
+    #The parsed id attribute.  Python attributes only live as long as the lxml proxy does so this
+    #is only kept for elements something holds on to (e.g. the elements in an ElementIndex)
+    __cached_id = None
+
+    #Only set on the root of a document, see get_element_index
+    __element_index = None
+
     def get_id(self):
-        return int(self.get(Attributes.Id))
+        if self.__cached_id is None:
+            self.__cached_id = int(self.get(Attributes.Id))
+        return self.__cached_id
     
     def get_bool(self, attr_name, default_value=False):
         value = self.get(attr_name)
@@ -89,11 +119,68 @@ class RomElement(ElementBase, EventTarget, TreeNode):
             return self.get(attr_name).lower() in ["true", "t", "yes", "1", "y"]
     
     def set(self, attr_name, attr_value):
-        return ElementBase.set(self, attr_name, str(attr_value))
+        if attr_name == Attributes.Id:
+            return self.__set_id(attr_value)
+        ElementBase.set(self, attr_name, str(attr_value))
+        if attr_name == Attributes.Focusable:
+            #The focus system indexes the focusable elements
+            self.dispatch_event(SubtreeModifiedEvent())
+
+    def __set_id(self, element_id):
+        #Indexed elements always have their id cached (the index holds on to them)
+        old_id = self.__cached_id
+        ElementBase.set(self, Attributes.Id, str(element_id))
+        self.__cached_id = None
+        if old_id is not None:
+            self.get_element_index().update_id(self, old_id)
+
+    def __get_root(self):
+        root = self
+        for root in self.iterancestors():
+            pass
+        return root
+
+    def get_element_index(self):
+        '''
+        Returns the :class:`ElementIndex` of the document (the tree) this element is part of.
+        The index is kept on the root element so it is released along with the document.
+        '''
+        root = self.__get_root()
+        if root.__element_index is None:
+            root.__element_index = ElementIndex()
+        return root.__element_index
     
-    def focus(self):
-        self.dispatch_event(FocusRequestEvent())
+    @property
+    def text(self):
+        return ElementBase.text.__get__(self)
+
+    @text.setter
+    def text(self, value):
+        ElementBase.text.__set__(self, value)
+        self.dispatch_event(TextModifiedEvent())
+
+    def focus(self, synchronous=True):
+        self.dispatch_event(FocusRequestEvent(synchronous=synchronous))
         
+    def bfs(self, predicate, include_self=True):
+        if isinstance(predicate, XPathPredicate):
+            return predicate.find_first_in_breadth_order(self, include_self)
+        return TreeNode.bfs(self, predicate, include_self)
+
+    def dfs(self, predicate, include_self=True):
+        if isinstance(predicate, XPathPredicate):
+            return predicate.find_first_descendant(self, include_self)
+        return TreeNode.dfs(self, predicate, include_self)
+
+    def find_first_ancestor(self, predicate, include_self=True):
+        if isinstance(predicate, XPathPredicate):
+            #The window is not an element and so never matches
+            return predicate.find_first_ancestor(self, include_self)
+        return TreeNode.find_first_ancestor(self, predicate, include_self)
+
+    def _iter_subtree(self):
+        return self.iter(tag=etree.Element)
+
     def getparent(self, *args, **kwargs):
         result = ElementBase.getparent(self, *args, **kwargs)
         if result is None:
@@ -101,14 +188,147 @@ class RomElement(ElementBase, EventTarget, TreeNode):
         else:
             return result
 
+    # The structural mutators are wrapped so that anything caching information about the shape
+    # of the tree (e.g. event propagation paths) can be invalidated and so that the element
+    # indexes follow the elements from document to document.
+
+    def notify_subtree_modified(self):
+        '''
+        Must be called after the children of this element are changed by means which bypass the
+        mutators of this class (e.g. etree.SubElement or an incremental parse)
+        '''
+        GLOBAL_DISPATCHER.invalidate_propagation_paths()
+        self.dispatch_event(SubtreeModifiedEvent())
+
+    @staticmethod
+    def __subtrees_moving(elements):
+        '''
+        Called before elements are moved, they leave the index of the document they are in.
+        Returns the parents they are leaving, which must be notified once the move is done (see
+        :meth:`__subtrees_moved`).
+        '''
+        old_parents = []
+        for element in elements:
+            if not isinstance(element, RomElement):
+                continue
+            old_parent = ElementBase.getparent(element)
+            if old_parent is not None and old_parent not in old_parents:
+                old_parents.append(old_parent)
+            root = element.__get_root()
+            if root is element:
+                #The whole document is joining another one
+                element.__element_index = None
+            elif root.__element_index is not None:
+                root.__element_index.remove_subtree(element)
+        return old_parents
+
+    @staticmethod
+    def __subtrees_moved(old_parents, new_parent):
+        #The new parent has been notified already, the parents which lost children have not
+        for old_parent in old_parents:
+            if old_parent is not new_parent:
+                old_parent.notify_subtree_modified()
+
+    def __subtrees_added(self, elements):
+        element_index = self.get_element_index()
+        for element in elements:
+            element_index.add_subtree(element)
+        self.notify_subtree_modified()
+
+    def __subtrees_removed(self, elements):
+        element_index = self.get_element_index()
+        for element in elements:
+            element_index.remove_subtree(element)
+        self.notify_subtree_modified()
+
+    def append(self, element):
+        old_parents = self.__subtrees_moving([element])
+        ElementBase.append(self, element)
+        self.__subtrees_added([element])
+        self.__subtrees_moved(old_parents, self)
+
+    def extend(self, elements):
+        elements = list(elements)
+        old_parents = self.__subtrees_moving(elements)
+        ElementBase.extend(self, elements)
+        self.__subtrees_added(elements)
+        self.__subtrees_moved(old_parents, self)
+
+    def insert(self, index, element):
+        old_parents = self.__subtrees_moving([element])
+        ElementBase.insert(self, index, element)
+        self.__subtrees_added([element])
+        self.__subtrees_moved(old_parents, self)
+
+    def remove(self, element):
+        ElementBase.remove(self, element)
+        self.__subtrees_removed([element])
+
+    def replace(self, old_element, new_element):
+        old_parents = self.__subtrees_moving([new_element])
+        ElementBase.replace(self, old_element, new_element)
+        self.get_element_index().remove_subtree(old_element)
+        self.__subtrees_added([new_element])
+        self.__subtrees_moved(old_parents, self)
+
+    def __sibling_added(self, element, old_parents):
+        #The children of this element's parent have changed, not this element's
+        parent = ElementBase.getparent(self)
+        if parent is None:
+            parent = self
+        parent.__subtrees_added([element])
+        self.__subtrees_moved(old_parents, parent)
+
+    def addnext(self, element):
+        old_parents = self.__subtrees_moving([element])
+        ElementBase.addnext(self, element)
+        self.__sibling_added(element, old_parents)
+
+    def addprevious(self, element):
+        old_parents = self.__subtrees_moving([element])
+        ElementBase.addprevious(self, element)
+        self.__sibling_added(element, old_parents)
+
+    def clear(self, *args, **kwargs):
+        children = list(self)
+        ElementBase.clear(self, *args, **kwargs)
+        self.__subtrees_removed(children)
+
+    def __setitem__(self, index, value):
+        old_children = self[index] if isinstance(index, slice) else [self[index]]
+        new_children = list(value) if isinstance(index, slice) else [value]
+        old_parents = self.__subtrees_moving(new_children)
+        ElementBase.__setitem__(self, index, new_children if isinstance(index, slice) else value)
+        element_index = self.get_element_index()
+        for element in old_children:
+            element_index.remove_subtree(element)
+        self.__subtrees_added(new_children)
+        self.__subtrees_moved(old_parents, self)
+
+    def __delitem__(self, index):
+        old_children = self[index] if isinstance(index, slice) else [self[index]]
+        ElementBase.__delitem__(self, index)
+        self.__subtrees_removed(old_children)
+
 class TagProcessor(object):
+    '''
+    A processor for elements with a single tag.  The tag is advertised through tags so that
+    :class:`bowser.xmlparse.XmlParser` only hands this processor matching elements.
+    '''
     
     def __init__(self, tag_name):
         self.tag_name = tag_name
+        self.tags = [tag_name]
         
     def process(self, xml_element):
         if xml_element.tag == self.tag_name:
             self._do_process(xml_element)
+            
+    def process_tagged(self, xml_element):
+        '''
+        Processes an element which is already known to have this processor's tag
+        '''
+        self._do_process(xml_element)
 
     def _do_process(self, _):
         raise Exception("Override in child class")
@@ -119,50 +339,98 @@ class RamProcessor(TagProcessor):
         TagProcessor.__init__(self, Tags.Ram)
     
     def _do_process(self, element):
-        element.set(Attributes.Focusable, False)
+        #Bypasses RomElement.set, which would notify the document once per ram element
+        ElementBase.set(element, Attributes.Focusable, str(False))
+
+    def finish(self, root):
+        #One notification for every ram element of the document
+        root.notify_subtree_modified()
 
 class ContainerController(object):
+    '''
+    Navigates between the children of a container.  The title (if any) is not navigable, the
+    rest of the children (the "real" children) are navigated by index.
+
+    The real children and the title are cached and the cache is dropped whenever the
+    container's children change (see :class:`SubtreeModifiedEvent`), so navigation does not
+    rescan the children on every key press.
+
+    remember_position
+        If True then focusing the container returns to the child that was last navigated to
+    page_size
+        The number of children skipped by :meth:`page_forwards` and :meth:`page_backwards`
+    '''
 
     def __init__(self):
         self.remember_position = False
+        self.page_size = 10
         self.__current_index = None
         self.navigation_theme = None
+        self.__real_children = None
+        self.__title = None
 
     def watch(self, element):
         self.__add_navigation_controller(element)
         element.add_event_listener(FocusEvent.focus_name, self.__on_focus)
+        element.add_event_listener(SubtreeModifiedEvent.name, self.__on_subtree_modified)
 
     def navigate_forwards(self, element):
         if self.__current_index is None:
-            if self.__has_real_children(element):
-                self.__current_index = 0
-            else:
-                return
+            self.navigate_first(element)
         else:
-            if self.__current_index < (self.__num_real_children(element) - 1):
-                self.__current_index += 1
-            else:
-                return
-        self.__get_real_child(element, self.__current_index).focus()
+            self.navigate_to_index(element, self.__current_index + 1)
     
     def navigate_backwards(self, element):
         if self.__current_index is None:
             return
-        if self.__current_index == 0:
+        self.navigate_to_index(element, self.__current_index - 1)
+
+    def navigate_first(self, element):
+        self.navigate_to_index(element, 0)
+
+    def navigate_last(self, element):
+        self.navigate_to_index(element, len(self.__get_real_children(element)) - 1)
+
+    def page_forwards(self, element):
+        last_index = len(self.__get_real_children(element)) - 1
+        if self.__current_index is None:
+            self.navigate_to_index(element, min(self.page_size - 1, last_index))
+        else:
+            self.navigate_to_index(element, min(self.__current_index + self.page_size, last_index))
+
+    def page_backwards(self, element):
+        if self.__current_index is None:
+            return
+        self.navigate_to_index(element, max(self.__current_index - self.page_size, 0))
+
+    def navigate_to_index(self, element, index):
+        '''
+        Focuses the index'th real child.  Nothing happens if there is no such child.
+        '''
+        real_children = self.__get_real_children(element)
+        if index < 0 or index >= len(real_children):
             return
-        self.__current_index -= 1
-        self.__get_real_child(element, self.__current_index).focus()
-        
-    def __get_real_child(self, element, index):
-        real_index = 0
-        for child in element:
-            if child.tag == Tags.Title:
-                continue
-            if real_index == index:
-                return child
-            else:
-                real_index += 1
-        raise Exception("Index out of bounds: {0}".format(index))
+        self.__current_index = index
+        real_children[index].focus()
+
+    def __get_real_children(self, element):
+        if self.__real_children is None:
+            self.__real_children = []
+            for child in element.iterchildren(tag=etree.Element):
+                if child.tag == Tags.Title:
+                    if self.__title is None:
+                        self.__title = child
+                else:
+                    self.__real_children.append(child)
+            if self.__current_index is not None and self.__current_index >= len(self.__real_children):
+                #Children were removed from under the current position
+                self.__current_index = len(self.__real_children) - 1 if self.__real_children else None
+        return self.__real_children
+
+    def __on_subtree_modified(self, event):
+        if event.event_phase == Event.AT_TARGET:
+            self.__real_children = None
+            self.__title = None
         
     def __add_navigation_controller(self, element):
         if element.get(Attributes.NavigationTheme) is None:
@@ -171,31 +439,48 @@ class ContainerController(object):
             navcon = create_navigation_controller(element.get(Attributes.NavigationTheme), self)
         element.add_event_listener(KeyEvent.name, navcon.on_key)
         
-    def __num_real_children(self, element):
-        result = 0
-        for child in element:
-            if child.tag != Tags.Title:
-                result += 1
-        return result
-        
-    def __has_real_children(self, element):
-        return self.__num_real_children(element) > 0
-        
     def __get_title(self, element):
-        for child in element:
-            if child.tag == Tags.Title:
-                return child
+        self.__get_real_children(element)
+        return self.__title
         
     def __get_component_to_focus_on_reset(self, element):
         title_element = self.__get_title(element) 
         if title_element is not None:
             return title_element
+        real_children = self.__get_real_children(element)
         if self.__current_index is None:
-            if self.__has_real_children(element):
+            if real_children:
                 self.__current_index = 0
             else:
                 return None
-        return self.__get_real_child(element, self.__current_index)
+        return real_children[self.__current_index]
+        
+    def __get_index_of(self, element, child):
+        real_children = self.__get_real_children(element)
+        if self.__current_index is not None and real_children[self.__current_index] is child:
+            return self.__current_index
+        for index, real_child in enumerate(real_children):
+            if real_child is child:
+                return index
+        return None
+
+    def __predict_next_focus(self, element, focused_child):
+        '''
+        From a child the next focus is most likely the next child, then the previous one, then
+        the title (when the container is left and re-entered)
+        '''
+        real_children = self.__get_real_children(element)
+        if focused_child is self.__title:
+            candidates = real_children[:1]
+        else:
+            index = self.__get_index_of(element, focused_child)
+            if index is None:
+                return
+            candidates = real_children[index + 1:index + 2] + real_children[max(index - 1, 0):index]
+            if self.__title is not None:
+                candidates.append(self.__title)
+        if candidates:
+            element.dispatch_event(FocusPredictionEvent(candidates))
         
     def __on_focus(self, focus_event):
         if focus_event.event_phase == Event.AT_TARGET:
@@ -205,6 +490,8 @@ class ContainerController(object):
             if component is not None:
                 component.focus()
                 focus_event.stop_propagation()
+        elif focus_event.target.getparent() is focus_event.current_target:
+            self.__predict_next_focus(focus_event.current_target, focus_event.target)
 
 class ContainerProcessor(TagProcessor):
     
@@ -215,28 +502,104 @@ class ContainerProcessor(TagProcessor):
         container_controller = ContainerController()
         container_controller.watch(element)
         
+class ElementIndex(object):
+    '''
+    Maps the ids of the elements of a document to the elements.  Every document has its own
+    index (see :meth:`RomElement.get_element_index`).  Elements are added as
+    :class:`IdPopulatingProcessor` gives them their ids and follow the elements as they are
+    moved between documents through :class:`RomElement`'s mutators.
+
+    Holding the elements also keeps their lxml proxies alive, which is what allows
+    :meth:`RomElement.get_id` to cache the parsed id.  The index is only reachable from the
+    document's root so it is released along with the document.
+    '''
+
+    def __init__(self):
+        self.__elements = {}
+
+    def __len__(self):
+        return len(self.__elements)
+
+    def __contains__(self, element_id):
+        return element_id in self.__elements
+
+    def get(self, element_id):
+        '''
+        Returns the element with the given id or None if there is no such element
+        '''
+        return self.__elements.get(element_id)
+
+    def add(self, element):
+        self.__elements[element.get_id()] = element
+
+    def add_subtree(self, root):
+        '''
+        Adds root and all of its descendants.  Elements without an id are skipped.
+        '''
+        for element in root.iter(tag=etree.Element):
+            if element.get(Attributes.Id) is not None:
+                self.add(element)
+
+    def remove_subtree(self, root):
+        for element in root.iter(tag=etree.Element):
+            if element.get(Attributes.Id) is not None:
+                self.__remove(element.get_id(), element)
+
+    def update_id(self, element, old_id):
+        '''
+        Moves an element whose id attribute has changed from old_id to its new id
+        '''
+        if self.__remove(old_id, element):
+            self.add(element)
+
+    def __remove(self, element_id, element):
+        if self.__elements.get(element_id) is element:
+            del self.__elements[element_id]
+            return True
+        return False
+
+def release_elements(element_ids):
+    '''
+    Releases everything held for the elements with the given ids (their listeners, the index
+    entries go with their document).  Called when the elements are discarded, e.g. when a
+    document is replaced.
+    '''
+    GLOBAL_DISPATCHER.release_targets(list(element_ids))
+
 class IdPopulatingProcessor(object):
+    '''
+    Gives every element a unique id and adds it to the element index.  Listeners are stored
+    by id so ids are unique across all processors (and therefore all parsers), not just within
+    a single document.
+    '''
     
-    def __init__(self):
-        self.counter = 0
+    #Processes every element
+    tags = None
+    
+    __counter = itertools.count()
         
     def __get_next_id(self):
-        result = self.counter
-        self.counter += 1
-        return result
+        return next(IdPopulatingProcessor.__counter)
         
     def process(self, element):
         element.set(Attributes.Id, str(self.__get_next_id()))
+        #Elements being parsed are always attached to their document's root
+        element.getroottree().getroot().get_element_index().add(element)
         
 def create_processors_list():
     return [IdPopulatingProcessor(), ContainerProcessor(), RamProcessor()]
 
 class Window(EventTarget):
     
+    #Listeners are stored by id so every window needs an id of its own, otherwise the listeners
+    #of one window (e.g. of a previous Bowser instance) would be heard by the others
+    __ids = itertools.count()
+
     def __init__(self):
         EventTarget.__init__(self)
         #Singleton pattern!
         RomElement.window = self
+        self.__id = "WINDOW-{0}".format(next(Window.__ids))
         self.__location = None
         self.__root_element = None
 
@@ -244,7 +607,16 @@ class Window(EventTarget):
         return None
     
     def get_id(self):
-        return "WINDOW"
+        return self.__id
+
+    def get_element_by_id(self, element_id):
+        '''
+        Returns the element of the current document with the given id (an int or the value of
+        the id attribute) or None if there is no such element
+        '''
+        if self.__root_element is None:
+            return None
+        return self.__root_element.get_element_index().get(int(element_id))
         
     @property
     def location(self):
@@ -264,7 +636,25 @@ class Window(EventTarget):
     def root_element(self, value):
         if self.__root_element is not None:
             self.__root_element.parent = None
+            self.__release_document(self.__root_element, value)
         self.__root_element = value
         self.__root_element.parent = self
+        GLOBAL_DISPATCHER.invalidate_propagation_paths()
         self.__root_element.focus()
 
+    @staticmethod
+    def __get_element_ids(root):
+        #Elements created outside of the parser (e.g. with etree.SubElement) may have no id
+        return set(element.get_id() for element in root.iter(tag=etree.Element)
+                   if element.get(Attributes.Id) is not None)
+
+    def __release_document(self, old_root, new_root):
+        '''
+        Releases the listeners of every element of the old document that is not part of the
+        new document.  Listeners are stored by element id so they would otherwise outlive the
+        elements they were registered on.
+        '''
+        released_ids = self.__get_element_ids(old_root)
+        released_ids.difference_update(self.__get_element_ids(new_root))
+        release_elements(released_ids)
+
@@ -0,0 +1,104 @@
+'''
+Recording and replaying of input sessions.  A session file is a JSON document per line.  The
+first line describes the session (the starting location) and every following line is a
+timestamped input event.
+'''
+import json
+import logging
+import time
+
+import pygame
+
+from bowser.custom_futures import Future
+
+class InputRecorder(object):
+    '''
+    Records the input stream handled by :class:`bowser.systems.key_and_frame.KeyAndFrameEngine`.
+
+    Only user input (key presses) is recorded.  Pygame user events are produced by bowser
+    itself (e.g. sound effects finishing) and will be produced again during a replay.
+    '''
+
+    def __init__(self, session_file):
+        self.__session_file = session_file
+        self.__started = None
+        self.logger = logging.getLogger(__name__)
+
+    def __write(self, record):
+        self.__session_file.write(json.dumps(record) + '\n')
+        self.__session_file.flush()
+
+    def start(self, location):
+        '''
+        Starts the session at the given location, event timestamps are relative to this call
+        '''
+        self.__started = time.time()
+        self.__write({'type': 'session', 'location': location, 'started': self.__started})
+
+    def record_key(self, key_code, modifiers):
+        if self.__started is None:
+            return
+        self.__write({'type': 'key', 'time': time.time() - self.__started, 'key': key_code, 'mod': modifiers})
+
+    def close(self):
+        self.__session_file.close()
+
+class InputReplayer(object):
+    '''
+    Feeds a recorded session back through the key and frame engine.  This should be added to
+    the loop as an engine and started at the same point the recording was (just after the
+    starting location is opened).  In real time mode events are replayed with their recorded timing,
+    otherwise every remaining event is replayed on the next frame.
+
+    finished
+        A :class:`bowser.custom_futures.Future` which is fulfilled once every event has been
+        replayed
+    '''
+
+    def __init__(self, session_file, key_and_frame, real_time=True):
+        self.__key_and_frame = key_and_frame
+        self.real_time = real_time
+        self.location = None
+        self.__events = []
+        self.__next_event = 0
+        self.__started = None
+        self.finished = Future()
+        self.logger = logging.getLogger(__name__)
+        self.__load(session_file)
+
+    def __load(self, session_file):
+        for line in session_file:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record['type'] == 'session':
+                self.location = record['location']
+            elif record['type'] == 'key':
+                self.__events.append(record)
+            else:
+                raise Exception("Unrecognized session record type: {0}".format(record['type']))
+        self.logger.info("Loaded session with %s events starting at %s", len(self.__events), self.location)
+
+    def __is_due(self, record, elapsed):
+        return not self.real_time or record['time'] <= elapsed
+
+    def start(self):
+        '''
+        Starts replaying, recorded timestamps are relative to this call
+        '''
+        self.__started = time.time()
+
+    def iterate(self):
+        if self.__started is None or self.finished.finished:
+            return
+        elapsed = time.time() - self.__started
+        due_events = []
+        while self.__next_event < len(self.__events) and self.__is_due(self.__events[self.__next_event], elapsed):
+            record = self.__events[self.__next_event]
+            #pylint: disable=no-member
+            due_events.append(pygame.event.Event(pygame.KEYUP, key=record['key'], mod=record['mod']))
+            self.__next_event += 1
+        if due_events:
+            self.__key_and_frame.inject_events(due_events)
+        if self.__next_event == len(self.__events):
+            self.finished.fulfill()
@@ -3,32 +3,204 @@ Created on Mar 25, 2015
 
 @author: Pace
 '''
-import pyttsx
+import hashlib
+import itertools
+import json
 import logging
 import os
+import tempfile
+import time
 import pygame
+from collections import OrderedDict, deque
 from threading import RLock
 from bowser.custom_futures import Future
-from bowser.systems.key_and_frame import PygameUserEvent
+from bowser.metrics import CacheMetrics
+from bowser.systems.key_and_frame import USER_EVENT_ROUTER
+from bowser.systems.streaming import StreamingChannel
+from bowser.systems.tts_process import ProcessTtsChannel
+from bowser.systems.speech import SynthesizingTtsChannel, EspeakSynthesizer, UtteranceCache,\
+    CachingSynthesizer
+
+def load_pygame_sound(path):
+    return pygame.mixer.Sound(file=path)
+
+class NullSound(object):
+    '''
+    Stands in for a pygame Sound when running headless.  Nothing is decoded, the sound simply
+    reports a fixed length.
+    '''
+    
+    DEFAULT_LENGTH = 0.25
+    
+    def __init__(self, path, length=DEFAULT_LENGTH):
+        self.path = path
+        self.length = length
+        
+    def get_length(self):
+        return self.length
+
+def get_sound_bytes(sound):
+    '''
+    Returns roughly how much memory the decoded audio of a sound takes up in the mixer's format,
+    0 if the mixer is not initialized
+    '''
+    mixer_settings = pygame.mixer.get_init()
+    if mixer_settings is None:
+        return 0
+    frequency, sample_format, channels = mixer_settings[:3]
+    return int(round(sound.get_length() * frequency)) * channels * (abs(sample_format) // 8)
+
+class DecodedEffectCache(object):
+    '''
+    Keeps the decoded audio of effects on disk as raw PCM in the mixer's format so that an
+    effect only has to be decoded the first time it is ever loaded.  Later loads read the PCM
+    file and hand it to pygame as is, skipping the decoder.  pygame copies the samples into a
+    Sound of its own, so a loaded effect takes as much memory as a decoded one, the cache only
+    saves decoding time.  Entries are keyed by a hash of the effect
+    file's contents and the mixer settings, a changed effect or a different mixer format simply
+    misses.
+
+    Use :meth:`load` as the sound_factory of a :class:`SoundLibrary`.  Hits and misses are
+    recorded in :attr:`metrics`.
+    '''
+
+    DISK = 'disk'
+    #: Where decoded effects are kept between runs unless told otherwise
+    DEFAULT_DIRECTORY = os.path.join(os.path.expanduser("~"), ".bowser", "effects")
+
+    def __init__(self, directory=DEFAULT_DIRECTORY):
+        self.directory = directory
+        self.metrics = CacheMetrics()
+        self.logger = logging.getLogger(__name__)
+
+    @staticmethod
+    def get_key(path, mixer_settings):
+        digest = hashlib.sha256()
+        with open(path, 'rb') as effect_file:
+            for block in iter(lambda: effect_file.read(64 * 1024), b''):
+                digest.update(block)
+        digest.update(json.dumps(list(mixer_settings)).encode('utf-8'))
+        return digest.hexdigest()
+
+    def __get_path(self, key):
+        return os.path.join(self.directory, key + ".pcm")
+
+    def load(self, path):
+        '''
+        Returns the effect at path as a pygame Sound, the mixer must be initialized
+        '''
+        cached_path = self.__get_path(DecodedEffectCache.get_key(path, pygame.mixer.get_init()))
+        sound = self.__read(cached_path)
+        if sound is not None:
+            self.metrics.record_hit(DecodedEffectCache.DISK)
+            return sound
+        self.metrics.record_miss()
+        sound = load_pygame_sound(path)
+        self.__write(cached_path, sound.get_raw())
+        return sound
+
+    def __read(self, cached_path):
+        try:
+            with open(cached_path, 'rb') as cached_file:
+                pcm = cached_file.read()
+        except OSError:
+            #Missing or unreadable
+            return None
+        if not pcm:
+            return None
+        return pygame.mixer.Sound(buffer=pcm)
+
+    def __write(self, cached_path, pcm):
+        #Written to a temporary file first so a partially written file is never read
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            handle, temporary_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        except OSError:
+            self.logger.exception("Could not cache decoded effect in %s", self.directory)
+            return
+        try:
+            with os.fdopen(handle, 'wb') as temporary_file:
+                temporary_file.write(pcm)
+            os.replace(temporary_path, cached_path)
+        except OSError:
+            self.logger.exception("Could not cache decoded effect in %s", cached_path)
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
 
 class SoundLibrary(object):
+    '''
+    The sound effects in a folder.  sound_factory turns a path into a sound, by default the
+    file is decoded into a pygame Sound (which requires the mixer to be initialized), see also
+    :class:`DecodedEffectCache`.
+
+    :meth:`load` only finds the effects, an effect is not loaded until it is first asked for.
+    Loaded effects are kept in memory, least recently used first, until they take up more than
+    max_memory_bytes (measured with sound_bytes).  Hits, misses and evictions are recorded in
+    :attr:`metrics`.
+    '''
+
+    MEMORY = 'memory'
+    DEFAULT_MAX_MEMORY_BYTES = 16 * 1024 * 1024
     
-    def __init__(self, folder):
+    def __init__(self, folder, sound_factory=load_pygame_sound, max_memory_bytes=DEFAULT_MAX_MEMORY_BYTES,
+                 sound_bytes=get_sound_bytes):
         self.__folder = folder
-        self.__sounds = {}
+        self.__sound_factory = sound_factory
+        self.__sound_bytes = sound_bytes
+        self.max_memory_bytes = max_memory_bytes
+        self.metrics = CacheMetrics()
+        self.__paths = {}
+        #name -> (sound, size), least recently used first
+        self.__sounds = OrderedDict()
+        self.__memory_bytes = 0
+        self.__lock = RLock()
         
     def load(self):
+        paths = {}
         for filename in os.listdir(self.__folder):
             if filename.endswith(".ogg"):
                 name = filename.rpartition('.')[0]
-                full_path = os.path.join(self.__folder, filename)
-                self.__sounds[name] = pygame.mixer.Sound(file=full_path)
+                paths[name] = os.path.join(self.__folder, filename)
+        with self.__lock:
+            self.__paths = paths
+
+    def get_memory_bytes(self):
+        with self.__lock:
+            return self.__memory_bytes
             
     def get_effect(self, name):
-        return self.__sounds[name]
+        with self.__lock:
+            entry = self.__sounds.get(name)
+            if entry is not None:
+                self.__sounds.move_to_end(name)
+                self.metrics.record_hit(SoundLibrary.MEMORY)
+                return entry[0]
+            path = self.__paths[name]
+            self.metrics.record_miss()
+            sound = self.__sound_factory(path)
+            size = self.__sound_bytes(sound)
+            self.__sounds[name] = (sound, size)
+            self.__memory_bytes += size
+            self.__evict(name)
+            return sound
+
+    def __evict(self, keep):
+        #A sound that is playing is kept alive by the mixer channel playing it
+        while self.__memory_bytes > self.max_memory_bytes and len(self.__sounds) > 1:
+            name = next(iter(self.__sounds))
+            if name == keep:
+                break
+            _, size = self.__sounds.pop(name)
+            self.__memory_bytes -= size
+            self.metrics.record_eviction(SoundLibrary.MEMORY)
     
+    def get_effect_names(self):
+        with self.__lock:
+            return list(self.__paths)
+
     def get_effects(self):
-        return self.__sounds.values()
+        return [self.get_effect(name) for name in self.get_effect_names()]
 
 class PygameEffectsChannel(object):
     '''
@@ -36,7 +208,9 @@ class PygameEffectsChannel(object):
     requests to play sound effects, background music, etc.  The input to the channel's
     queue method depends on the type of channel (str for tts, etc.)
     
-    This is a pgyame channel, it is used for sound effects
+    This is a pgyame channel, it is used for sound effects.  The channel's end events are
+    routed straight to the channel by user_event_router (see
+    :class:`bowser.systems.key_and_frame.UserEventRouter`).
     '''
     
     class QueuedEffect(object):
@@ -45,18 +219,21 @@ class PygameEffectsChannel(object):
             self.effect = effect
             self.future = future
     
-    def __init__(self, channel_id, event_bus):
+    def __init__(self, channel_id, user_event_router=USER_EVENT_ROUTER):
         self.__channel = None
         self.__channel_id = channel_id
-        self.__queue = []
+        self.__queue = deque()
         self.__playing = False
         self.__queued_to_pygame = 0
         self.__lock = RLock()
-        self.__event_bus = event_bus
-        self.__event_bus.add_event_listener(PygameUserEvent.name, self.__on_pygame_finish)
+        self.__user_event_router = user_event_router
+        self.__user_event_router.register(self.__get_event_code(), self.__on_pygame_finish)
         
-    def __del__(self):
-        self.__event_bus.remove_event_listener(PygameUserEvent.name, self.__on_pygame_finish)
+    def close(self):
+        '''
+        Stops routing the channel's end events to the channel
+        '''
+        self.__user_event_router.unregister(self.__get_event_code())
     
     def initialize(self):
         self.__channel = pygame.mixer.Channel(self.__channel_id)
@@ -66,7 +243,7 @@ class PygameEffectsChannel(object):
         return self.__queued_to_pygame < 2
     
     def __pop_and_finish(self):
-        finished = self.__queue.pop(0)
+        finished = self.__queue.popleft()
         if finished is not None:
             finished.future.fulfill()
     
@@ -74,16 +251,15 @@ class PygameEffectsChannel(object):
         #pylint: disable=no-member
         return pygame.USEREVENT + self.__channel_id
     
-    def __on_pygame_finish(self, event):
-        if event.event_code == self.__get_event_code():
-            with self.__lock:
-                self.__pop_and_finish()
-                #self.__queue[0] could be None if we have two sounds playing and get interrupted.
-                #In this case we will push two None events into the queue to swallow the two pygame callbacks.
-                #When swallowing the first callback self.__queue[0] will be None
-                self.__queued_to_pygame -= 1
-                if len(self.__queue) > 1 and self.__queue[0] is not None:
-                    self.__queue_to_pygame(self.__queue[0].effect)
+    def __on_pygame_finish(self, _):
+        with self.__lock:
+            self.__pop_and_finish()
+            #self.__queue[0] could be None if we have two sounds playing and get interrupted.
+            #In this case we will push two None events into the queue to swallow the two pygame callbacks.
+            #When swallowing the first callback self.__queue[0] will be None
+            self.__queued_to_pygame -= 1
+            if len(self.__queue) > 1 and self.__queue[0] is not None:
+                self.__queue_to_pygame(self.__queue[0].effect)
                 
     def __queue_to_pygame(self, effect):
         self.__channel.queue(effect)
@@ -92,7 +268,7 @@ class PygameEffectsChannel(object):
     def interrupt(self):
         with self.__lock:
             old_queue = self.__queue
-            self.__queue = []
+            self.__queue = deque()
             #If pygame is still playing then pygame will send a finish event when
             #we call stop, so we add a None to prevent that finish event from triggering the future
             for _ in range(self.__queued_to_pygame):
@@ -110,6 +286,196 @@ class PygameEffectsChannel(object):
                 self.__queue_to_pygame(effect)
             return future
 
+class PygameVoice(object):
+    '''
+    Plays one effect at a time on a pygame mixer channel, see :class:`EffectsMixer`.
+    '''
+
+    def __init__(self, channel_id, user_event_router=USER_EVENT_ROUTER):
+        self.channel_id = channel_id
+        self.__channel = None
+        self.__on_finished = None
+        #Stopping a playing channel still produces an end event, which must not finish the next effect
+        self.__stale_end_events = 0
+        self.__lock = RLock()
+        self.__user_event_router = user_event_router
+        self.__user_event_router.register(self.__get_event_code(), self.__on_pygame_finish)
+
+    def close(self):
+        self.__user_event_router.unregister(self.__get_event_code())
+
+    def __get_event_code(self):
+        #pylint: disable=no-member
+        return pygame.USEREVENT + self.channel_id
+
+    def initialize(self):
+        self.__channel = pygame.mixer.Channel(self.channel_id)
+        self.__channel.set_endevent(self.__get_event_code())
+
+    def play(self, effect, on_finished):
+        with self.__lock:
+            self.__on_finished = on_finished
+            self.__channel.play(effect)
+
+    def stop(self):
+        with self.__lock:
+            if self.__on_finished is not None:
+                self.__on_finished = None
+                self.__stale_end_events += 1
+                self.__channel.stop()
+
+    def __on_pygame_finish(self, _):
+        with self.__lock:
+            if self.__stale_end_events > 0:
+                self.__stale_end_events -= 1
+                return
+            on_finished = self.__on_finished
+            self.__on_finished = None
+        if on_finished is not None:
+            on_finished()
+
+    def _iterate(self):
+        pass
+
+class NullVoice(object):
+    '''
+    A voice for headless runs, see :class:`EffectsMixer`.  Effects are not played, they simply
+    take as long as the effect's length to finish.
+
+    clock
+        A callable returning the current time in seconds, defaults to time.time
+    '''
+
+    def __init__(self, clock=None):
+        self.clock = clock or time.time
+        self.__finishes_at = None
+        self.__on_finished = None
+
+    def close(self):
+        pass
+
+    def initialize(self):
+        pass
+
+    def play(self, effect, on_finished):
+        self.__finishes_at = self.clock() + effect.get_length()
+        self.__on_finished = on_finished
+
+    def stop(self):
+        self.__finishes_at = None
+        self.__on_finished = None
+
+    def _iterate(self):
+        if self.__finishes_at is not None and self.__finishes_at <= self.clock():
+            on_finished = self.__on_finished
+            self.stop()
+            on_finished()
+
+class EffectsMixer(object):
+    '''
+    Plays effects concurrently on a pool of voices (e.g. one :class:`PygameVoice` per mixer
+    channel).  Unlike a channel nothing is ever queued, an effect either starts playing right
+    away or not at all.
+
+    Each effect is played with a priority.  An idle voice is used if there is one, otherwise
+    the voice playing the effect with the lowest priority (the oldest such effect if there is
+    a tie) is stolen, provided that priority is no higher than the new effect's.  The future of
+    a stolen effect is cancelled, as is the future of an effect no voice could be found for.
+
+    steals
+        How many playing effects were cut off to make room for another
+    rejections
+        How many effects were not played because every voice was busy with a higher priority
+    '''
+
+    LOW_PRIORITY = 0
+    NORMAL_PRIORITY = 10
+    HIGH_PRIORITY = 20
+
+    class Voice(object):
+
+        def __init__(self, player):
+            self.player = player
+            self.future = None
+            self.priority = None
+            self.sequence = None
+
+    def __init__(self, players):
+        self.__voices = [EffectsMixer.Voice(player) for player in players]
+        self.__sequence = itertools.count()
+        self.__lock = RLock()
+        self.steals = 0
+        self.rejections = 0
+
+    def initialize(self):
+        for voice in self.__voices:
+            voice.player.initialize()
+
+    def close(self):
+        for voice in self.__voices:
+            voice.player.close()
+
+    def get_busy_voices(self):
+        with self.__lock:
+            return sum(1 for voice in self.__voices if voice.future is not None)
+
+    def __allocate(self, priority):
+        victim = None
+        for voice in self.__voices:
+            if voice.future is None:
+                return voice
+            if victim is None or (voice.priority, voice.sequence) < (victim.priority, victim.sequence):
+                victim = voice
+        if victim.priority > priority:
+            return None
+        return victim
+
+    def play(self, effect, priority=NORMAL_PRIORITY):
+        future = Future()
+        stolen = None
+        with self.__lock:
+            voice = self.__allocate(priority)
+            if voice is None:
+                self.rejections += 1
+            else:
+                if voice.future is not None:
+                    self.steals += 1
+                    stolen = voice.future
+                    voice.player.stop()
+                voice.future = future
+                voice.priority = priority
+                voice.sequence = next(self.__sequence)
+                voice.player.play(effect, lambda: self.__on_finished(voice, future))
+        if stolen is not None:
+            stolen.cancel()
+        if voice is None:
+            future.cancel()
+        return future
+
+    def __on_finished(self, voice, future):
+        with self.__lock:
+            if voice.future is future:
+                voice.future = None
+        future.fulfill()
+
+    def interrupt(self):
+        '''
+        Stops every playing effect
+        '''
+        stopped = []
+        with self.__lock:
+            for voice in self.__voices:
+                if voice.future is not None:
+                    stopped.append(voice.future)
+                    voice.future = None
+                    voice.player.stop()
+        for future in stopped:
+            future.cancel()
+
+    def _iterate(self):
+        for voice in self.__voices:
+            voice.player._iterate() #pylint: disable=protected-access
+
 class PyttsxChannel(object):
     '''
     A Channel is a linear sequence of audio.  Audio requests can be TTS requests,
@@ -118,13 +484,18 @@ class PyttsxChannel(object):
     
     This is a pyttsx channel, it is used for TTS and speaks strings
     '''
+
+    #: Whether :meth:`prefetch` does anything, so callers know whether to prepare text for it
+    supports_prefetch = False
     
     def __init__(self, name):
         self.name = name
         self.engine = None
         self.logger = logging.getLogger("{0}.{1}".format(__name__, name))
         self.__lock = RLock()
-        self.__futures = []
+        #Utterances are named so that their completion can be matched up with their future
+        self.__futures = {}
+        self.__utterance_names = itertools.count()
     
     def queue(self, text):
         '''
@@ -133,10 +504,18 @@ class PyttsxChannel(object):
         self.logger.debug("Queuing %s", text)
         future = Future()
         with self.__lock:
-            self.engine.say(text)
-            self.__futures.append(future)
+            utterance_name = str(next(self.__utterance_names))
+            self.__futures[utterance_name] = future
+            self.engine.say(text, utterance_name)
             return future
     
+    def prefetch(self, text):
+        '''
+        pyttsx can only speak text, not synthesize it ahead of time, so this does nothing.  See
+        :class:`bowser.systems.speech.SynthesizingTtsChannel`.
+        '''
+        pass
+
     def initialize(self):
         '''
         Initializes the channel.  A channel must be initialized before it can be
@@ -144,16 +523,23 @@ class PyttsxChannel(object):
         be calling the iterate function.
         '''
         self.logger.info("Channel initialized")
+        #pyttsx is imported here so that headless runs do not require it
+        import pyttsx
         self.engine = pyttsx.init(debug=True)
         self.engine.startLoop(useDriverLoop=False)
         self.engine.connect('finished-utterance', self.__on_utterance_finished)
     
     #pylint: disable=unused-argument
-    def __on_utterance_finished(self, completed, *args, **kwargs):
+    def __on_utterance_finished(self, name, completed, *args, **kwargs):
+        with self.__lock:
+            future = self.__futures.pop(name, None)
+        if future is None:
+            #An utterance stopped by an interrupt, its future has already been cancelled
+            return
         if completed:
-            self.__futures.pop().fulfill()
+            future.fulfill()
         else:
-            self.__futures.pop().cancel()
+            future.cancel()
     
     def interrupt(self):
         '''
@@ -162,8 +548,11 @@ class PyttsxChannel(object):
         '''
         with self.__lock:
             self.logger.debug("Channel interrupted")
+            old_futures = self.__futures
+            self.__futures = {}
             self.engine.stop()
-            self.__futures = []
+        for future in old_futures.values():
+            future.cancel()
         
     def _iterate(self):
         '''
@@ -172,23 +561,199 @@ class PyttsxChannel(object):
         '''
         self.engine.iterate()
 
+class _SimulatedChannel(object):
+    '''
+    Base class for the in-memory channels used when running headless.  Queued items are
+    "played" one after another, each taking as long as :meth:`_get_duration` says, and their
+    futures are completed from :meth:`_iterate`.
+    
+    clock
+        A callable returning the current time in seconds, defaults to time.time
+    '''
+    
+    class QueuedItem(object):
+        
+        def __init__(self, item, future):
+            self.item = item
+            self.future = future
+    
+    def __init__(self, clock=None):
+        self.clock = clock or time.time
+        self.__queue = []
+        self.__current_finishes_at = None
+        self.__lock = RLock()
+        
+    def initialize(self):
+        pass
+    
+    def _get_duration(self, item):
+        raise Exception("Override in child class")
+    
+    def __start_next(self, now):
+        if self.__queue:
+            self.__current_finishes_at = now + self._get_duration(self.__queue[0].item)
+        else:
+            self.__current_finishes_at = None
+    
+    def queue(self, item):
+        future = Future()
+        with self.__lock:
+            self.__queue.append(_SimulatedChannel.QueuedItem(item, future))
+            if self.__current_finishes_at is None:
+                self.__start_next(self.clock())
+        return future
+    
+    def interrupt(self):
+        with self.__lock:
+            old_queue = self.__queue
+            self.__queue = []
+            self.__current_finishes_at = None
+        for old_record in old_queue:
+            old_record.future.cancel()
+    
+    def _iterate(self):
+        finished = []
+        with self.__lock:
+            now = self.clock()
+            while self.__current_finishes_at is not None and self.__current_finishes_at <= now:
+                finished.append(self.__queue.pop(0))
+                self.__start_next(self.__current_finishes_at)
+        for record in finished:
+            record.future.fulfill()
+
+class NullEffectsChannel(_SimulatedChannel):
+    '''
+    An effects channel for headless runs.  Effects are not played, they simply take as long as
+    the effect's length to complete.
+    '''
+    
+    def __init__(self, clock=None):
+        _SimulatedChannel.__init__(self, clock)
+        
+    def _get_duration(self, effect):
+        return effect.get_length()
+
+class NullTtsChannel(_SimulatedChannel):
+    '''
+    A TTS channel for headless runs.  Nothing is spoken, every utterance is recorded (see
+    :attr:`utterances`) and takes as long as it would take to speak at words_per_minute.
+    Prefetched text is recorded in :attr:`prefetched`.
+    '''
+
+    supports_prefetch = True
+    
+    def __init__(self, name, words_per_minute=200, clock=None):
+        _SimulatedChannel.__init__(self, clock)
+        self.name = name
+        self.words_per_minute = words_per_minute
+        self.utterances = []
+        self.prefetched = []
+        self.logger = logging.getLogger("{0}.{1}".format(__name__, name))
+        
+    def queue(self, text):
+        self.logger.debug("Queuing %s", text)
+        self.utterances.append(text)
+        return _SimulatedChannel.queue(self, text)
+        
+    def prefetch(self, text):
+        '''
+        Records the text in :attr:`prefetched`, nothing needs preparing
+        '''
+        self.prefetched.append(text)
+        
+    def _get_duration(self, text):
+        return len(text.split()) * 60.0 / self.words_per_minute
+
+class NullStreamingChannel(_SimulatedChannel):
+    '''
+    A streaming channel for headless runs.  Nothing is downloaded or played, every queued
+    location is recorded (see :attr:`streamed`) and takes length seconds to "play".
+    '''
+
+    DEFAULT_LENGTH = 1.0
+
+    def __init__(self, name, length=DEFAULT_LENGTH, clock=None):
+        _SimulatedChannel.__init__(self, clock)
+        self.name = name
+        self.length = length
+        self.streamed = []
+
+    def queue(self, location):
+        self.streamed.append(location)
+        return _SimulatedChannel.queue(self, location)
+
+    def _get_duration(self, location):
+        return self.length
+
 class AudioSystem(object):
     '''
     The AudioSystem keeps tracks of a number of named channels.
+    
+    When headless is True the channels are replaced with in-memory channels which do not
+    require an audio device, pygame's mixer or a speech engine.  When speculative_tts is True
+    speech is synthesized to memory (with espeak) so that the speech of the likely next focus
+    targets can be synthesized ahead of time, see :class:`bowser.systems.speech.SynthesizingTtsChannel`.
+    The synthesized speech is cached (in memory and in utterance_cache_dir) and the cache is
+    available as :attr:`utterance_cache`.  Otherwise, when tts_process is True, the speech
+    engine runs in a worker process so it can never hold up the loop, see
+    :class:`bowser.systems.tts_process.ProcessTtsChannel`.
+
+    Besides the (serial) effects_channel there is an :class:`EffectsMixer`, effects_mixer, which
+    plays up to effects_voices effects at once.  The end events of the pygame channels are
+    routed to their owners by user_event_router, event_bus is no longer used for them.
+
+    Long audio (background music, clips) is played on stream_channel, which decodes it while
+    it plays instead of up front, see :class:`bowser.systems.streaming.StreamingChannel`.
     '''
         
-    def __init__(self, event_bus):
-        self.tts_channel = PyttsxChannel('main-tts')
-        self.effects_channel = PygameEffectsChannel(0, event_bus)
+    #: Where synthesized speech is cached between runs unless told otherwise
+    DEFAULT_UTTERANCE_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".bowser", "utterances")
+    #: Mixer channel 0 is the effects channel and 1 plays synthesized speech, the voices follow
+    FIRST_VOICE_CHANNEL_ID = 2
+    DEFAULT_EFFECTS_VOICES = 4
+
+    def __init__(self, event_bus, headless=False, speculative_tts=False, utterance_cache_dir=None,
+                 effects_voices=DEFAULT_EFFECTS_VOICES, user_event_router=USER_EVENT_ROUTER, tts_process=False):
+        self.event_bus = event_bus
+        self.headless = headless
+        self.utterance_cache = None
+        self.effects_voices = effects_voices
+        if headless:
+            self.tts_channel = NullTtsChannel('main-tts')
+            self.effects_channel = NullEffectsChannel()
+            self.effects_mixer = EffectsMixer([NullVoice() for _ in range(effects_voices)])
+            self.stream_channel = NullStreamingChannel('main-stream')
+        else:
+            self.tts_channel = self.__create_tts_channel(user_event_router, speculative_tts, utterance_cache_dir,
+                                                         tts_process)
+            self.effects_channel = PygameEffectsChannel(0, user_event_router)
+            self.effects_mixer = EffectsMixer([PygameVoice(AudioSystem.FIRST_VOICE_CHANNEL_ID + index, user_event_router)
+                                               for index in range(effects_voices)])
+            self.stream_channel = StreamingChannel('main-stream', user_event_router)
+
+    def __create_tts_channel(self, user_event_router, speculative_tts, utterance_cache_dir, tts_process):
+        if speculative_tts:
+            self.utterance_cache = UtteranceCache(directory=utterance_cache_dir or AudioSystem.DEFAULT_UTTERANCE_CACHE_DIR)
+            synthesizer = CachingSynthesizer(EspeakSynthesizer(), self.utterance_cache)
+            return SynthesizingTtsChannel('main-tts', synthesizer, PygameEffectsChannel(1, user_event_router))
+        if tts_process:
+            return ProcessTtsChannel('main-tts')
+        return PyttsxChannel('main-tts')
         
     def initialize(self):
         '''
         Initializes the AudioSystem.  This must be called on the same thread that calls
         the iterate function.
         '''
-        pygame.mixer.init(frequency=44100)
+        if not self.headless:
+            pygame.mixer.init(frequency=44100)
+            channels_needed = AudioSystem.FIRST_VOICE_CHANNEL_ID + self.effects_voices
+            if pygame.mixer.get_num_channels() < channels_needed:
+                pygame.mixer.set_num_channels(channels_needed)
         self.tts_channel.initialize()
         self.effects_channel.initialize()
+        self.effects_mixer.initialize()
+        self.stream_channel.initialize()
         
     def iterate(self):
         '''
@@ -197,4 +762,8 @@ class AudioSystem(object):
         '''
         #pylint: disable=protected-access
         self.tts_channel._iterate()
+        self.stream_channel._iterate()
+        if self.headless:
+            self.effects_channel._iterate()
+            self.effects_mixer._iterate()
                     
\ No newline at end of file
@@ -3,10 +3,13 @@ Created on Mar 25, 2015
 
 @author: Pace
 '''
-from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from threading import Lock
 import logging
 import time
 
+from bowser.metrics import DispatchMetrics
+
 
 class Event(object):
     '''
@@ -25,6 +28,9 @@ class Event(object):
         True if this event will be dispatched synchronously or False if dispatched asynchronously
     bubbles
         True if this event will bubble up, or False if it will only be emitted at the target
+    mergeable
+        True if a queued asynchronous event may be superseded by a later event with the same
+        :meth:`coalesce_key`
     event_phase
         The phase the event is currently in.
     '''
@@ -40,13 +46,14 @@ class Event(object):
     #: Events in this phase are bubbling up (moving up from target to window)
     BUBBLING_PHASE = 3
 
-    def __init__(self, event_type, synchronous=True, bubbles=True):
+    def __init__(self, event_type, synchronous=True, bubbles=True, mergeable=False):
         self.name = event_type
         self.target = None
         self.current_target = None
         self.timestamp = None
         self.synchronous = synchronous
         self.bubbles = bubbles
+        self.mergeable = mergeable
         self.event_phase = Event.NONE
         self.__immediate_propagate = True
         self.__propagate = True
@@ -63,6 +70,17 @@ class Event(object):
         '''
         return self.__immediate_propagate
 
+    def coalesce_key(self):
+        '''
+        Returns the key used to merge queued asynchronous events or None if this event cannot
+        be merged.  When a mergeable event is queued any pending event with the same key is
+        dropped.  By default events are merged with pending events of the same type on the
+        same target.
+        '''
+        if not self.mergeable:
+            return None
+        return (self.name, self.target.get_id())
+
     def stop_propagation(self):
         '''
         Stops propagation of the event, the event will not be dispatched on any other event targets
@@ -102,20 +120,161 @@ class EventDispatcher(object):
     If the event is set to bubble (bubbles=True) then a bubbling phase will occur.  The event
     will travel upwards, from the target to the top level window and listeners that have
     been registered with use_capture=False will be triggered.
+
+    Synchronous events are dispatched immediately on the calling thread.  Asynchronous events
+    are queued, in order, and dispatched by :meth:`iterate` which should be called once per
+    frame on the loop thread.  At most async_batch_size events are dispatched per call.
+
+    Dispatch timing can be recorded by calling :meth:`enable_metrics`.  While metrics are
+    disabled (the default) :attr:`metrics` is None and nothing is timed.
     '''
 
-    def __init__(self):
-        self.__async_executor = ThreadPoolExecutor(max_workers=10)
+    def __init__(self, async_batch_size=64):
+        self.async_batch_size = async_batch_size
+        self.__async_queue = _AsyncEventQueue()
+        self.metrics = None
         self.logger = logging.getLogger(__name__)
         self._listeners_map = {}
         self._capture_listeners_map = {}
+        self.__listener_index = {}
+        self.__capture_listener_index = {}
+        self.__propagation_paths = {}
+
+    @staticmethod
+    def __calculate_propagation_path(target):
+        path = []
+        ancestor = target.getparent()
+        while ancestor is not None:
+            path.append(ancestor)
+            ancestor = ancestor.getparent()
+        path.reverse()
+        return _PropagationPath(path)
+
+    def get_propagation_path(self, target):
+        '''
+        Returns the ancestors of target, ordered from the top level target (the window) down to
+        the parent of target.  This is the path an event dispatched at target travels through.
+
+        Paths are cached per target (by id) so they must be invalidated with
+        :meth:`invalidate_propagation_paths` whenever a subtree is attached, detached or moved.
+        '''
+        return self._get_propagation_path(target).targets
+
+    def _get_propagation_path(self, target):
+        target_id = target.get_id()
+        path = self.__propagation_paths.get(target_id)
+        if path is None:
+            path = self.__calculate_propagation_path(target)
+            self.__propagation_paths[target_id] = path
+        return path
+
+    def invalidate_propagation_paths(self):
+        '''
+        Discards all cached propagation paths.  This must be called whenever the shape of the
+        tree changes.
+        '''
+        self.__propagation_paths = {}
+
+    def enable_metrics(self, slow_listener_threshold=0.05):
+        '''
+        Starts recording per event and per phase latency, the time spent in each listener and
+        listener calls slower than slow_listener_threshold seconds.  Returns the
+        :class:`bowser.metrics.DispatchMetrics` the results are recorded in.
+        '''
+        if self.metrics is None:
+            self.metrics = DispatchMetrics(slow_listener_threshold)
+        else:
+            self.metrics.slow_listener_threshold = slow_listener_threshold
+        return self.metrics
+
+    def disable_metrics(self):
+        '''
+        Stops recording metrics and discards anything recorded so far
+        '''
+        self.metrics = None
+
+    def release_targets(self, target_ids):
+        '''
+        Discards every listener registered on the given targets.  This is used when a document
+        is replaced so that the listeners (and anything they reference) of elements that no
+        longer exist can be reclaimed.
+        '''
+        for target_id in target_ids:
+            self.__release_listeners(target_id, use_capture=False)
+            self.__release_listeners(target_id, use_capture=True)
+        self.invalidate_propagation_paths()
+
+    def __release_listeners(self, target_id, use_capture):
+        if use_capture:
+            target_listeners = self._capture_listeners_map.pop(target_id, None)
+        else:
+            target_listeners = self._listeners_map.pop(target_id, None)
+        if target_listeners:
+            for event_type in target_listeners:
+                self._unindex_listener(target_id, event_type, use_capture)
+
+    def __get_listener_index(self, use_capture):
+        if use_capture:
+            return self.__capture_listener_index
+        else:
+            return self.__listener_index
+
+    def _index_listener(self, target_id, event_type, use_capture):
+        '''
+        Records that target_id has at least one listener for event_type
+        '''
+        listener_index = self.__get_listener_index(use_capture)
+        if event_type not in listener_index:
+            listener_index[event_type] = set()
+        listener_index[event_type].add(target_id)
+
+    def _unindex_listener(self, target_id, event_type, use_capture):
+        '''
+        Records that target_id no longer has any listeners for event_type
+        '''
+        listener_index = self.__get_listener_index(use_capture)
+        target_ids = listener_index.get(event_type)
+        if target_ids is not None:
+            target_ids.discard(target_id)
+            if not target_ids:
+                del listener_index[event_type]
+
+    def _get_listeners(self, target_id, event_type, use_capture):
+        '''
+        Returns the listeners target_id has registered for event_type (or None if there are none)
+        '''
+        if use_capture:
+            listeners_map = self._capture_listeners_map
+        else:
+            listeners_map = self._listeners_map
+        target_listeners = listeners_map.get(target_id)
+        if target_listeners is None:
+            return None
+        return target_listeners.get(event_type)
+
+    def _get_interested_targets(self, path, event_type, use_capture):
+        '''
+        Returns the (target_id, target) pairs on path which have listeners for event_type, in
+        path order.  The cost depends on the smaller of the path length and the number of
+        targets listening for event_type.
+        '''
+        target_ids = self.__get_listener_index(use_capture).get(event_type)
+        if not target_ids:
+            return []
+        if len(target_ids) < len(path.ids):
+            positions = sorted(path.positions[target_id] for target_id in target_ids
+                               if target_id in path.positions)
+            return [(path.ids[position], path.targets[position]) for position in positions]
+        else:
+            return [(target_id, target) for target_id, target in zip(path.ids, path.targets)
+                    if target_id in target_ids]
 
     def __do_fire_event(self, event, target):
         '''
         Actually fires the event
         '''
         try:
-            _EventExecution(event, target).fire()
+            _EventExecution(self, event, target).fire()
         #pylint: disable=bare-except
         except:
             self.logger.exception("Error occurred dispatching event: %s", event)
@@ -127,66 +286,168 @@ class EventDispatcher(object):
         if event.synchronous:
             self.__do_fire_event(event, target)
         else:
-            self.__async_executor.submit(self.__do_fire_event, event, target)
+            self.__async_queue.put(event, target)
+
+    def iterate(self):
+        '''
+        Dispatches the next batch of queued asynchronous events.  Events queued while the batch
+        is being dispatched will wait for the next call.
+        '''
+        for queued_event in self.__async_queue.take(self.async_batch_size):
+            self.__do_fire_event(queued_event.event, queued_event.target)
+
+    def get_pending_event_count(self):
+        '''
+        Returns the number of asynchronous events waiting to be dispatched
+        '''
+        return len(self.__async_queue)
+
+    def discard_pending_events(self):
+        '''
+        Drops every queued asynchronous event without dispatching it (e.g. between tests, which
+        do not iterate the dispatcher the way the app loop does)
+        '''
+        self.__async_queue.clear()
+
+class _AsyncEventQueue(object):
+    '''
+    A thread safe FIFO of asynchronous events which coalesces mergeable events
+    '''
+
+    class QueuedEvent(object):
+
+        def __init__(self, event, target, coalesce_key):
+            self.event = event
+            self.target = target
+            self.coalesce_key = coalesce_key
+            self.superseded = False
+
+    #: How many superseded events may pile up (beyond the number of live events) before they are dropped
+    COMPACTION_SLACK = 64
+
+    def __init__(self):
+        self.__lock = Lock()
+        self.__pending = deque()
+        self.__mergeable = {}
+        self.__live_count = 0
+
+    def __len__(self):
+        return self.__live_count
+
+    def put(self, event, target):
+        queued_event = _AsyncEventQueue.QueuedEvent(event, target, event.coalesce_key())
+        with self.__lock:
+            if queued_event.coalesce_key is not None:
+                superseded = self.__mergeable.get(queued_event.coalesce_key)
+                if superseded is not None:
+                    superseded.superseded = True
+                    self.__live_count -= 1
+                self.__mergeable[queued_event.coalesce_key] = queued_event
+            self.__pending.append(queued_event)
+            self.__live_count += 1
+            if len(self.__pending) > 2 * self.__live_count + _AsyncEventQueue.COMPACTION_SLACK:
+                self.__compact()
+
+    def __compact(self):
+        '''
+        Drops superseded events so that a stream of mergeable events which is not being drained
+        (e.g. while nothing iterates the dispatcher) does not grow the queue
+        '''
+        self.__pending = deque(queued_event for queued_event in self.__pending if not queued_event.superseded)
+
+    def clear(self):
+        with self.__lock:
+            self.__pending.clear()
+            self.__mergeable.clear()
+            self.__live_count = 0
+
+    def take(self, max_events):
+        taken = []
+        with self.__lock:
+            while self.__pending and len(taken) < max_events:
+                queued_event = self.__pending.popleft()
+                if queued_event.superseded:
+                    continue
+                if queued_event.coalesce_key is not None:
+                    del self.__mergeable[queued_event.coalesce_key]
+                self.__live_count -= 1
+                taken.append(queued_event)
+        return taken
 
 GLOBAL_DISPATCHER = EventDispatcher()
-  
+
+class _PropagationPath(object):
+    '''
+    A cached propagation path along with the ids of the targets on it
+    '''
+
+    def __init__(self, targets):
+        self.targets = targets
+        self.ids = [target.get_id() for target in targets]
+        self.positions = dict((target_id, position) for position, target_id in enumerate(self.ids))
+
 class _EventExecution(object):
     '''
-    Command to execute an individual event
+    Command to execute an individual event.
+
+    Only targets that have registered listeners for the event's type are visited, the rest
+    of the propagation path is skipped entirely.
     '''
 
-    def __init__(self, event, target):
+    def __init__(self, dispatcher, event, target):
+        self.__dispatcher = dispatcher
         self.__event = event
         self.__target = target
-        self.__propagation_path = []
+        self.__target_id = target.get_id()
+        self.__propagation_path = dispatcher._get_propagation_path(target)
+        self.__metrics = dispatcher.metrics
         self.logger = logging.getLogger(__name__)
 
-    def __calculate_propagation_path(self):
-        path = []
-        target = self.__target.getparent()
-        while target is not None:
-            path.append(target)
-            target = target.getparent()
-        return list(reversed(path))
-
     def __fire_on_listeners(self, listeners):
         for listener in listeners:
-            listener(self.__event)
+            if self.__metrics is None:
+                listener(self.__event)
+            else:
+                started = time.perf_counter()
+                listener(self.__event)
+                self.__metrics.record_listener(listener, self.__event, time.perf_counter() - started)
             if not self.__event.should_propagate_immediately():
                 return
 
+    def __fire_timed_phase(self, phase_function, phase):
+        started = time.perf_counter()
+        phase_function()
+        self.__metrics.record_phase(self.__event.name, phase, time.perf_counter() - started)
+
+    def __fire_phase(self, phase_function, phase):
+        if self.__metrics is None:
+            phase_function()
+        else:
+            self.__fire_timed_phase(phase_function, phase)
+
     def __relocate_event(self, event_target):
         self.__event.current_target = event_target
 
-    def __get_capture_listeners(self, target):
-        if self.__event.name in target.capture_listeners:
-            return target.capture_listeners[self.__event.name]
-        else:
-            return []
-        
-    def __get_listeners(self, target):
-        if self.__event.name in target.listeners:
-            return target.listeners[self.__event.name]
-        else:
-            return []
+    def __fire_at(self, target_id, target, use_capture):
+        listeners = self.__dispatcher._get_listeners(target_id, self.__event.name, use_capture)
+        if listeners:
+            self.__relocate_event(target)
+            self.__fire_on_listeners(listeners)
 
     def __fire_target_phase(self):
         self.__relocate_event(self.__target)
-        listeners = self.__get_capture_listeners(self.__target)
-        self.__fire_on_listeners(listeners)
+        self.__fire_at(self.__target_id, self.__target, use_capture=True)
         if not self.__event.should_propagate():
             return
         self.__event.event_phase = Event.AT_TARGET
-        listeners = self.__get_listeners(self.__target)
-        self.__fire_on_listeners(listeners)
+        self.__fire_at(self.__target_id, self.__target, use_capture=False)
 
     def __fire_capture_phase(self):
         self.__event.event_phase = Event.CAPTURING_PHASE
-        for event_target in self.__propagation_path:
-            self.__relocate_event(event_target)
-            listeners = self.__get_capture_listeners(event_target)
-            self.__fire_on_listeners(listeners)
+        interested = self.__dispatcher._get_interested_targets(self.__propagation_path,
+                                                               self.__event.name, use_capture=True)
+        for target_id, event_target in interested:
+            self.__fire_at(target_id, event_target, use_capture=True)
             if not self.__event.should_propagate():
                 return
 
@@ -194,29 +455,61 @@ class _EventExecution(object):
         self.__event.event_phase = Event.BUBBLING_PHASE
         if not self.__event.bubbles:
             return
-        for event_target in reversed(self.__propagation_path):
-            self.__relocate_event(event_target)
-            listeners = self.__get_listeners(event_target)
-            self.__fire_on_listeners(listeners)
+        interested = self.__dispatcher._get_interested_targets(self.__propagation_path,
+                                                               self.__event.name, use_capture=False)
+        for target_id, event_target in reversed(interested):
+            self.__fire_at(target_id, event_target, use_capture=False)
             if not self.__event.should_propagate():
                 return
 
+    def __fire_phases(self):
+        self.__fire_phase(self.__fire_capture_phase, Event.CAPTURING_PHASE)
+        if not self.__event.should_propagate():
+            return
+        self.__fire_phase(self.__fire_target_phase, Event.AT_TARGET)
+        if not self.__event.should_propagate():
+            return
+        if self.__event.bubbles:
+            self.__fire_phase(self.__fire_bubbles_phase, Event.BUBBLING_PHASE)
+
     def fire(self):
         try:
             self.logger.debug("Firing event: %s at target %s", self.__event, self.__target)
             self.__event.timestamp = time.time()
-            self.__propagation_path = self.__calculate_propagation_path()
-            self.__fire_capture_phase()
-            if not self.__event.should_propagate():
-                return
-            self.__fire_target_phase()
-            if not self.__event.should_propagate():
-                return
-            self.__fire_bubbles_phase()
+            if self.__metrics is None:
+                self.__fire_phases()
+            else:
+                started = time.perf_counter()
+                self.__fire_phases()
+                self.__metrics.record_event(self.__event.name, time.perf_counter() - started)
         finally:
             self.__event.event_phase = Event.NONE
             self.__event.current_target = None
             
+class SubtreeModifiedEvent(Event):
+    '''
+    Dispatched on an element after its children have changed (elements were added, removed or
+    replaced) or after something else about its subtree which the systems index (e.g. whether
+    an element is focusable) has changed.  It bubbles so anything caching information about a
+    subtree hears about changes anywhere beneath it.
+    '''
+
+    name = 'subtree_modified'
+
+    def __init__(self):
+        Event.__init__(self, SubtreeModifiedEvent.name, synchronous=True, bubbles=True)
+
+class TextModifiedEvent(Event):
+    '''
+    Dispatched on an element after its text has been changed.  It bubbles so anything caching
+    the text of a subtree hears about changes anywhere beneath it.
+    '''
+
+    name = 'text_modified'
+
+    def __init__(self):
+        Event.__init__(self, TextModifiedEvent.name, synchronous=True, bubbles=True)
+
 class EventTarget(object):
     '''
     A base class for entities which wish to act as event targets.
@@ -262,6 +555,7 @@ class EventTarget(object):
         listener_map = self.__get_listeners_map(use_capture)
         if not listener_map[event_type]:
             del listener_map[event_type]
+            GLOBAL_DISPATCHER._unindex_listener(self.get_id(), event_type, use_capture)
 
     def add_event_listener(self, event_type, listener, use_capture=False):
         '''
@@ -278,6 +572,7 @@ class EventTarget(object):
             must be called twice
         '''
         self.__get_listeners_for_type(event_type, use_capture, initialize=True).append(listener)
+        GLOBAL_DISPATCHER._index_listener(self.get_id(), event_type, use_capture)
 
     def remove_event_listener(self, event_type, listener, use_capture=False):
         '''
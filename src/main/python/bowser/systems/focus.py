@@ -3,10 +3,14 @@ Created on Mar 25, 2015
 
 @author: Pace
 '''
-from bowser.systems.event import Event
+from bowser.systems.event import Event, SubtreeModifiedEvent
+from bowser.predicates import BoolAttributePredicate
 from bowser import Attributes
+from bisect import bisect_left
 import logging
 
+from lxml import etree
+
 FOCUSABLE_ATTR_NAME = "focusable"
 
 class FocusRequestEvent(Event):
@@ -20,8 +24,14 @@ class FocusRequestEvent(Event):
     
     name = 'focus_request'
     
-    def __init__(self):
-        Event.__init__(self, FocusRequestEvent.name, synchronous=True, bubbles=True)
+    def __init__(self, synchronous=True):
+        Event.__init__(self, FocusRequestEvent.name, synchronous=synchronous, bubbles=True, mergeable=True)
+
+    def coalesce_key(self):
+        '''
+        A queued focus request is superseded by any later focus request, whatever its target
+        '''
+        return FocusRequestEvent.name
 
 class FocusEvent(Event):
     '''
@@ -40,23 +50,230 @@ class FocusEvent(Event):
     def __init__(self, name):
         Event.__init__(self, name, synchronous=True, bubbles=True)
 
+class FocusPredictionEvent(Event):
+    '''
+    Dispatched (asynchronously) after the focus moves, naming the elements that are likely to
+    be focused next.  Systems may use it to prepare for those elements ahead of time (e.g. the
+    rendering system synthesizes their speech).  Only the latest pending prediction is
+    delivered.
+
+    candidates
+        The likely next focus targets, most likely first
+    '''
+
+    name = 'focus_prediction'
+
+    def __init__(self, candidates):
+        Event.__init__(self, FocusPredictionEvent.name, synchronous=False, bubbles=True, mergeable=True)
+        self.candidates = candidates
+
+    def coalesce_key(self):
+        return FocusPredictionEvent.name
+
+class FocusIndex(object):
+    '''
+    The focusable elements of a document in document order.  Every element's subtree is a
+    contiguous range of document positions so the first focusable element in a subtree is found
+    by binary search.  The nearest focusable ancestor of every element is recorded as well.
+
+    Positions are spread out (see :attr:`POSITION_GAP`) so that when a subtree is modified only
+    that subtree is re-indexed, within the range of positions it already owns (see
+    :meth:`update`).  A subtree which has outgrown its range is re-indexed within the range of
+    its parent instead, and so on up to the root.
+
+    root
+        The root of the indexed document
+    '''
+
+    #: The distance between the positions of consecutive elements when a range is numbered
+    POSITION_GAP = 1 << 20
+
+    def __init__(self, root, is_focusable):
+        self.root = root
+        self.__is_focusable = is_focusable
+        self.__positions = {}
+        self.__subtree_ends = {}
+        self.__focusable_ancestors = {}
+        #Every indexed position in order and the id of the element at each
+        self.__ordered_positions = []
+        self.__ordered_ids = []
+        self.__focusable_positions = []
+        self.__focusable_elements = []
+        self.__build()
+
+    def __build(self):
+        self.__positions.clear()
+        self.__subtree_ends.clear()
+        self.__focusable_ancestors.clear()
+        size = sum(1 for _ in self.root.iter(tag=etree.Element))
+        self.__ordered_positions, self.__ordered_ids, self.__focusable_positions, self.__focusable_elements, _ = \
+            self.__walk(self.root, 0, size * FocusIndex.POSITION_GAP, FocusIndex.POSITION_GAP, None)
+
+    def __walk(self, subtree_root, start, end, step, focusable_ancestor):
+        '''
+        Numbers the subtree, step apart from start, and records its elements.  Returns the
+        positions and ids, the focusable positions and elements (all in document order) and the
+        old positions of elements which were already indexed elsewhere.
+        '''
+        ordered_positions, ordered_ids, focusable_positions, focusable_elements = [], [], [], []
+        moved_positions = []
+        position = start
+        #The focusable ancestors of the current element, nearest last
+        focusable_stack = [focusable_ancestor]
+        for event, element in etree.iterwalk(subtree_root, events=('start', 'end'), tag=etree.Element):
+            element_id = element.get_id()
+            if event == 'start':
+                if element_id in self.__positions:
+                    moved_positions.append(self.__positions[element_id])
+                self.__positions[element_id] = position
+                self.__focusable_ancestors[element_id] = focusable_stack[-1]
+                ordered_positions.append(position)
+                ordered_ids.append(element_id)
+                if self.__is_focusable(element):
+                    focusable_positions.append(position)
+                    focusable_elements.append(element)
+                    focusable_stack.append(element)
+                position += step
+            else:
+                self.__subtree_ends[element_id] = position
+                if focusable_stack[-1] is element:
+                    focusable_stack.pop()
+        #The subtree keeps all of its range, it can grow into the positions it does not use yet
+        self.__subtree_ends[subtree_root.get_id()] = end
+        return ordered_positions, ordered_ids, focusable_positions, focusable_elements, moved_positions
+
+    def __len__(self):
+        return len(self.__focusable_elements)
+
+    def contains(self, element):
+        return element.get_id() in self.__positions
+
+    def update(self, modified_elements):
+        '''
+        Re-indexes the subtrees of modified_elements (elements whose children or focusability
+        have changed).  A subtree is only re-indexed once even if several elements within it
+        were modified.
+        '''
+        modified_elements = set(modified_elements)
+        for element in modified_elements:
+            ancestors = list(element.iterancestors())
+            if (ancestors[-1] if ancestors else element) is not self.root:
+                self.__on_detached_modified(element)
+            elif not any(ancestor in modified_elements for ancestor in ancestors):
+                #An element added since the last update is indexed along with its parent
+                while not self.contains(element):
+                    element = ancestors.pop(0)
+                self.__reindex(element)
+
+    def __on_detached_modified(self, element):
+        #Usually a tree being put together before it is added, but elements may have been moved
+        #out of the document into it
+        if any(self.contains(descendant) for descendant in element.iter(tag=etree.Element)):
+            self.__build()
+
+    def __reindex(self, subtree_root):
+        subtree_root_id = subtree_root.get_id()
+        start = self.__positions[subtree_root_id]
+        end = self.__subtree_ends[subtree_root_id]
+        size = sum(1 for _ in subtree_root.iter(tag=etree.Element))
+        step = min((end - start) // size, FocusIndex.POSITION_GAP)
+        if step < 1:
+            #Outgrown its range
+            if subtree_root is self.root:
+                self.__build()
+            else:
+                self.__reindex(next(subtree_root.iterancestors()))
+            return
+        focusable_ancestor = self.__focusable_ancestors[subtree_root_id]
+        self.__forget_range(start, end)
+        ordered_positions, ordered_ids, focusable_positions, focusable_elements, moved_positions = \
+            self.__walk(subtree_root, start, end, step, focusable_ancestor)
+        for moved_position in moved_positions:
+            self.__forget_range(moved_position, moved_position + 1, forget_ids=False)
+        index = bisect_left(self.__ordered_positions, start)
+        self.__ordered_positions[index:index] = ordered_positions
+        self.__ordered_ids[index:index] = ordered_ids
+        index = bisect_left(self.__focusable_positions, start)
+        self.__focusable_positions[index:index] = focusable_positions
+        self.__focusable_elements[index:index] = focusable_elements
+
+    def __forget_range(self, start, end, forget_ids=True):
+        low = bisect_left(self.__ordered_positions, start)
+        high = bisect_left(self.__ordered_positions, end)
+        if forget_ids:
+            for element_id in self.__ordered_ids[low:high]:
+                del self.__positions[element_id]
+                del self.__subtree_ends[element_id]
+                del self.__focusable_ancestors[element_id]
+        del self.__ordered_positions[low:high]
+        del self.__ordered_ids[low:high]
+        low = bisect_left(self.__focusable_positions, start)
+        high = bisect_left(self.__focusable_positions, end)
+        del self.__focusable_positions[low:high]
+        del self.__focusable_elements[low:high]
+
+    def find_first_focusable(self, element):
+        '''
+        Returns the first focusable element (in document order) in the subtree rooted at element
+        or, if there is none, element's nearest focusable ancestor
+        '''
+        element_id = element.get_id()
+        index = bisect_left(self.__focusable_positions, self.__positions[element_id])
+        if index < len(self.__focusable_positions) and \
+                self.__focusable_positions[index] < self.__subtree_ends[element_id]:
+            return self.__focusable_elements[index]
+        return self.__focusable_ancestors[element_id]
+
 class FocusSystem(object):
+    '''
+    Moves the focus in response to focus requests.  The focus goes to the first focusable
+    element in the requesting element's subtree, or failing that to its nearest focusable
+    ancestor.
+
+    Requests for elements of the window's document are resolved with a :class:`FocusIndex`.
+    The index is rebuilt when the document is replaced.  When the document is modified the
+    modified elements are noted and their subtrees re-indexed by the next focus request.
+    '''
     
     def __init__(self, focus_tree_root):
         self.logger = logging.getLogger(__name__)
         self.currently_focused = None
+        self.focus_tree_root = focus_tree_root
+        self.__focus_index = None
+        #Elements modified since the focus index was last updated
+        self.__modified_elements = set()
         focus_tree_root.add_event_listener(FocusRequestEvent.name, self.__on_focus_requeseted)
+        focus_tree_root.add_event_listener(SubtreeModifiedEvent.name, self.__on_subtree_modified)
         
-    def __is_focusable(self, element):
-        return element.get_bool(Attributes.Focusable, default_value=True)
+    #Evaluated by lxml so searching for focusable elements happens in C
+    __is_focusable = BoolAttributePredicate(Attributes.Focusable, default_value=True)
+
+    def __on_subtree_modified(self, event):
+        if self.__focus_index is not None:
+            self.__modified_elements.add(event.target)
+
+    def __get_focus_index(self):
+        root = getattr(self.focus_tree_root, 'root_element', None)
+        if root is None:
+            return None
+        if self.__focus_index is None or self.__focus_index.root is not root:
+            self.__focus_index = FocusIndex(root, self.__is_focusable)
+        elif self.__modified_elements:
+            self.__focus_index.update(self.__modified_elements)
+        self.__modified_elements = set()
+        return self.__focus_index
         
     def __find_first_focusable_child(self, target):
-        return target.dfs(lambda node: self.__is_focusable(node))
+        return target.dfs(self.__is_focusable)
         
     def __find_first_focusable_parent(self, target):
-        return target.find_first_ancestor(lambda node: self.__is_focusable(node))
+        return target.find_first_ancestor(self.__is_focusable)
         
     def __find_first_focusable(self, target):
+        focus_index = self.__get_focus_index()
+        if focus_index is not None and focus_index.contains(target):
+            return focus_index.find_first_focusable(target)
+        #Not part of the displayed document (e.g. a detached element)
         if self.__is_focusable(target):
             return target
         result = self.__find_first_focusable_child(target)
@@ -3,11 +3,17 @@ Created on Apr 6, 2015
 
 @author: Pace
 '''
+from collections import OrderedDict
 from concurrent.futures.thread import ThreadPoolExecutor
-from threading import RLock
+from contextlib import contextmanager
+from threading import BoundedSemaphore, Lock, RLock
+import httplib2
 from httplib2 import Http
 import urllib
 import logging
+import time
+
+from bowser.metrics import HttpPoolMetrics
 
 class HttpRequest(object):
 
@@ -57,12 +63,178 @@ class HttpFuture(object):
             elif self.__status >= 400:
                 listener(self.__headers, self.__content)
 
+def _with_read_timeout(connection_type, read_timeout):
+    '''
+    Returns a subclass of an httplib2 connection type which connects with the connection's
+    timeout and then waits at most read_timeout seconds for each read
+    '''
+    def connect(self):
+        connection_type.connect(self)
+        self.sock.settimeout(read_timeout)
+    return type("ReadTimeout" + connection_type.__name__, (connection_type,), {'connect': connect})
+
+class _HostSlots(object):
+    '''
+    The connections of a :class:`HttpClientPool` to a single host
+
+    borrowers
+        How many requests hold, or are waiting for, one of the host's connections
+    idle
+        How many idle clients the pool keeps for the host
+    '''
+
+    def __init__(self, max_connections):
+        self.semaphore = BoundedSemaphore(max_connections)
+        self.borrowers = 0
+        self.idle = 0
+
+class HttpClientPool(object):
+    '''
+    A pool of httplib2 clients.  An httplib2 Http object is not thread safe and keeps a single
+    connection per host, so each request borrows a client of its own, one which last talked to
+    the same host (and so may still have a kept alive connection to it) if there is one.
+
+    At most max_connections_per_host requests run against a single host and at most
+    max_connections in total, further requests wait for a client to be returned.  No more than
+    max_connections idle clients are kept, the least recently used are closed first.
+
+    The bookkeeping for a host is dropped once it has no requests in flight and no idle clients
+    so a pool talking to many different hosts does not grow without bound.
+
+    New connections time out after connect_timeout seconds, reads after read_timeout seconds.
+    How often connections are reused and how long requests wait for a client is recorded in
+    :attr:`metrics`.
+    '''
+
+    def __init__(self, max_connections_per_host=4, max_connections=10, connect_timeout=10, read_timeout=30):
+        self.max_connections_per_host = max_connections_per_host
+        self.max_connections = max_connections
+        self.connect_timeout = connect_timeout
+        self.metrics = HttpPoolMetrics()
+        self.__connection_types = {
+            'http': _with_read_timeout(httplib2.HTTPConnectionWithTimeout, read_timeout),
+            'https': _with_read_timeout(httplib2.HTTPSConnectionWithTimeout, read_timeout)
+        }
+        self.__lock = Lock()
+        self.__connection_slots = BoundedSemaphore(max_connections)
+        self.__host_slots = {}
+        #(host, client) -> client, least recently used first
+        self.__idle = OrderedDict()
+
+    @staticmethod
+    def get_host_key(uri):
+        '''
+        Returns the key httplib2 files the connection for uri under
+        '''
+        scheme, authority, _, _ = httplib2.urlnorm(uri)
+        return scheme + ":" + authority
+
+    def get_host_count(self):
+        '''
+        Returns the number of hosts with requests in flight or idle clients
+        '''
+        with self.__lock:
+            return len(self.__host_slots)
+
+    def __join_host(self, host):
+        with self.__lock:
+            host_slots = self.__host_slots.get(host)
+            if host_slots is None:
+                host_slots = _HostSlots(self.max_connections_per_host)
+                self.__host_slots[host] = host_slots
+            host_slots.borrowers += 1
+            return host_slots
+
+    def __leave_host(self, host, host_slots):
+        with self.__lock:
+            host_slots.borrowers -= 1
+            self.__prune_host(host, host_slots)
+
+    def __prune_host(self, host, host_slots):
+        #Called with the lock held
+        if host_slots.borrowers == 0 and host_slots.idle == 0:
+            del self.__host_slots[host]
+
+    def __take_idle_client(self, host):
+        with self.__lock:
+            for key in reversed(self.__idle):
+                if key[0] == host:
+                    self.__host_slots[host].idle -= 1
+                    return self.__idle.pop(key)
+        return Http(timeout=self.connect_timeout)
+
+    def __return_client(self, host, client):
+        with self.__lock:
+            self.__idle[(host, client)] = client
+            self.__host_slots[host].idle += 1
+            evicted = []
+            while len(self.__idle) > self.max_connections:
+                evicted.append(self.__idle.popitem(last=False))
+            self.__forget_idle(evicted)
+        for _, evicted_client in evicted:
+            evicted_client.close()
+
+    def __forget_idle(self, idle_items):
+        #Called with the lock held
+        for (evicted_host, _), _ in idle_items:
+            host_slots = self.__host_slots[evicted_host]
+            host_slots.idle -= 1
+            self.__prune_host(evicted_host, host_slots)
+
+    @contextmanager
+    def borrow_client(self, host):
+        '''
+        Waits for a free connection to host and lends out a client for it
+        '''
+        started = time.time()
+        host_slots = self.__join_host(host)
+        try:
+            #Waiting for the host first means a busy host never ties up a slot other hosts could use
+            with host_slots.semaphore:
+                with self.__connection_slots:
+                    self.metrics.record_wait(time.time() - started)
+                    client = self.__take_idle_client(host)
+                    #pylint: disable=bare-except
+                    try:
+                        yield client
+                    except:
+                        #The connection may be half way through a response, it cannot be reused
+                        client.close()
+                        raise
+                    self.__return_client(host, client)
+        finally:
+            self.__leave_host(host, host_slots)
+
+    def request(self, uri, method='GET', body=None, headers=None):
+        '''
+        Makes a request on a pooled client, returning httplib2's (response, content)
+        '''
+        host = HttpClientPool.get_host_key(uri)
+        scheme = host.partition(':')[0]
+        with self.borrow_client(host) as client:
+            connection = client.connections.get(host)
+            self.metrics.record_request(connection is not None and connection.sock is not None)
+            return client.request(uri, method, body, headers, connection_type=self.__connection_types.get(scheme))
+
+    def close(self):
+        with self.__lock:
+            idle = list(self.__idle.items())
+            self.__idle.clear()
+            self.__forget_idle(idle)
+        for _, client in idle:
+            client.close()
+
 class HttpService(object):
+    '''
+    Makes HTTP requests on a pool of threads.  Requests are made with pooled clients (see
+    :class:`HttpClientPool`) so concurrent requests, even to the same host, never share a
+    client and connections are kept alive between requests.
+    '''
     
-    def __init__(self):
-        self.__async_executor = ThreadPoolExecutor(max_workers=10)
+    def __init__(self, max_connections_per_host=4, max_connections=10, connect_timeout=10, read_timeout=30):
+        self.__async_executor = ThreadPoolExecutor(max_workers=max_connections)
         self.logger = logging.getLogger(__name__)
-        self.__http = Http()
+        self.pool = HttpClientPool(max_connections_per_host, max_connections, connect_timeout, read_timeout)
     
     def get(self, request):
         return self.make_request(request, 'GET')
@@ -84,7 +256,7 @@ class HttpService(object):
     def __do_request(self, request, method, future):
         try:
             uri = request.url + urllib.parse.urlencode(request.parameters)
-            headers, content = self.__http.request(uri, method, request.data, request.headers)
+            headers, content = self.pool.request(uri, method, request.data, request.headers)
             future.fulfill(headers, content)
         except Exception as ex:
             self.logger.exception("Http __do_request attempt failed with exception")
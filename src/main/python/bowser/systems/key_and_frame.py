@@ -5,6 +5,8 @@ Created on Mar 29, 2015
 '''
 import logging
 import string
+from collections import deque
+from threading import Lock
 
 import pygame
 
@@ -46,17 +48,34 @@ class KeyCombo(object):
         return event.key_code == self.__key
 
 class LinearNavigationController(object):
+    '''
+    Translates key presses into navigation of a list of items.  Besides moving forwards and
+    backwards one item at a time the first and last items can be jumped to (home/end) and the
+    list can be moved through a page at a time (page down/page up).
+    '''
     
     def __init__(self, navigable_object, forward_key, backward_key):
         self.__target = navigable_object
         self.forward_key = forward_key
         self.backward_key = backward_key
+        self.first_key = KeyCombo("HOME")
+        self.last_key = KeyCombo("END")
+        self.page_forward_key = KeyCombo("PAGEDOWN")
+        self.page_backward_key = KeyCombo("PAGEUP")
         
     def on_key(self, event):
         if self.forward_key.matches(event):
             self.__target.navigate_forwards(event.current_target)
         elif self.backward_key.matches(event):
             self.__target.navigate_backwards(event.current_target)
+        elif self.first_key.matches(event):
+            self.__target.navigate_first(event.current_target)
+        elif self.last_key.matches(event):
+            self.__target.navigate_last(event.current_target)
+        elif self.page_forward_key.matches(event):
+            self.__target.page_forwards(event.current_target)
+        elif self.page_backward_key.matches(event):
+            self.__target.page_backwards(event.current_target)
 
 class NavigationTheme(object):
     
@@ -91,38 +110,129 @@ class PygameUserEvent(Event):
     
     name = 'pygame_user'
     
-    def __init__(self, event_code):
-        Event.__init__(self, PygameUserEvent.name, synchronous=True, bubbles=True)
+    def __init__(self, event_code, synchronous=True, mergeable=False):
+        Event.__init__(self, PygameUserEvent.name, synchronous=synchronous, bubbles=True, mergeable=mergeable)
         self.event_code = event_code
 
+    def coalesce_key(self):
+        '''
+        Mergeable pygame user events are merged with pending events carrying the same code
+        '''
+        if not self.mergeable:
+            return None
+        return (PygameUserEvent.name, self.event_code)
+
+class UserEventRouter(object):
+    '''
+    Maps pygame user event codes (e.g. a mixer channel's end event) to the handler which owns
+    the code.  :class:`KeyAndFrameEngine` calls the handler directly (with the event code) on
+    the loop thread instead of dispatching a :class:`PygameUserEvent` through the DOM, which
+    every interested listener would have to filter.  Codes without a handler are still
+    dispatched as a PygameUserEvent.
+    '''
+
+    def __init__(self):
+        self.__handlers = {}
+        self.__lock = Lock()
+
+    def register(self, event_code, handler):
+        with self.__lock:
+            if event_code in self.__handlers:
+                raise Exception("The user event code {0} is already registered".format(event_code))
+            self.__handlers[event_code] = handler
+
+    def unregister(self, event_code):
+        with self.__lock:
+            self.__handlers.pop(event_code, None)
+
+    def get_handler(self, event_code):
+        return self.__handlers.get(event_code)
+
+#The router used by the audio channels and the engine unless told otherwise
+USER_EVENT_ROUTER = UserEventRouter()
+
+class PygameDisplay(object):
+    '''
+    The display backend used normally.  Opens a (tiny) pygame window, which pygame requires in
+    order to deliver keyboard events.
+    '''
+
+    def initialize(self):
+        pygame.display.init()
+        pygame.display.set_mode((100, 100))
+
+    def flip(self):
+        pygame.display.flip()
+
+    def get_events(self):
+        return pygame.event.get()
+
+class NullDisplay(object):
+    '''
+    A display backend for headless runs.  Nothing is opened and no events are produced, input
+    must be injected (see :meth:`KeyAndFrameEngine.inject_events`).
+    '''
+
+    def initialize(self):
+        pass
+
+    def flip(self):
+        pass
+
+    def get_events(self):
+        return []
+
 class KeyAndFrameEngine(object):
 
-    def __init__(self, focus_system, global_event_bus):
+    def __init__(self, focus_system, global_event_bus, display=None, user_event_router=USER_EVENT_ROUTER):
         self.focus_system = focus_system
         self.global_event_bus = global_event_bus
+        self.user_event_router = user_event_router
+        self.display = display or PygameDisplay()
+        self.input_recorder = None
+        self.__injected_events = deque()
         self.logger = logging.getLogger(__name__)
 
     def __del__(self):
         pygame.quit()
 
     def initialize(self):
-        pygame.display.init()
-        pygame.display.set_mode((100, 100))
+        self.display.initialize()
+
+    def inject_events(self, events):
+        '''
+        Queues pygame events (e.g. from a replayed session) to be processed on the next frame,
+        ahead of any events coming from pygame itself.  This may be called from any thread.
+        '''
+        self.__injected_events.extend(events)
+
+    def __take_injected_events(self):
+        events = []
+        while self.__injected_events:
+            events.append(self.__injected_events.popleft())
+        return events
 
     def iterate(self):
-        pygame.display.flip()
-        events = pygame.event.get()
+        self.display.flip()
+        self.__process_events(self.__take_injected_events())
+        events = self.display.get_events()
         self.__process_events(events)
         
     def __process_events(self, events):
         for event in events:
             if event.type == pygame.KEYUP:
                 self.logger.debug("Key press: code=%s mod=%s", event.key, event.mod)
+                if self.input_recorder is not None:
+                    self.input_recorder.record_key(event.key, event.mod)
                 if self.focus_system is not None:
                     self.focus_system.currently_focused.dispatch_event(KeyEvent(event.key, event.mod))
             elif event.type >= pygame.USEREVENT:
                 self.logger.debug("User event: code=%s", event.type)
-                self.global_event_bus.dispatch_event(PygameUserEvent(event.type))
+                handler = self.user_event_router.get_handler(event.type)
+                if handler is not None:
+                    handler(event.type)
+                else:
+                    self.global_event_bus.dispatch_event(PygameUserEvent(event.type))
             elif event.type == pygame.QUIT:
                 import sys
                 sys.exit(0)
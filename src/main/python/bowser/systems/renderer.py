@@ -4,32 +4,255 @@ Created on Mar 25, 2015
 @author: Pace
 '''
 import logging
+import re
+import time
 
-from bowser.systems.focus import FocusEvent
+from lxml import etree
 
+from bowser.systems.event import SubtreeModifiedEvent, TextModifiedEvent
+from bowser.systems.focus import FocusEvent, FocusPredictionEvent
+from bowser.metrics import RenderMetrics
+
+#The text (as in element.text) of an element and each of its descendants in document order.  An
+#element's text is its first child node, if that is a text node.  Comments are skipped.
+_ELEMENT_TEXTS = etree.XPath("descendant-or-self::*/node()[1][self::text()]", smart_strings=False)
+
+#Whitespace following the end of a sentence
+_SENTENCE_BREAKS = re.compile(r"(?<=[.!?;])\s+")
+#Whitespace following the end of a phrase
+_PHRASE_BREAKS = re.compile(r"(?<=[,:])\s+")
+
+def _split_long_piece(piece, max_chunk_chars):
+    '''
+    Splits a sentence that does not fit in a chunk at phrase breaks and, if need be, between words
+    '''
+    chunks = []
+    for phrase in _PHRASE_BREAKS.split(piece):
+        while len(phrase) > max_chunk_chars:
+            cut = phrase.rfind(' ', 0, max_chunk_chars + 1)
+            if cut <= 0:
+                cut = max_chunk_chars
+            chunks.append(phrase[:cut].strip())
+            phrase = phrase[cut:].strip()
+        if phrase:
+            chunks.append(phrase)
+    return chunks
+
+def split_into_chunks(text, max_chunk_chars):
+    '''
+    Splits text into chunks of at most max_chunk_chars characters to be spoken one after
+    another.  The text is split between sentences where possible, then between phrases and
+    finally between words.  The first chunk is kept to a single sentence so that speech can
+    start as early as possible, later sentences are packed together.
+    '''
+    chunks = []
+    for sentence in _SENTENCE_BREAKS.split(' '.join(text.split())):
+        if not sentence:
+            continue
+        if len(sentence) > max_chunk_chars:
+            chunks.extend(_split_long_piece(sentence, max_chunk_chars))
+        elif len(chunks) > 1 and len(chunks[-1]) + 1 + len(sentence) <= max_chunk_chars:
+            chunks[-1] = chunks[-1] + ' ' + sentence
+        else:
+            chunks.append(sentence)
+    return chunks
+
+class _RenderedText(object):
+    '''
+    The cached rendering of an element, its chunks are only split when first needed
+    '''
+
+    def __init__(self, text):
+        self.text = text
+        self.chunks = None
 
 class RenderingSystem(object):
+    '''
+    Speaks the text of the subtree of whatever element gains focus.  The text of the elements
+    likely to be focused next (see :class:`FocusPredictionEvent`) is handed to the channel's
+    prefetch, if the channel supports prefetching (see its supports_prefetch attribute).
+
+    The text of every rendered element is cached until the text or the children of the element
+    (or of one of its descendants) change, so focusing the same element again does not walk
+    its subtree again.
+
+    The text is queued as a series of chunks (see :func:`split_into_chunks`) so that the
+    channel can start speaking the first chunk while the rest are prepared, and an interrupt
+    only discards chunks which have not been spoken.
+
+    When settle_interval is not None speech is debounced.  A focus change which follows the
+    previous one by less than settle_interval seconds (e.g. while an arrow key is held down)
+    is not spoken, the speech is interrupted and the focus effect from sound_library is played
+    on the effects mixer instead.  Once focus has stayed put for settle_interval seconds the
+    element focused last is spoken, this happens in :meth:`iterate`.  How many renders were spoken and how many were
+    suppressed is recorded in :attr:`metrics`.
+
+    max_render_chars
+        If not None then at most this many characters are rendered for a single focus, the text
+        is cut at the last word that fits
+    max_chunk_chars
+        The longest chunk of text queued at once
+    settle_interval
+        How long (in seconds) focus must stay put before it is spoken, None speaks every focus
+        change immediately
+    sound_library
+        Where the focus effect played for suppressed focus changes comes from, if None nothing
+        is played
+    clock
+        A callable returning the current time in seconds, defaults to time.time
+    '''
+
+    DEFAULT_MAX_CHUNK_CHARS = 200
+    #: The effect played for focus changes which are not spoken
+    FOCUS_EFFECT_NAME = 'chime'
     
-    def __init__(self, focus_tree_root, audio_system):
+    def __init__(self, focus_tree_root, audio_system, max_render_chars=None, max_chunk_chars=DEFAULT_MAX_CHUNK_CHARS,
+                 settle_interval=None, sound_library=None, clock=None):
         self.logger = logging.getLogger(__name__)
         focus_tree_root.add_event_listener(FocusEvent.focus_name, self.__on_focus)
+        focus_tree_root.add_event_listener(SubtreeModifiedEvent.name, self.__on_subtree_modified)
+        focus_tree_root.add_event_listener(TextModifiedEvent.name, self.__on_subtree_modified)
+        focus_tree_root.add_event_listener(FocusPredictionEvent.name, self.__on_focus_prediction)
         self.text_channel = audio_system.tts_channel
+        self.audio_system = audio_system
+        self.sound_library = sound_library
+        self.settle_interval = settle_interval
+        self.clock = clock or time.time
+        self.metrics = RenderMetrics()
+        self.__last_focus_time = None
+        #The most recently focused element while focus has not settled, it is spoken by iterate
+        self.__pending_target = None
+        #Keyed by element id, only holds elements of a single document (__cached_root's)
+        self.__text_cache = {}
+        self.__cached_root = None
+        self.__max_render_chars = max_render_chars
+        self.__max_chunk_chars = max_chunk_chars
+
+    @property
+    def max_chunk_chars(self):
+        return self.__max_chunk_chars
+
+    @max_chunk_chars.setter
+    def max_chunk_chars(self, value):
+        self.__max_chunk_chars = value
+        self.__text_cache.clear()
+
+    @property
+    def max_render_chars(self):
+        return self.__max_render_chars
+
+    @max_render_chars.setter
+    def max_render_chars(self, value):
+        self.__max_render_chars = value
+        self.__text_cache.clear()
         
-    def __add_texts_to_list(self, node, texts):
-        if node.text is not None:
-            texts.append(node.text)
-        
-    def __build_texts_to_render(self, target):
-        texts_to_render = []
-        target.dfs_do(self.__add_texts_to_list, texts_to_render)
-        return texts_to_render
+    def __build_text_to_render(self, target):
+        texts = _ELEMENT_TEXTS(target)
+        if self.max_render_chars is None:
+            return ' '.join(texts)
+        #Only join as much as can be rendered
+        length = 0
+        for count, text in enumerate(texts):
+            length += len(text) + 1
+            if length > self.max_render_chars:
+                return self.__truncate(' '.join(texts[:count + 1]))
+        return ' '.join(texts)
+
+    def __truncate(self, text):
+        if len(text) <= self.max_render_chars:
+            return text
+        truncated = text[:self.max_render_chars]
+        if not text[self.max_render_chars].isspace():
+            #Do not render half of a word
+            words = truncated.rsplit(None, 1)
+            if len(words) > 1:
+                truncated = words[0]
+        return truncated.rstrip()
+
+    def __get_rendered_text(self, target):
+        root = target.getroottree().getroot()
+        if root is not self.__cached_root:
+            #A new document, nothing cached for the old one is needed any more
+            self.__text_cache.clear()
+            self.__cached_root = root
+        target_id = target.get_id()
+        rendered_text = self.__text_cache.get(target_id)
+        if rendered_text is None:
+            rendered_text = _RenderedText(self.__build_text_to_render(target))
+            self.__text_cache[target_id] = rendered_text
+        return rendered_text
+
+    def get_text_to_render(self, target):
+        '''
+        Returns the text that focusing target renders
+        '''
+        return self.__get_rendered_text(target).text
+
+    def get_chunks_to_render(self, target):
+        '''
+        Returns the text that focusing target renders, split into the chunks that are queued
+        '''
+        rendered_text = self.__get_rendered_text(target)
+        if rendered_text.chunks is None:
+            rendered_text.chunks = split_into_chunks(rendered_text.text, self.max_chunk_chars)
+        return rendered_text.chunks
         
-    def __render(self, target):
+    def __render(self, target, settle_delay=None):
         self.logger.debug("Rendering target: %s", target)
         self.text_channel.interrupt()
-        text_to_render = ' '.join(self.__build_texts_to_render(target))
-        self.text_channel.queue(text_to_render)
+        for chunk in self.get_chunks_to_render(target):
+            self.text_channel.queue(chunk)
+        self.metrics.record_spoken(settle_delay)
+
+    def __suppress(self, target):
+        self.logger.debug("Focus has not settled, not rendering target: %s", target)
+        if self.__pending_target is not None:
+            self.metrics.record_suppressed()
+        self.__pending_target = target
+        self.text_channel.interrupt()
+        if self.sound_library is not None:
+            #Played on the mixer so that effects of quick focus changes overlap rather than queue up
+            self.audio_system.effects_mixer.play(self.sound_library.get_effect(RenderingSystem.FOCUS_EFFECT_NAME))
         
     def __on_focus(self, focus_event):
-        self.__render(focus_event.target)
-        
\ No newline at end of file
+        if self.settle_interval is None:
+            self.__render(focus_event.target)
+            return
+        now = self.clock()
+        settled = self.__last_focus_time is None or now - self.__last_focus_time >= self.settle_interval
+        self.__last_focus_time = now
+        if settled and self.__pending_target is None:
+            self.__render(focus_event.target)
+        else:
+            self.__suppress(focus_event.target)
+
+    def iterate(self):
+        '''
+        Speaks the element focused last once focus has settled.  This must be called regularly
+        when settle_interval is not None.
+        '''
+        if self.__pending_target is None:
+            return
+        settle_delay = self.clock() - self.__last_focus_time
+        if self.settle_interval is None or settle_delay >= self.settle_interval:
+            target = self.__pending_target
+            self.__pending_target = None
+            self.__render(target, settle_delay)
+
+    def __on_focus_prediction(self, prediction_event):
+        #Lets the channel prepare the speech of the likely next focus targets
+        if not getattr(self.text_channel, 'supports_prefetch', False):
+            #Rendering the candidates would be wasted work
+            return
+        for candidate in prediction_event.candidates:
+            #Only the first chunk delays the start of speech
+            chunks = self.get_chunks_to_render(candidate)
+            if chunks:
+                self.text_channel.prefetch(chunks[0])
+
+    def __on_subtree_modified(self, event):
+        if not self.__text_cache:
+            return
+        self.__text_cache.pop(event.target.get_id(), None)
+        for ancestor in event.target.iterancestors():
+            self.__text_cache.pop(ancestor.get_id(), None)
@@ -5,18 +5,45 @@ Created on Mar 29, 2015
 '''
 import logging
 import urllib
+from collections import OrderedDict
 
 from io import BytesIO
+from lxml import etree
+from threading import RLock
+from bowser import Attributes
 from bowser.rom import LocationChangedEvent
 from bowser.systems.http import HttpRequest
 from xml.sax import xmlreader
 
+class _StreamingLoad(object):
+    '''
+    A resource which is being parsed incrementally from a file like object
+    '''
+    
+    def __init__(self, source, incremental_parse):
+        self.source = source
+        self.parse = incremental_parse
+        self.published = False
+
 class ResourceLoader(object):
+    '''
+    Loads the resource at the window's location and makes it the window's root element.
     
-    def __init__(self, window, parser, http_service):
+    When incremental is True resources are parsed chunk_size bytes at a time.  The partially
+    parsed document is published as soon as it contains focusable content (so the user can
+    start navigating right away) and the rest of the document is parsed by :meth:`iterate`,
+    chunks_per_frame chunks per call.
+    '''
+    
+    def __init__(self, window, parser, http_service, incremental=False, chunk_size=16 * 1024, chunks_per_frame=4):
         self.__window = window
         self.__parser = parser
         self.__http_service = http_service
+        self.incremental = incremental
+        self.chunk_size = chunk_size
+        self.chunks_per_frame = chunks_per_frame
+        self.__streaming_load = None
+        self.__streaming_lock = RLock()
         self.__window.add_event_listener(LocationChangedEvent.name, self.__on_location_change)
         self.logger = logging.getLogger(__name__)
         
@@ -31,19 +58,98 @@ class ResourceLoader(object):
             element.initialize()
         
     def __initialize_resource(self, resource):
-        resource.dfs_do(self.__initialize_element)
+        for element in resource.iter(tag=etree.Element):
+            self.__initialize_element(element)
 
     def __on_resource_load(self, resource):
         self.__window.root_element = resource
         
+    @staticmethod
+    def __is_focusable(element):
+        return element.get_bool(Attributes.Focusable, default_value=True)
+        
+    def __start_streaming(self, source):
+        incremental_parse = self.__parser.parse_incrementally(self.__is_focusable)
+        with self.__streaming_lock:
+            if self.__streaming_load is not None:
+                self.__streaming_load.source.close()
+            self.__streaming_load = _StreamingLoad(source, incremental_parse)
+            #Parse synchronously until there is something to show the user, the rest of the
+            #document is parsed a frame at a time
+            while self.__streaming_load is not None and not self.__streaming_load.published:
+                self.__stream_chunk(self.__streaming_load)
+                
+    def __read_chunk(self, streaming_load):
+        chunk = streaming_load.source.read(self.chunk_size)
+        if chunk:
+            return streaming_load.parse.feed(chunk)
+        return streaming_load.parse.close()
+    
+    def __finish_streaming(self, streaming_load):
+        streaming_load.source.close()
+        if self.__streaming_load is streaming_load:
+            self.__streaming_load = None
+                
+    def __stream_chunk(self, streaming_load):
+        try:
+            new_elements = self.__read_chunk(streaming_load)
+        except:
+            self.__finish_streaming(streaming_load)
+            raise
+        if streaming_load.parse.finished:
+            self.__finish_streaming(streaming_load)
+        for element in new_elements:
+            self.__initialize_element(element)
+        if streaming_load.published:
+            self.__notify_parents(new_elements)
+        elif streaming_load.parse.ready:
+            streaming_load.published = True
+            self.__on_resource_load(streaming_load.parse.root)
+            
+    @staticmethod
+    def __notify_parents(new_elements):
+        '''
+        The parser adds to the published tree without going through RomElement so the elements
+        which gained children are notified here.  Parents which are new themselves can not have
+        cached anything about their children yet.
+        '''
+        new_ids = set(element.get_id() for element in new_elements)
+        parents = OrderedDict()
+        for element in new_elements:
+            parent = element.getparent()
+            if parent is not None and parent.get_id() not in new_ids:
+                parents[parent.get_id()] = parent
+        for parent in parents.values():
+            parent.notify_subtree_modified()
+
+    def iterate(self):
+        '''
+        Parses the next few chunks of a resource being loaded incrementally
+        '''
+        with self.__streaming_lock:
+            for _ in range(self.chunks_per_frame):
+                if self.__streaming_load is None:
+                    return
+                try:
+                    self.__stream_chunk(self.__streaming_load)
+                #pylint: disable=bare-except
+                except:
+                    self.logger.exception("Failed to parse resource, the rest of it has been dropped")
+        
     def __load_file_resource(self, url):
         #TODO: Asynchronous?
+        if self.incremental:
+            self.__start_streaming(open(url, 'rb'))
+            return
         resource_file = open(url)
         resource = self.__parser.parse(resource_file)
         self.__initialize_resource(resource)
         self.__on_resource_load(resource)
     
     def __on_http_load(self, headers, content):
+        if self.incremental:
+            self.__start_streaming(BytesIO(content))
+            return
         resource = self.__parser.parse(BytesIO(content))
         self.__initialize_resource(resource)
         self.__on_resource_load(resource)
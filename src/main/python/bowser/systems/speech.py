@@ -0,0 +1,514 @@
+'''
+Speech synthesis to memory.  Unlike :class:`bowser.systems.audio.PyttsxChannel`, which hands
+text to the speech engine at the moment it should be spoken, the channel in this module
+synthesizes audio ahead of time on a pool of worker threads and plays the resulting buffers.
+Audio for text which is likely to be spoken next can be synthesized speculatively (see
+:meth:`SynthesizingTtsChannel.prefetch`) so that it is ready by the time it is needed.
+'''
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from threading import RLock
+import hashlib
+import itertools
+import json
+import logging
+import os
+import subprocess
+import tempfile
+import time
+import wave
+
+import pygame
+
+from bowser.custom_futures import Future
+from bowser.metrics import SpeculationMetrics, CacheMetrics
+
+class Utterance(object):
+    '''
+    Synthesized speech held in memory as raw PCM
+
+    text
+        The text that was synthesized
+    pcm
+        The audio as signed little endian PCM frames
+    sample_rate
+        Frames per second
+    sample_width
+        Bytes per sample
+    channels
+        Samples per frame
+    '''
+
+    def __init__(self, text, pcm, sample_rate, sample_width=2, channels=1):
+        self.text = text
+        self.pcm = pcm
+        self.sample_rate = sample_rate
+        self.sample_width = sample_width
+        self.channels = channels
+
+    def get_length(self):
+        return len(self.pcm) / float(self.sample_rate * self.sample_width * self.channels)
+
+    def to_wav(self):
+        '''
+        Returns the utterance as the bytes of a WAV file
+        '''
+        wav_bytes = BytesIO()
+        wav_file = wave.open(wav_bytes, 'wb')
+        try:
+            wav_file.setnchannels(self.channels)
+            wav_file.setsampwidth(self.sample_width)
+            wav_file.setframerate(self.sample_rate)
+            wav_file.writeframes(self.pcm)
+        finally:
+            wav_file.close()
+        return wav_bytes.getvalue()
+
+    @staticmethod
+    def from_wav(text, wav_bytes):
+        wav_file = wave.open(BytesIO(wav_bytes), 'rb')
+        try:
+            pcm = wav_file.readframes(wav_file.getnframes())
+            return Utterance(text, pcm, wav_file.getframerate(), wav_file.getsampwidth(), wav_file.getnchannels())
+        finally:
+            wav_file.close()
+
+def load_pygame_utterance(utterance):
+    '''
+    Turns an utterance into a pygame Sound (converted to the mixer's format by pygame)
+    '''
+    return pygame.mixer.Sound(file=BytesIO(utterance.to_wav()))
+
+class EspeakSynthesizer(object):
+    '''
+    Synthesizes speech with the espeak command line program (the engine pyttsx drives on
+    Linux).  Synthesis is thread safe, every call runs its own espeak process.
+
+    voice
+        The espeak voice name
+    words_per_minute
+        The speaking rate
+    '''
+
+    def __init__(self, voice="en", words_per_minute=175, executable="espeak"):
+        self.voice = voice
+        self.words_per_minute = words_per_minute
+        self.executable = executable
+
+    def get_parameters(self):
+        '''
+        Everything besides the text which affects the synthesized audio
+        '''
+        return {'engine': 'espeak', 'executable': self.executable, 'voice': self.voice,
+                'words_per_minute': self.words_per_minute}
+
+    def synthesize(self, text):
+        #The text is passed on stdin so text starting with '-' is not taken for an option
+        command = [self.executable, "--stdout", "--stdin", "-v", self.voice, "-s", str(self.words_per_minute)]
+        try:
+            process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except OSError:
+            raise Exception("Could not run {0}, is espeak installed?".format(self.executable))
+        wav_bytes, error = process.communicate(text.encode('utf-8'))
+        if process.returncode != 0:
+            raise Exception("espeak failed with code {0}: {1}".format(process.returncode, error))
+        return Utterance.from_wav(text, wav_bytes)
+
+class NullSynthesizer(object):
+    '''
+    A synthesizer for headless runs and tests.  Produces silence as long as the text would take
+    to speak at words_per_minute after pretending to work for latency seconds.
+    '''
+
+    def __init__(self, words_per_minute=200, sample_rate=8000, latency=0.0):
+        self.words_per_minute = words_per_minute
+        self.sample_rate = sample_rate
+        self.latency = latency
+
+    def get_parameters(self):
+        return {'engine': 'null', 'words_per_minute': self.words_per_minute, 'sample_rate': self.sample_rate}
+
+    def synthesize(self, text):
+        if self.latency:
+            time.sleep(self.latency)
+        seconds = len(text.split()) * 60.0 / self.words_per_minute
+        return Utterance(text, b'\0\0' * int(seconds * self.sample_rate), self.sample_rate)
+
+class UtteranceCache(object):
+    '''
+    A cache of synthesized speech with a bounded in-memory LRU tier and an optional on-disk
+    tier which survives restarts.  Entries are addressed by a hash of the text and of the
+    synthesizer's parameters (voice, rate, engine...) so changing any of them never returns
+    stale audio.  The cache is thread safe, files are read and written without holding its lock.
+
+    max_memory_bytes
+        The most PCM held in memory, least recently used utterances are evicted first
+    directory
+        Where the disk tier is kept, None disables it
+    max_disk_bytes
+        The most the disk tier may hold, least recently used files are deleted first
+    metrics
+        Hits (per tier), misses and evictions (per tier), see :class:`bowser.metrics.CacheMetrics`
+    '''
+
+    MEMORY = 'memory'
+    DISK = 'disk'
+
+    def __init__(self, max_memory_bytes=32 * 1024 * 1024, directory=None, max_disk_bytes=256 * 1024 * 1024):
+        self.max_memory_bytes = max_memory_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.metrics = CacheMetrics()
+        self.logger = logging.getLogger(__name__)
+        self.__lock = RLock()
+        self.__memory = OrderedDict()
+        self.__memory_bytes = 0
+        self.__disk_sizes = OrderedDict()
+        self.__disk_bytes = 0
+        #Keys whose files are being written
+        self.__writing = set()
+        if directory is not None:
+            self.__load_disk_index()
+
+    @staticmethod
+    def get_key(text, parameters):
+        key_source = json.dumps([text, parameters], sort_keys=True)
+        return hashlib.sha256(key_source.encode('utf-8')).hexdigest()
+
+    def __get_path(self, key):
+        return os.path.join(self.directory, key + ".wav")
+
+    def __load_disk_index(self):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        entries = []
+        for filename in os.listdir(self.directory):
+            if filename.endswith(".wav"):
+                stat = os.stat(os.path.join(self.directory, filename))
+                entries.append((stat.st_mtime, filename[:-len(".wav")], stat.st_size))
+        #Least recently used first
+        for _, key, size in sorted(entries):
+            self.__disk_sizes[key] = size
+            self.__disk_bytes += size
+        self.__delete_files(self.__evict_disk())
+
+    def get(self, text, parameters):
+        '''
+        Returns the cached utterance or None
+        '''
+        key = self.get_key(text, parameters)
+        with self.__lock:
+            utterance = self.__memory.get(key)
+            if utterance is not None:
+                self.__memory.move_to_end(key)
+                if key in self.__disk_sizes:
+                    #Only the order in memory, the file's time is only refreshed when it is read
+                    self.__disk_sizes.move_to_end(key)
+                self.metrics.record_hit(UtteranceCache.MEMORY)
+                return utterance
+            on_disk = key in self.__disk_sizes
+        #Files are read and written without holding the lock so a slow disk never holds up
+        #memory hits
+        utterance = self.__read_from_disk(key, text) if on_disk else None
+        with self.__lock:
+            if utterance is None:
+                self.metrics.record_miss()
+                return None
+            if key in self.__disk_sizes:
+                self.__disk_sizes.move_to_end(key)
+            self.metrics.record_hit(UtteranceCache.DISK)
+            self.__put_in_memory(key, utterance)
+            return utterance
+
+    def put(self, text, parameters, utterance):
+        key = self.get_key(text, parameters)
+        with self.__lock:
+            self.__put_in_memory(key, utterance)
+            if self.directory is None or key in self.__disk_sizes or key in self.__writing:
+                return
+            self.__writing.add(key)
+        try:
+            size = self.__write_to_disk(key, utterance)
+        finally:
+            with self.__lock:
+                self.__writing.discard(key)
+        if size is None:
+            return
+        with self.__lock:
+            self.__disk_sizes[key] = size
+            self.__disk_bytes += size
+            evicted_keys = self.__evict_disk()
+        self.__delete_files(evicted_keys)
+
+    def __put_in_memory(self, key, utterance):
+        previous = self.__memory.pop(key, None)
+        if previous is not None:
+            self.__memory_bytes -= len(previous.pcm)
+        if len(utterance.pcm) > self.max_memory_bytes:
+            return
+        self.__memory[key] = utterance
+        self.__memory_bytes += len(utterance.pcm)
+        while self.__memory_bytes > self.max_memory_bytes:
+            _, evicted = self.__memory.popitem(last=False)
+            self.__memory_bytes -= len(evicted.pcm)
+            self.metrics.record_eviction(UtteranceCache.MEMORY)
+
+    def __read_from_disk(self, key, text):
+        path = self.__get_path(key)
+        try:
+            with open(path, 'rb') as wav_file:
+                utterance = Utterance.from_wav(text, wav_file.read())
+            #The modification time orders the entries for eviction after a restart
+            os.utime(path, None)
+            return utterance
+        #pylint: disable=broad-except
+        except Exception:
+            with self.__lock:
+                #Otherwise it was evicted while it was being read
+                unreadable = self.__forget_disk_entry(key)
+            if unreadable:
+                self.logger.exception("Discarding unreadable cache entry %s", path)
+                self.__delete_files([key])
+            return None
+
+    def __write_to_disk(self, key, utterance):
+        '''
+        Writes the utterance's file, returning its size or None if it was not written
+        '''
+        wav_bytes = utterance.to_wav()
+        if len(wav_bytes) > self.max_disk_bytes:
+            return None
+        #Written to a temporary file first so a crash never leaves a truncated entry behind
+        temporary_path = None
+        try:
+            handle, temporary_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(handle, 'wb') as temporary_file:
+                temporary_file.write(wav_bytes)
+            os.replace(temporary_path, self.__get_path(key))
+        except OSError:
+            self.logger.exception("Failed to write cache entry %s", key)
+            if temporary_path is not None and os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            return None
+        return len(wav_bytes)
+
+    def __forget_disk_entry(self, key):
+        #Called with the lock held, the file is deleted afterwards (see __delete_files)
+        size = self.__disk_sizes.pop(key, None)
+        if size is None:
+            return False
+        self.__disk_bytes -= size
+        return True
+
+    def __delete_files(self, keys):
+        for key in keys:
+            try:
+                os.remove(self.__get_path(key))
+            except OSError:
+                pass
+
+    def __evict_disk(self):
+        '''
+        Forgets the least recently used files until the disk tier fits, returns their keys so
+        the files can be deleted once the lock is released
+        '''
+        evicted_keys = []
+        while self.__disk_bytes > self.max_disk_bytes:
+            key = next(iter(self.__disk_sizes))
+            self.__forget_disk_entry(key)
+            evicted_keys.append(key)
+            self.metrics.record_eviction(UtteranceCache.DISK)
+        return evicted_keys
+
+class CachingSynthesizer(object):
+    '''
+    Consults an :class:`UtteranceCache` before synthesizing with another synthesizer
+    '''
+
+    def __init__(self, synthesizer, cache):
+        self.synthesizer = synthesizer
+        self.cache = cache
+
+    def get_parameters(self):
+        return self.synthesizer.get_parameters()
+
+    def synthesize(self, text):
+        parameters = self.synthesizer.get_parameters()
+        utterance = self.cache.get(text, parameters)
+        if utterance is None:
+            utterance = self.synthesizer.synthesize(text)
+            self.cache.put(text, parameters, utterance)
+        return utterance
+
+class _Synthesis(object):
+    '''
+    A synthesis job submitted to the worker pool
+    '''
+
+    def __init__(self, text, job):
+        self.text = text
+        self.job = job
+        self.started_at = time.time()
+        self.finished_at = None
+
+class SynthesizingTtsChannel(object):
+    '''
+    A TTS channel which synthesizes text to memory on a pool of worker threads and then plays
+    the audio on playback_channel (an effects channel).
+
+    Text passed to :meth:`prefetch` is synthesized speculatively.  If it is queued later the
+    buffer is played as soon as it is ready instead of synthesis starting then.  How often
+    this happens and how much latency it saves is recorded in :attr:`metrics`.
+
+    name
+        The name of the channel (used for logging)
+    synthesizer
+        Turns text into a :class:`Utterance`, must be thread safe
+    playback_channel
+        The channel that plays the synthesized audio, e.g. a PygameEffectsChannel
+    sound_factory
+        Turns an :class:`Utterance` into something playback_channel can play
+    workers
+        The number of synthesis threads
+    max_prefetched
+        How many speculatively synthesized utterances are kept.  The oldest are discarded
+        (and counted as wasted) first.
+    lookahead
+        How many texts are synthesized ahead of the one playing (or about to play).  Texts
+        synthesized and handed to playback_channel count until they have been played, so the
+        next text is only synthesized once playback advances.
+    '''
+
+    class QueuedText(object):
+
+        def __init__(self, text, future, synthesis, queued_at):
+            self.text = text
+            self.future = future
+            self.synthesis = synthesis
+            self.queued_at = queued_at
+
+    supports_prefetch = True
+
+    def __init__(self, name, synthesizer, playback_channel, sound_factory=load_pygame_utterance,
+                 workers=2, max_prefetched=8, lookahead=2):
+        self.name = name
+        self.lookahead = lookahead
+        self.synthesizer = synthesizer
+        self.playback_channel = playback_channel
+        self.sound_factory = sound_factory
+        self.max_prefetched = max_prefetched
+        self.metrics = SpeculationMetrics()
+        self.logger = logging.getLogger("{0}.{1}".format(__name__, name))
+        self.__pool = ThreadPoolExecutor(max_workers=workers)
+        self.__lock = RLock()
+        self.__queue = deque()
+        #Texts handed to the playback channel which have not finished playing
+        self.__playing = deque()
+        self.__prefetched = OrderedDict()
+
+    def initialize(self):
+        self.playback_channel.initialize()
+        self.logger.info("Channel initialized")
+
+    def __synthesize(self, text):
+        synthesis = _Synthesis(text, None)
+        def run():
+            try:
+                return self.synthesizer.synthesize(text)
+            finally:
+                synthesis.finished_at = time.time()
+        synthesis.job = self.__pool.submit(run)
+        return synthesis
+
+    def prefetch(self, text):
+        '''
+        Starts synthesizing text which is likely to be queued soon
+        '''
+        with self.__lock:
+            if text in self.__prefetched:
+                self.__prefetched.move_to_end(text)
+                return
+            self.__prefetched[text] = self.__synthesize(text)
+            self.metrics.record_prediction()
+            while len(self.__prefetched) > self.max_prefetched:
+                _, discarded = self.__prefetched.popitem(last=False)
+                discarded.job.cancel()
+                self.metrics.record_wasted()
+
+    def __take_prefetched(self, text, now):
+        synthesis = self.__prefetched.pop(text, None)
+        if synthesis is None:
+            self.metrics.record_miss()
+            return None
+        #Whatever synthesis time passed before the text was needed has been saved
+        finished_at = synthesis.finished_at if synthesis.finished_at is not None else now
+        self.metrics.record_hit(max(0.0, min(finished_at, now) - synthesis.started_at))
+        return synthesis
+
+    def queue(self, text):
+        '''
+        Queues a string of text to be spoken.  The returned future is fulfilled once it has
+        been spoken and cancelled if it is interrupted first.
+
+        Only the next few texts (see lookahead) are synthesized at any time, so queuing a long
+        series of texts does not hold up the first one and an interrupt throws away little work.
+        '''
+        self.logger.debug("Queuing %s", text)
+        future = Future()
+        now = time.time()
+        with self.__lock:
+            synthesis = self.__take_prefetched(text, now)
+            self.__queue.append(SynthesizingTtsChannel.QueuedText(text, future, synthesis, now))
+            self.__play_ready()
+        return future
+
+    def interrupt(self):
+        with self.__lock:
+            self.logger.debug("Channel interrupted")
+            old_queue = self.__queue
+            self.__queue = deque()
+            self.__playing.clear()
+            self.playback_channel.interrupt()
+        for queued_text in old_queue:
+            if queued_text.synthesis is not None:
+                queued_text.synthesis.job.cancel()
+            queued_text.future.cancel()
+
+    def __play_ready(self):
+        '''
+        Starts synthesizing the next few queued texts and hands the queued texts whose synthesis
+        has finished (in order) to the playback channel
+        '''
+        self.__playing = deque(playing for playing in self.__playing if not playing.future.finished)
+        while self.__queue:
+            #The text playing (or about to play) and up to lookahead more
+            to_synthesize = max(self.lookahead + 1 - len(self.__playing), 0)
+            for queued_text in itertools.islice(self.__queue, to_synthesize):
+                if queued_text.synthesis is None:
+                    queued_text.synthesis = self.__synthesize(queued_text.text)
+            synthesis = self.__queue[0].synthesis
+            if synthesis is None or not synthesis.job.done():
+                return
+            queued_text = self.__queue.popleft()
+            try:
+                sound = self.sound_factory(queued_text.synthesis.job.result())
+            #pylint: disable=broad-except
+            except Exception:
+                self.logger.exception("Failed to synthesize %s", queued_text.text)
+                queued_text.future.cancel()
+                continue
+            self.metrics.record_wait(time.time() - queued_text.queued_at)
+            self.__playing.append(queued_text)
+            self.playback_channel.queue(sound).forward_to(queued_text.future)
+
+    def _iterate(self):
+        with self.__lock:
+            self.__play_ready()
+        #pylint: disable=protected-access
+        iterate = getattr(self.playback_channel, '_iterate', None)
+        if iterate is not None:
+            iterate()
+
+    def close(self):
+        self.__pool.shutdown(wait=False)
@@ -0,0 +1,231 @@
+'''
+Playback of long audio (background music, clips minutes long) without decoding it up front.
+Unlike :class:`bowser.systems.audio.PygameEffectsChannel`, which plays fully decoded Sounds,
+the channel in this module plays through pygame's music stream, which decodes a little at a
+time while it plays.
+'''
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import RLock
+import logging
+import os
+import tempfile
+import urllib.parse
+import urllib.request
+
+import pygame
+
+from bowser.custom_futures import Future
+from bowser.systems.key_and_frame import USER_EVENT_ROUTER
+
+def is_remote(location):
+    return urllib.parse.urlparse(location).scheme in ('http', 'https')
+
+class _Stream(object):
+    '''
+    A location queued on a :class:`StreamingChannel`
+
+    path
+        Where the audio is played from, for remote locations this is only set once the body
+        has been downloaded
+    downloading
+        True while the body is being downloaded
+    '''
+
+    def __init__(self, location, future):
+        self.location = location
+        self.future = future
+        self.path = None if is_remote(location) else location
+        self.downloading = False
+        self.failed = False
+        self.cancelled = False
+
+class StreamingChannel(object):
+    '''
+    Plays audio files (or HTTP(S) URLs of audio files) one after another, decoding them
+    incrementally with pygame's music stream.  Only one streaming channel can play at a time
+    because pygame only has one music stream.
+
+    The body of a remote location is read chunk_size bytes at a time into a temporary file in
+    spool_directory, so no more than a chunk of it is ever held in memory.  Bodies larger than
+    max_download_bytes are abandoned.  Remote locations are downloaded as soon as they are
+    queued (on up to download_workers threads) so the next stream is usually ready by the time
+    the current one finishes.  Playback of a remote location starts once its body is
+    downloaded, the decoders need to look at the end of a file before they can play it.
+
+    As with the other channels, :meth:`queue` returns a future which is fulfilled when the
+    stream finishes playing and cancelled if it is interrupted (or cannot be played).  The
+    end events of the music stream are routed to the channel by user_event_router.  The end
+    event code sits above those of the mixer channels, which pygame 1 has no room for (it only
+    allows 32 event types), so the channel requires pygame 2 and refuses to start without it.
+
+    music
+        The music stream, pygame.mixer.music unless told otherwise
+    opener
+        Opens a URL, returning a file like response, urllib.request.urlopen unless told otherwise
+    '''
+
+    #: Mixer channel end events use pygame.USEREVENT + channel id, the music stream goes after them.
+    #: Only valid on pygame 2, see :meth:`__init__`
+    END_EVENT_OFFSET = 64
+    DEFAULT_CHUNK_SIZE = 64 * 1024
+    DEFAULT_MAX_DOWNLOAD_BYTES = 256 * 1024 * 1024
+
+    def __init__(self, name, user_event_router=USER_EVENT_ROUTER, music=None, opener=None,
+                 chunk_size=DEFAULT_CHUNK_SIZE, max_download_bytes=DEFAULT_MAX_DOWNLOAD_BYTES,
+                 spool_directory=None, download_workers=2):
+        self.name = name
+        self.music = music or pygame.mixer.music
+        self.opener = opener or urllib.request.urlopen
+        self.chunk_size = chunk_size
+        self.max_download_bytes = max_download_bytes
+        self.spool_directory = spool_directory
+        self.logger = logging.getLogger("{0}.{1}".format(__name__, name))
+        #pylint: disable=no-member
+        if self.__get_event_code() >= pygame.NUMEVENTS:
+            raise Exception("StreamingChannel requires pygame 2, pygame {0} has no event code free for "
+                            "the music stream".format(pygame.version.ver))
+        self.__queue = deque()
+        self.__playing = None
+        #Stopping the music stream still produces an end event, which must not finish the next stream
+        self.__stale_end_events = 0
+        self.__lock = RLock()
+        self.__downloads = ThreadPoolExecutor(max_workers=download_workers)
+        self.__user_event_router = user_event_router
+        self.__user_event_router.register(self.__get_event_code(), self.__on_music_finished)
+
+    def __get_event_code(self):
+        #pylint: disable=no-member
+        return pygame.USEREVENT + StreamingChannel.END_EVENT_OFFSET
+
+    def initialize(self):
+        self.music.set_endevent(self.__get_event_code())
+        self.logger.info("Channel initialized")
+
+    def close(self):
+        self.interrupt()
+        self.__user_event_router.unregister(self.__get_event_code())
+        self.__downloads.shutdown(wait=False)
+
+    def queue(self, location):
+        '''
+        Queues a path or HTTP(S) URL to be played after everything queued before it
+        '''
+        self.logger.debug("Queuing %s", location)
+        stream = _Stream(location, Future())
+        with self.__lock:
+            self.__queue.append(stream)
+            if stream.path is None:
+                stream.downloading = True
+                self.__downloads.submit(self.__download, stream)
+        return stream.future
+
+    def __download(self, stream):
+        #Runs on a download thread
+        path = None
+        try:
+            handle, path = tempfile.mkstemp(dir=self.spool_directory, suffix=".stream")
+            with os.fdopen(handle, 'wb') as spool_file:
+                response = self.opener(stream.location)
+                try:
+                    self.__copy(stream, response, spool_file)
+                finally:
+                    response.close()
+        except Exception: #pylint: disable=broad-except
+            self.logger.exception("Could not download %s", stream.location)
+            stream.failed = True
+        with self.__lock:
+            stream.downloading = False
+            if stream.failed or stream.cancelled:
+                self.__remove_spool_file(path)
+            else:
+                stream.path = path
+
+    def __copy(self, stream, response, spool_file):
+        downloaded = 0
+        while not stream.cancelled:
+            chunk = response.read(self.chunk_size)
+            if not chunk:
+                return
+            downloaded += len(chunk)
+            if downloaded > self.max_download_bytes:
+                raise Exception("{0} is larger than {1} bytes".format(stream.location, self.max_download_bytes))
+            spool_file.write(chunk)
+
+    def __remove_spool_file(self, path):
+        if path is None:
+            return
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def __release(self, stream):
+        if is_remote(stream.location) and not stream.downloading:
+            self.__remove_spool_file(stream.path)
+            stream.path = None
+
+    def __play_next(self):
+        failed = []
+        with self.__lock:
+            while self.__playing is None and self.__queue:
+                stream = self.__queue[0]
+                if stream.failed:
+                    failed.append(self.__queue.popleft())
+                    continue
+                if stream.path is None:
+                    #Still downloading
+                    break
+                self.__queue.popleft()
+                try:
+                    self.music.load(stream.path)
+                    self.music.play()
+                except pygame.error:
+                    self.logger.exception("Could not play %s", stream.location)
+                    self.__release(stream)
+                    failed.append(stream)
+                    continue
+                self.__playing = stream
+        for stream in failed:
+            stream.future.cancel()
+
+    def __on_music_finished(self, _):
+        with self.__lock:
+            if self.__stale_end_events > 0:
+                self.__stale_end_events -= 1
+                return
+            finished = self.__playing
+            self.__playing = None
+            if finished is not None:
+                self.__unload()
+                self.__release(finished)
+        if finished is not None:
+            finished.future.fulfill()
+        self.__play_next()
+
+    def __unload(self):
+        #Closes the file the music stream was reading (pygame 2 only)
+        unload = getattr(self.music, 'unload', None)
+        if unload is not None:
+            unload()
+
+    def interrupt(self):
+        with self.__lock:
+            interrupted = list(self.__queue)
+            self.__queue.clear()
+            if self.__playing is not None:
+                interrupted.append(self.__playing)
+                self.__playing = None
+                self.__stale_end_events += 1
+                self.music.stop()
+                self.__unload()
+            for stream in interrupted:
+                #A download in progress notices and removes its own file
+                stream.cancelled = True
+                self.__release(stream)
+        for stream in interrupted:
+            stream.future.cancel()
+
+    def _iterate(self):
+        #Streams are started on the loop thread, downloads only mark them as ready
+        self.__play_next()
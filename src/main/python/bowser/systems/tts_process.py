@@ -0,0 +1,236 @@
+'''
+Speech in a separate process.  The speech engine is driven by a worker process so that a slow
+synthesis step can never hold up the loop which handles key presses and focus changes.  The
+loop talks to the worker through a pair of queues, see :class:`ProcessTtsChannel`.
+'''
+from threading import RLock, Thread
+import itertools
+import logging
+import multiprocessing
+import queue
+import time
+
+from bowser.custom_futures import Future
+
+#Messages sent to the worker
+_SAY = 'say'
+_INTERRUPT = 'interrupt'
+_STOP = 'stop'
+#Messages sent by the worker
+_READY = 'ready'
+_FINISHED = 'finished'
+
+class PyttsxEngine(object):
+    '''
+    Drives pyttsx inside the worker process.  An engine is created by the worker with a
+    callback, on_finished(name, completed), to call whenever an utterance finishes or is
+    stopped.  Engines must provide say(text, name), stop() and iterate().
+    '''
+
+    def __init__(self, on_finished):
+        #pyttsx is imported here so that only the worker process requires it
+        import pyttsx
+        self.engine = pyttsx.init()
+        self.engine.startLoop(useDriverLoop=False)
+        self.engine.connect('finished-utterance', lambda name, completed, **_: on_finished(name, completed))
+
+    def say(self, text, name):
+        self.engine.say(text, name)
+
+    def stop(self):
+        self.engine.stop()
+
+    def iterate(self):
+        self.engine.iterate()
+
+def _run_worker(engine_factory, requests, completions, poll_interval):
+    '''
+    The body of the worker process
+    '''
+    engine = engine_factory(lambda name, completed: completions.put((_FINISHED, name, completed)))
+    completions.put((_READY,))
+    while True:
+        try:
+            message = requests.get(timeout=poll_interval)
+        except queue.Empty:
+            message = None
+        while message is not None:
+            if message[0] == _SAY:
+                engine.say(message[2], message[1])
+            elif message[0] == _INTERRUPT:
+                engine.stop()
+            elif message[0] == _STOP:
+                return
+            try:
+                message = requests.get_nowait()
+            except queue.Empty:
+                message = None
+        engine.iterate()
+
+class _Worker(object):
+    '''
+    A running worker process and the queues used to talk to it
+    '''
+
+    def __init__(self, context, engine_factory, poll_interval):
+        self.requests = context.Queue()
+        self.completions = context.Queue()
+        self.process = context.Process(target=_run_worker,
+                                       args=(engine_factory, self.requests, self.completions, poll_interval))
+        self.process.daemon = True
+        self.started_at = None
+
+    def start(self):
+        self.process.start()
+        self.started_at = time.time()
+
+    def stop(self, timeout):
+        if self.process.is_alive():
+            self.requests.put((_STOP,))
+            self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(timeout)
+
+class ProcessTtsChannel(object):
+    '''
+    A TTS channel which speaks through an engine (pyttsx by default, see :class:`PyttsxEngine`)
+    running in a worker process.  Queued text and interrupts are sent to the worker as
+    messages and the worker reports back when each utterance finishes.  Completion messages
+    are read by a thread of the channel's own which completes the futures returned by
+    :meth:`queue`, so the loop calling :meth:`_iterate` never waits on the engine.
+
+    If the worker dies the futures of everything it had not finished speaking are cancelled
+    and a new worker is started, no sooner than restart_delay seconds after the last one was
+    started.  :attr:`restarts` counts how often this has happened.
+
+    engine_factory
+        Creates the engine in the worker process, it must be picklable (e.g. a module level
+        class or function)
+    poll_interval
+        How long the worker waits for a message before iterating the engine
+    '''
+
+    #: The engine cannot synthesize ahead of time, see :meth:`prefetch`
+    supports_prefetch = False
+
+    def __init__(self, name, engine_factory=PyttsxEngine, restart_delay=1.0, poll_interval=0.01):
+        self.name = name
+        self.engine_factory = engine_factory
+        self.restart_delay = restart_delay
+        self.poll_interval = poll_interval
+        self.restarts = 0
+        self.logger = logging.getLogger("{0}.{1}".format(__name__, name))
+        #Spawned rather than forked so the worker does not inherit pygame's state
+        self.__context = multiprocessing.get_context('spawn')
+        self.__lock = RLock()
+        #Utterances are named so that their completion can be matched up with their future
+        self.__futures = {}
+        self.__utterance_names = itertools.count()
+        self.__worker = None
+        self.__reader = None
+        self.__closing = False
+
+    def initialize(self):
+        with self.__lock:
+            self.__worker = self.__start_worker()
+        self.__reader = Thread(target=self.__read_completions, name="{0}-completions".format(self.name))
+        self.__reader.daemon = True
+        self.__reader.start()
+        self.logger.info("Channel initialized")
+
+    def __start_worker(self):
+        worker = _Worker(self.__context, self.engine_factory, self.poll_interval)
+        worker.start()
+        return worker
+
+    def queue(self, text):
+        '''
+        Queues a string of text to be spoken by the worker's engine
+        '''
+        self.logger.debug("Queuing %s", text)
+        future = Future()
+        with self.__lock:
+            utterance_name = str(next(self.__utterance_names))
+            self.__futures[utterance_name] = future
+            self.__worker.requests.put((_SAY, utterance_name, text))
+        return future
+
+    def prefetch(self, text):
+        '''
+        The engine can only speak text, not synthesize it ahead of time, so this does nothing
+        '''
+        pass
+
+    def interrupt(self):
+        '''
+        Stops whatever is being spoken and clears out the queue
+        '''
+        with self.__lock:
+            self.logger.debug("Channel interrupted")
+            old_futures = self.__take_futures()
+            self.__worker.requests.put((_INTERRUPT,))
+        for future in old_futures:
+            future.cancel()
+
+    def __take_futures(self):
+        old_futures = list(self.__futures.values())
+        self.__futures = {}
+        return old_futures
+
+    def __read_completions(self):
+        while not self.__closing:
+            worker = self.__worker
+            try:
+                message = worker.completions.get(timeout=0.1)
+            except queue.Empty:
+                if not worker.process.is_alive() and not self.__closing:
+                    self.__restart_worker(worker)
+                continue
+            if message[0] == _FINISHED:
+                self.__on_utterance_finished(message[1], message[2])
+
+    def __on_utterance_finished(self, name, completed):
+        with self.__lock:
+            future = self.__futures.pop(name, None)
+        if future is None:
+            #An utterance stopped by an interrupt, its future has already been cancelled
+            return
+        if completed:
+            future.fulfill()
+        else:
+            future.cancel()
+
+    def __restart_worker(self, worker):
+        self.logger.error("The speech worker exited (exit code %s), restarting it", worker.process.exitcode)
+        remaining_delay = worker.started_at + self.restart_delay - time.time()
+        if remaining_delay > 0:
+            time.sleep(remaining_delay)
+        with self.__lock:
+            if self.__closing:
+                return
+            lost_futures = self.__take_futures()
+            self.__worker = self.__start_worker()
+            self.restarts += 1
+        for future in lost_futures:
+            future.cancel()
+
+    def close(self, timeout=1.0):
+        '''
+        Stops the worker process
+        '''
+        with self.__lock:
+            self.__closing = True
+            old_futures = self.__take_futures()
+        if self.__reader is not None:
+            self.__reader.join(timeout)
+        if self.__worker is not None:
+            self.__worker.stop(timeout)
+        for future in old_futures:
+            future.cancel()
+
+    def _iterate(self):
+        '''
+        Nothing to do, the worker process iterates the engine
+        '''
+        pass
@@ -5,20 +5,112 @@ Created on Mar 24, 2015
 '''
 from lxml import etree
 
+class IncrementalParse(object):
+    '''
+    A document being parsed a chunk at a time.  Elements are post-processed as soon as they are
+    opened (their attributes are known at that point and post-processing them in document order
+    matches what a complete parse does).
+
+    root
+        The root element, available once the first chunk containing it has been fed
+    ready
+        True once an element (other than the root) matching the ready predicate has been closed.
+        At that point the partial document can be published.
+    finished
+        True once the parse has been closed
+    '''
+    
+    def __init__(self, lookup, post_process_element, ready_predicate):
+        self.__pull_parser = etree.XMLPullParser(events=('start', 'end'), huge_tree=True)
+        self.__pull_parser.set_element_class_lookup(lookup)
+        self.__post_process_element = post_process_element
+        self.__ready_predicate = ready_predicate
+        self.root = None
+        self.ready = False
+        self.finished = False
+        
+    def __process_events(self):
+        new_elements = []
+        for action, element in self.__pull_parser.read_events():
+            if action == 'start':
+                if self.root is None:
+                    self.root = element
+                self.__post_process_element(element)
+                new_elements.append(element)
+            elif not self.ready and element is not self.root and self.__ready_predicate(element):
+                self.ready = True
+        return new_elements
+    
+    def feed(self, data):
+        '''
+        Parses the next chunk of the document.  Returns the elements which were opened (and
+        post-processed) by this chunk.
+        '''
+        self.__pull_parser.feed(data)
+        return self.__process_events()
+    
+    def close(self):
+        '''
+        Finishes the parse, raising an error if the document was incomplete.  Returns any elements
+        opened while finishing.
+        '''
+        self.__pull_parser.close()
+        new_elements = self.__process_events()
+        self.ready = True
+        self.finished = True
+        return new_elements
+
 class XmlParser(object):
+    '''
+    Parses documents and post-processes every element of them with a list of processors.
+    
+    A processor has a process(element) method.  If it also has a tags attribute (a list of tag
+    names) then it is only given elements with those tags and, instead of process, its
+    process_tagged(element) method is called (the tag is already known to match).  For any
+    given element processors are run in the order they were supplied.
+
+    A processor may also have a finish(root) method, which is called once a whole document
+    has been post-processed (e.g. to announce all of its changes at once).  It is not called
+    for incremental parses, whose elements are announced as they are published.
+    '''
     
     def __init__(self, processors, default_element_class):
-        lookup = etree.ElementDefaultClassLookup(element=default_element_class)
-        self.parser = etree.XMLParser()
-        self.parser.set_element_class_lookup(lookup)
+        self.lookup = etree.ElementDefaultClassLookup(element=default_element_class)
+        #huge_tree lifts libxml2's limit on how deeply elements may be nested
+        self.parser = etree.XMLParser(huge_tree=True)
+        self.parser.set_element_class_lookup(self.lookup)
         self.processors = processors
+        self.__finish_functions = [processor.finish for processor in processors if hasattr(processor, 'finish')]
+        self.__processors_by_tag = {}
+        
+    def __create_processor_list(self, tag):
+        processor_functions = []
+        for processor in self.processors:
+            tags = getattr(processor, 'tags', None)
+            if tags is None:
+                processor_functions.append(processor.process)
+            elif tag in tags:
+                processor_functions.append(processor.process_tagged)
+        return processor_functions
+        
+    def __get_processors(self, tag):
+        processor_functions = self.__processors_by_tag.get(tag)
+        if processor_functions is None:
+            processor_functions = self.__create_processor_list(tag)
+            self.__processors_by_tag[tag] = processor_functions
+        return processor_functions
 
     def __post_process_element(self, xml_element):
-        for processor in self.processors:
-            processor.process(xml_element)
+        for processor_function in self.__get_processors(xml_element.tag):
+            processor_function(xml_element)
     
     def __post_process_tree(self, xml_tree):
-        xml_tree.dfs_do(self.__post_process_element)
+        #A single, non-recursive pass in document order.  Comments and processing instructions
+        #are not elements of the default class and are skipped.
+        for xml_element in xml_tree.iter(tag=etree.Element):
+            self.__post_process_element(xml_element)
+        for finish_function in self.__finish_functions:
+            finish_function(xml_tree)
         
     def fromstring(self, xml_text):
         root_element = etree.fromstring(xml_text, parser=self.parser)
@@ -28,4 +120,13 @@ class XmlParser(object):
     def parse(self, file_like_object):
         root_element = etree.parse(file_like_object, parser=self.parser).getroot()
         self.__post_process_tree(root_element)
-        return root_element
\ No newline at end of file
+        return root_element
+    
+    def parse_incrementally(self, ready_predicate=None):
+        '''
+        Starts an :class:`IncrementalParse`.  ready_predicate is called with each closed element
+        until it returns True, at which point the parse is marked ready.  By default the parse
+        is ready as soon as any element inside the root has been closed.
+        '''
+        return IncrementalParse(self.lookup, self.__post_process_element,
+                                ready_predicate or (lambda element: True))
@@ -0,0 +1,4 @@
+'''
+Benchmarks for bowser.  These are not unit tests, each module can be run directly
+(e.g. python -m benchmark.dispatch_depth from src/test/python) and prints its results.
+'''
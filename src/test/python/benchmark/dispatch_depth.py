@@ -0,0 +1,44 @@
+'''
+Measures the cost of dispatching an event at the deepest element of documents of
+increasing depth, with and without the propagation path cache.  A single listener is
+registered on the window, as is typical of the systems (focus, rendering, resource loading).
+'''
+import timeit
+
+from bowser import rom
+from bowser.rom import RomElement, Window
+from bowser.systems.event import GLOBAL_DISPATCHER, Event
+from bowser.xmlparse import XmlParser
+
+DEPTHS = [8, 16, 32, 64, 128, 250]
+ITERATIONS = 2000
+
+def create_nested_document(depth):
+    return '<container>' * depth + '<p>leaf</p>' + '</container>' * depth
+
+def find_leaf(root):
+    return root.dfs(lambda node: node.tag == 'p')
+
+def measure(depth):
+    window = Window()
+    parser = XmlParser(rom.create_processors_list(), RomElement)
+    window.root_element = parser.fromstring(create_nested_document(depth))
+    leaf = find_leaf(window.root_element)
+    window.add_event_listener('benchmark', lambda event: None)
+    def dispatch():
+        leaf.dispatch_event(Event('benchmark'))
+    def dispatch_uncached():
+        GLOBAL_DISPATCHER.invalidate_propagation_paths()
+        leaf.dispatch_event(Event('benchmark'))
+    cached = timeit.timeit(dispatch, number=ITERATIONS) / ITERATIONS
+    uncached = timeit.timeit(dispatch_uncached, number=ITERATIONS) / ITERATIONS
+    return cached, uncached
+
+def main():
+    print("{0:>8} {1:>14} {2:>14}".format("depth", "cached (us)", "uncached (us)"))
+    for depth in DEPTHS:
+        cached, uncached = measure(depth)
+        print("{0:>8} {1:>14.2f} {2:>14.2f}".format(depth, cached * 1e6, uncached * 1e6))
+
+if __name__ == '__main__':
+    main()
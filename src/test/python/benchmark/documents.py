@@ -0,0 +1,42 @@
+'''
+Generates synthetic RAM documents for the benchmarks.
+
+A document is a ram element containing as many "sections" as are needed to reach the
+requested element count.  A section is a chain of depth nested containers, each of which
+has a title and fan_out real children (fan_out - 1 paragraphs plus the next container in the
+chain, the innermost container has fan_out paragraphs).
+'''
+
+def generate_document(element_count, depth, fan_out):
+    '''
+    Returns the text of a document with roughly element_count elements where no container is
+    nested deeper than depth and every container has fan_out real children.
+    '''
+    if depth < 1 or fan_out < 1:
+        raise Exception("depth and fan_out must both be at least 1")
+    parts = ['<ram>']
+    count = 1
+    section = 0
+    while count < element_count:
+        open_containers = 0
+        for level in range(depth):
+            parts.append('<container><title><p>Section {0} level {1}</p></title>'.format(section, level))
+            open_containers += 1
+            count += 3
+            paragraphs = fan_out if level == depth - 1 else fan_out - 1
+            for index in range(min(paragraphs, element_count - count)):
+                parts.append('<p>Item {0} of section {1} level {2}</p>'.format(index, section, level))
+                count += 1
+            if count >= element_count:
+                break
+        parts.append('</container>' * open_containers)
+        section += 1
+    parts.append('</ram>')
+    return ''.join(parts)
+
+#: (name, depth, fan_out) of the document shapes benchmarked at each size
+SHAPES = [
+    ('wide', 2, 1000),
+    ('balanced', 8, 10),
+    ('deep', 100, 2),
+]
@@ -0,0 +1,228 @@
+'''
+The benchmark suite.  Times parsing (with post-processing), focus resolution, container
+navigation, rendering and raw event dispatch on synthetic documents of increasing size and
+varying shape, then writes the results as JSON so that runs can be compared over time.
+
+Run from src/test/python:
+
+    python -m benchmark.suite [--max-elements N] [--output FILE] [--compare BASELINE_FILE]
+'''
+from io import BytesIO
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import time
+
+import lxml.etree
+import pygame
+
+from benchmark.documents import generate_document, SHAPES
+from bowser import rom
+from bowser.rom import RomElement, Window
+from bowser.systems.event import Event
+from bowser.systems.focus import FocusSystem, FocusEvent
+from bowser.systems.key_and_frame import KeyEvent
+from bowser.systems.renderer import RenderingSystem
+from bowser.xmlparse import XmlParser
+
+SIZES = [10 ** exponent for exponent in range(2, 7)]
+#: Each benchmark is repeated until it has run for at least this long...
+MIN_TIME = 0.5
+#: ...or has run this many times
+MAX_ITERATIONS = 1000
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+class _SilentChannel(object):
+
+    def interrupt(self):
+        pass
+
+    def queue(self, _):
+        pass
+
+class _SilentAudioSystem(object):
+
+    def __init__(self):
+        self.tts_channel = _SilentChannel()
+
+def measure(function, after_each=None):
+    '''
+    Runs function repeatedly and returns the duration of each run.  after_each (if given) is
+    called after each run, outside of the timed region.
+    '''
+    samples = []
+    while not samples or (sum(samples) < MIN_TIME and len(samples) < MAX_ITERATIONS):
+        started = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - started)
+        if after_each is not None:
+            after_each()
+    return samples
+
+class Fixture(object):
+    '''
+    A parsed document attached to a window with the focus and rendering systems running
+    '''
+
+    def __init__(self, document):
+        self.window = Window()
+        self.parser = XmlParser(rom.create_processors_list(), RomElement)
+        self.focus_system = FocusSystem(self.window)
+        self.renderer = RenderingSystem(self.window, _SilentAudioSystem())
+        self.document = document
+        self.root = self.parser.fromstring(document)
+        self.window.root_element = self.root
+
+    def parse(self):
+        return self.parser.parse(BytesIO(self.document))
+
+def benchmark_parse(fixture):
+    parsed = []
+    def parse():
+        parsed.append(fixture.parse())
+    def release():
+        #Releases the listeners (and index entries) registered while post-processing.  The
+        #fixture's own document stays displayed for the benchmarks which follow.
+        document = parsed.pop()
+        rom.release_elements(element.get_id() for element in document.iter(tag=lxml.etree.Element))
+    return measure(parse, release), 1
+
+def benchmark_focus(fixture):
+    sections = [child for child in fixture.root]
+    position = [0]
+    def focus_next_section():
+        sections[position[0] % len(sections)].focus()
+        position[0] += 1
+    return measure(focus_next_section), 1
+
+def __press(fixture, key):
+    fixture.focus_system.currently_focused.dispatch_event(KeyEvent(key, 0))
+
+def benchmark_navigation(fixture):
+    #pylint: disable=no-member
+    container = fixture.root[0]
+    presses = len([child for child in container if child.tag != rom.Tags.Title])
+    def navigate():
+        container.focus()
+        for _ in range(presses):
+            __press(fixture, pygame.K_RIGHT)
+        for _ in range(presses):
+            __press(fixture, pygame.K_LEFT)
+    return measure(navigate), presses * 2
+
+def benchmark_render(fixture):
+    def render():
+        fixture.root.dispatch_event(FocusEvent(FocusEvent.focus_name))
+    return measure(render), 1
+
+def benchmark_dispatch(fixture):
+    leaf = fixture.root
+    while len(leaf):
+        leaf = leaf[-1]
+    fixture.window.add_event_listener('benchmark', lambda event: None)
+    fixture.root.add_event_listener('benchmark', lambda event: None, use_capture=True)
+    events_per_run = 1000
+    def dispatch():
+        for _ in range(events_per_run):
+            leaf.dispatch_event(Event('benchmark'))
+    return measure(dispatch), events_per_run
+
+BENCHMARKS = [
+    ('parse', benchmark_parse),
+    ('focus', benchmark_focus),
+    ('navigation', benchmark_navigation),
+    ('render', benchmark_render),
+    ('dispatch', benchmark_dispatch),
+]
+
+def summarize(name, shape, element_count, depth, fan_out, samples, operations_per_run):
+    total = sum(samples)
+    return {
+        'benchmark': name,
+        'shape': shape,
+        'element_count': element_count,
+        'depth': depth,
+        'fan_out': fan_out,
+        'iterations': len(samples),
+        'operations_per_iteration': operations_per_run,
+        'total_seconds': total,
+        'mean_seconds': total / len(samples),
+        'min_seconds': min(samples),
+        'max_seconds': max(samples),
+        'seconds_per_operation': min(samples) / operations_per_run
+    }
+
+def get_metadata():
+    return {
+        'timestamp': datetime.datetime.now().isoformat(),
+        'python': sys.version,
+        'lxml': lxml.etree.__version__,
+        'platform': platform.platform(),
+        'min_time': MIN_TIME,
+        'max_iterations': MAX_ITERATIONS
+    }
+
+def run(sizes, benchmark_names):
+    results = []
+    for element_count in sizes:
+        for shape, depth, fan_out in SHAPES:
+            document = generate_document(element_count, depth, fan_out).encode('utf-8')
+            fixture = Fixture(document)
+            for name, benchmark in BENCHMARKS:
+                if name not in benchmark_names:
+                    continue
+                samples, operations_per_run = benchmark(fixture)
+                result = summarize(name, shape, element_count, depth, fan_out, samples, operations_per_run)
+                print("{0:>10} {1:>9} {2:>8} {3:>14.3f}us/op".format(
+                    name, shape, element_count, result['seconds_per_operation'] * 1e6))
+                results.append(result)
+    return {'metadata': get_metadata(), 'results': results}
+
+def __result_key(result):
+    return (result['benchmark'], result['shape'], result['element_count'])
+
+def compare(report, baseline):
+    '''
+    Prints the ratio of each result to the matching result in baseline (>1 means slower)
+    '''
+    baseline_results = dict((__result_key(result), result) for result in baseline['results'])
+    print("{0:>10} {1:>9} {2:>8} {3:>10}".format("benchmark", "shape", "elements", "ratio"))
+    for result in report['results']:
+        baseline_result = baseline_results.get(__result_key(result))
+        if baseline_result is None:
+            continue
+        ratio = result['seconds_per_operation'] / baseline_result['seconds_per_operation']
+        print("{0:>10} {1:>9} {2:>8} {3:>10.2f}".format(result['benchmark'], result['shape'],
+                                                         result['element_count'], ratio))
+
+def get_default_output():
+    if not os.path.exists(RESULTS_DIR):
+        os.makedirs(RESULTS_DIR)
+    filename = datetime.datetime.now().strftime("benchmark-%Y%m%d-%H%M%S.json")
+    return os.path.join(RESULTS_DIR, filename)
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs the bowser benchmark suite")
+    parser.add_argument("--max-elements", type=int, default=SIZES[-1],
+                        help="Skip documents larger than this many elements")
+    parser.add_argument("--benchmark", action="append", choices=[name for name, _ in BENCHMARKS],
+                        help="Only run the given benchmark (may be repeated)")
+    parser.add_argument("--output", help="Where to write the JSON results")
+    parser.add_argument("--compare", metavar="BASELINE", help="A previous results file to compare against")
+    args = parser.parse_args()
+    sizes = [size for size in SIZES if size <= args.max_elements]
+    benchmark_names = args.benchmark or [name for name, _ in BENCHMARKS]
+    report = run(sizes, benchmark_names)
+    output = args.output or get_default_output()
+    with open(output, 'w') as output_file:
+        json.dump(report, output_file, indent=2)
+    print("Results written to {0}".format(output))
+    if args.compare is not None:
+        with open(args.compare) as baseline_file:
+            compare(report, json.load(baseline_file))
+
+if __name__ == '__main__':
+    main()
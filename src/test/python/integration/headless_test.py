@@ -0,0 +1,34 @@
+'''
+Drives the complete application in headless mode
+'''
+import io
+import json
+import os
+import time
+import unittest
+
+import pygame
+
+from bowser.app import Bowser
+
+class HeadlessTest(unittest.TestCase):
+
+    def __create_session(self, keys):
+        location = os.path.abspath(os.path.join(os.path.dirname(__file__), "../manual/albums.ram"))
+        records = [{'type': 'session', 'location': location, 'started': 0}]
+        for index, key in enumerate(keys):
+            records.append({'type': 'key', 'time': index, 'key': key, 'mod': 0})
+        return io.StringIO('\n'.join(json.dumps(record) for record in records))
+
+    def test_replay_headless(self):
+        bowser = Bowser(headless=True, frames_per_second=None)
+        try:
+            #pylint: disable=no-member
+            replayer = bowser.replay_session(self.__create_session([pygame.K_DOWN, pygame.K_DOWN]), real_time=False)
+            replayer.finished.join()
+            #Injected events are handled on the frame after they are injected
+            time.sleep(0.1)
+        finally:
+            bowser.stop()
+        utterances = [' '.join(utterance.split()) for utterance in bowser.audio_system.tts_channel.utterances]
+        self.assertEqual(["Albums", "Hits of the caveman times", "The blues"], utterances)
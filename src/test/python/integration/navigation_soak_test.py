@@ -0,0 +1,55 @@
+'''
+A soak test which replaces the document many times and ensures memory stays flat
+'''
+import gc
+import logging
+import os
+import tracemalloc
+import unittest
+
+from bowser import rom
+from bowser.rom import RomElement, Window
+from bowser.systems.event import GLOBAL_DISPATCHER
+from bowser.systems.focus import FocusSystem
+from bowser.xmlparse import XmlParser
+
+class NavigationSoakTest(unittest.TestCase):
+
+    WARMUP_NAVIGATIONS = 200
+    NAVIGATIONS = 3000
+    #: Allowed growth (in bytes) between the end of the warmup and the end of the run
+    MAX_GROWTH = 256 * 1024
+
+    def setUp(self):
+        #Captured log records would otherwise show up as growth
+        logging.disable(logging.INFO)
+        self.window = Window()
+        self.focus_system = FocusSystem(self.window)
+        self.parser = XmlParser(rom.create_processors_list(), RomElement)
+        self.page_path = os.path.join(os.path.dirname(__file__), "../manual/albums.ram")
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+        GLOBAL_DISPATCHER.discard_pending_events()
+
+    def __navigate(self, times):
+        for _ in range(times):
+            with open(self.page_path) as page_file:
+                self.window.root_element = self.parser.parse(page_file)
+
+    def test_memory_is_flat(self):
+        tracemalloc.start()
+        try:
+            self.__navigate(NavigationSoakTest.WARMUP_NAVIGATIONS)
+            gc.collect()
+            baseline, _ = tracemalloc.get_traced_memory()
+            listener_count = len(GLOBAL_DISPATCHER._listeners_map)
+            self.__navigate(NavigationSoakTest.NAVIGATIONS)
+            gc.collect()
+            final, _ = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(listener_count, len(GLOBAL_DISPATCHER._listeners_map),
+                         "Listeners from replaced documents were not released")
+        self.assertLess(final - baseline, NavigationSoakTest.MAX_GROWTH,
+                        "Memory grew by {0} bytes over {1} navigations".format(final - baseline, NavigationSoakTest.NAVIGATIONS))
@@ -0,0 +1,60 @@
+'''
+Tests for the asynchronous event queue of the event dispatcher
+'''
+import unittest
+
+from bowser import rom
+from bowser.rom import RomElement, Window
+from bowser.systems.event import GLOBAL_DISPATCHER, Event
+from bowser.systems.focus import FocusRequestEvent
+from bowser.xmlparse import XmlParser
+
+class AsyncEventTest(unittest.TestCase):
+
+    def setUp(self):
+        #Other tests may leave events (e.g. focus predictions) on the shared dispatcher
+        GLOBAL_DISPATCHER.discard_pending_events()
+        self.window = Window()
+        parser = XmlParser(rom.create_processors_list(), RomElement)
+        self.root = parser.fromstring('<ram><p>one</p><p>two</p></ram>')
+        self.received = []
+        self.window.add_event_listener('async', self.__record)
+        self.window.add_event_listener(FocusRequestEvent.name, self.__record)
+
+    def tearDown(self):
+        self.window.remove_event_listener('async', self.__record)
+        self.window.remove_event_listener(FocusRequestEvent.name, self.__record)
+        GLOBAL_DISPATCHER.discard_pending_events()
+
+    def __record(self, event):
+        self.received.append(event)
+
+    def test_events_are_ordered_and_batched(self):
+        events = [Event('async', synchronous=False) for _ in range(GLOBAL_DISPATCHER.async_batch_size + 1)]
+        for event in events:
+            self.root[0].dispatch_event(event)
+        self.assertEqual([], self.received, "Asynchronous events were dispatched before the dispatcher iterated")
+        GLOBAL_DISPATCHER.iterate()
+        self.assertEqual(events[:-1], self.received, "The first batch was not dispatched in order")
+        GLOBAL_DISPATCHER.iterate()
+        self.assertEqual(events, self.received, "The remaining event was not dispatched by the next batch")
+
+    def test_mergeable_events_coalesce(self):
+        first = Event('async', synchronous=False, mergeable=True)
+        unrelated = Event('async', synchronous=False)
+        second = Event('async', synchronous=False, mergeable=True)
+        other_target = Event('async', synchronous=False, mergeable=True)
+        self.root[0].dispatch_event(first)
+        self.root[0].dispatch_event(unrelated)
+        self.root[0].dispatch_event(second)
+        self.root[1].dispatch_event(other_target)
+        self.assertEqual(3, GLOBAL_DISPATCHER.get_pending_event_count())
+        GLOBAL_DISPATCHER.iterate()
+        self.assertEqual([unrelated, second, other_target], self.received)
+
+    def test_focus_requests_supersede_each_other(self):
+        self.root[0].focus(synchronous=False)
+        self.root[1].focus(synchronous=False)
+        GLOBAL_DISPATCHER.iterate()
+        self.assertEqual(1, len(self.received), "A superseded focus request was dispatched")
+        self.assertEqual(self.root[1].get_id(), self.received[0].target.get_id())
@@ -0,0 +1,139 @@
+'''
+Tests for bowser's futures
+'''
+import asyncio
+import concurrent.futures
+import threading
+import unittest
+
+from bowser.custom_futures import Future, CancelledError
+
+class FutureTest(unittest.TestCase):
+
+    def test_callbacks_run_outside_the_lock(self):
+        future = Future()
+        other_thread_done = []
+        def callback(_):
+            #Another thread can use the future while the callback is running
+            thread = threading.Thread(target=lambda: other_thread_done.append(future.join(1)))
+            thread.start()
+            thread.join(1)
+        future.add_callback(callback)
+        future.fulfill()
+        self.assertEqual([True], other_thread_done)
+
+    def test_callbacks_run_on_executor(self):
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        future = Future(callback_executor=executor)
+        ran_on = []
+        called = threading.Event()
+        future.add_callback(lambda _: (ran_on.append(threading.current_thread()), called.set()))
+        future.fulfill()
+        self.assertTrue(called.wait(1))
+        self.assertIsNot(threading.current_thread(), ran_on[0])
+        executor.shutdown()
+
+    def test_completes_once(self):
+        future = Future()
+        calls = []
+        future.add_callback(calls.append)
+        self.assertTrue(future.fulfill(1))
+        self.assertFalse(future.cancel())
+        self.assertFalse(future.fulfill(2))
+        self.assertEqual([1], calls)
+        self.assertFalse(future.cancelled)
+        self.assertEqual(1, future.result())
+
+    def test_join_and_result_timeouts(self):
+        future = Future()
+        self.assertFalse(future.join(0.01))
+        self.assertRaises(TimeoutError, future.result, 0.01)
+        future.cancel()
+        self.assertTrue(future.join(0.01))
+        self.assertRaises(CancelledError, future.result)
+        failed = Future()
+        failed.fail(ValueError("bad"))
+        self.assertRaises(ValueError, failed.result)
+
+    def test_callbacks_not_triggered_on_cancel(self):
+        future = Future()
+        calls = []
+        future.add_callback(calls.append, trigger_on_cancel=False)
+        future.cancel()
+        future.add_callback(calls.append, trigger_on_cancel=False)
+        self.assertEqual([], calls)
+
+    def test_then(self):
+        first = Future()
+        inner = Future()
+        chained = first.then(lambda value: value + 1).then(lambda value: inner.then(lambda other: value * other))
+        first.fulfill(1)
+        self.assertFalse(chained.finished)
+        inner.fulfill(10)
+        self.assertEqual(20, chained.result(0))
+        failing = first.then(lambda value: value / 0)
+        self.assertIsInstance(failing.exception, ZeroDivisionError)
+        cancelled = Future()
+        after_cancel = cancelled.then(lambda value: value)
+        cancelled.cancel()
+        self.assertTrue(after_cancel.cancelled)
+
+    def test_all(self):
+        futures = [Future() for _ in range(3)]
+        combined = Future.all(futures)
+        futures[2].fulfill('c')
+        futures[0].fulfill('a')
+        self.assertFalse(combined.finished)
+        futures[1].fulfill('b')
+        self.assertEqual(['a', 'b', 'c'], combined.result(0))
+        self.assertEqual([], Future.all([]).result(0))
+        failing = [Future(), Future()]
+        combined = Future.all(failing)
+        failing[1].fail(ValueError())
+        self.assertIsInstance(combined.exception, ValueError)
+
+    def test_any(self):
+        futures = [Future() for _ in range(3)]
+        combined = Future.any(futures)
+        futures[0].cancel()
+        futures[2].fulfill('c')
+        futures[1].fulfill('b')
+        self.assertEqual('c', combined.result(0))
+        cancelled = [Future(), Future()]
+        combined = Future.any(cancelled)
+        cancelled[0].cancel()
+        self.assertFalse(combined.finished)
+        cancelled[1].fail(ValueError())
+        self.assertTrue(combined.cancelled)
+
+    def test_concurrent_bridges(self):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            self.assertEqual(4, Future.from_concurrent(executor.submit(pow, 2, 2)).result(1))
+            self.assertRaises(TypeError, Future.from_concurrent(executor.submit(pow, 2, 'x')).result, 1)
+        future = Future()
+        concurrent_future = future.to_concurrent()
+        future.fulfill(5)
+        self.assertEqual(5, concurrent_future.result(0))
+        cancelled = Future()
+        concurrent_future = cancelled.to_concurrent()
+        cancelled.cancel()
+        self.assertRaises(CancelledError, concurrent_future.result, 0)
+
+    def test_asyncio_bridges(self):
+        future = Future()
+        async def wait_for_future():
+            threading.Timer(0.01, future.fulfill, args=('done',)).start()
+            return await future
+        self.assertEqual('done', asyncio.run(wait_for_future()))
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever)
+        thread.start()
+        try:
+            async def compute():
+                await asyncio.sleep(0.01)
+                return 42
+            self.assertEqual(42, Future.from_awaitable(compute(), loop).result(1))
+        finally:
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
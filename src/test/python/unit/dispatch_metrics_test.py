@@ -0,0 +1,47 @@
+'''
+Tests for the opt-in dispatch metrics of the event dispatcher
+'''
+import json
+import time
+import unittest
+
+from bowser.rom import Window
+from bowser.systems.event import GLOBAL_DISPATCHER, Event
+
+class DispatchMetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.window = Window()
+        self.window.add_event_listener('metrics', self.slow_listener)
+        self.window.add_event_listener('metrics', self.fast_listener, use_capture=True)
+
+    def tearDown(self):
+        self.window.remove_event_listener('metrics', self.slow_listener)
+        self.window.remove_event_listener('metrics', self.fast_listener, use_capture=True)
+        GLOBAL_DISPATCHER.disable_metrics()
+
+    def slow_listener(self, _):
+        time.sleep(0.02)
+
+    def fast_listener(self, _):
+        pass
+
+    def test_disabled_by_default(self):
+        self.assertIsNone(GLOBAL_DISPATCHER.metrics)
+        self.window.dispatch_event(Event('metrics'))
+        self.assertIsNone(GLOBAL_DISPATCHER.metrics)
+
+    def test_records_events_phases_and_listeners(self):
+        metrics = GLOBAL_DISPATCHER.enable_metrics(slow_listener_threshold=0.01)
+        self.window.dispatch_event(Event('metrics'))
+        self.window.dispatch_event(Event('metrics'))
+        self.assertEqual(2, metrics.get_event_stats('metrics')['count'])
+        self.assertEqual(2, metrics.get_phase_stats('metrics', 'target')['count'])
+        self.assertEqual(2, metrics.get_listener_stats(self.slow_listener)['count'])
+        self.assertGreaterEqual(metrics.get_listener_stats(self.slow_listener)['total'], 0.04)
+        slow_listeners = metrics.get_slow_listeners()
+        self.assertEqual(2, len(slow_listeners))
+        self.assertTrue(slow_listeners[0]['listener'].endswith('DispatchMetricsTest.slow_listener'))
+        snapshot = json.loads(metrics.to_json())
+        self.assertIn('metrics', snapshot['events'])
+        self.assertIn('target', snapshot['phases']['metrics'])
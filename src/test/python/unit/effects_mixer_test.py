@@ -0,0 +1,82 @@
+'''
+Tests for the pooled effects mixer and the routing of pygame user events
+'''
+import unittest
+
+import pygame
+
+from bowser.systems.audio import EffectsMixer, NullSound, NullVoice
+from bowser.rom import Window
+from bowser.systems.key_and_frame import KeyAndFrameEngine, NullDisplay, PygameUserEvent, UserEventRouter
+
+class EffectsMixerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.mixer = EffectsMixer([NullVoice(clock=lambda: self.now) for _ in range(2)])
+        self.mixer.initialize()
+        self.effect = NullSound('chime', length=1.0)
+
+    def __advance(self, seconds):
+        self.now += seconds
+        self.mixer._iterate() #pylint: disable=protected-access
+
+    def test_effects_play_concurrently(self):
+        first = self.mixer.play(self.effect)
+        second = self.mixer.play(self.effect)
+        self.assertEqual(2, self.mixer.get_busy_voices())
+        self.__advance(1.0)
+        self.assertTrue(first.finished and second.finished)
+        self.assertFalse(first.cancelled or second.cancelled)
+        self.assertEqual(0, self.mixer.get_busy_voices())
+
+    def test_oldest_lowest_priority_effect_is_stolen(self):
+        low = self.mixer.play(self.effect, EffectsMixer.LOW_PRIORITY)
+        older = self.mixer.play(self.effect)
+        self.__advance(0.5)
+        newer = self.mixer.play(self.effect)
+        self.assertTrue(low.cancelled)
+        stealer = self.mixer.play(self.effect)
+        self.assertTrue(older.cancelled)
+        self.__advance(0.5)
+        self.assertFalse(newer.finished or stealer.finished)
+        self.__advance(0.5)
+        self.assertTrue(newer.finished and not newer.cancelled)
+        self.assertTrue(stealer.finished and not stealer.cancelled)
+        self.assertEqual(2, self.mixer.steals)
+
+    def test_higher_priority_effects_are_not_stolen(self):
+        high = [self.mixer.play(self.effect, EffectsMixer.HIGH_PRIORITY) for _ in range(2)]
+        rejected = self.mixer.play(self.effect)
+        self.assertTrue(rejected.cancelled)
+        self.assertEqual(1, self.mixer.rejections)
+        self.assertFalse(any(future.finished for future in high))
+
+    def test_interrupt(self):
+        futures = [self.mixer.play(self.effect) for _ in range(2)]
+        self.mixer.interrupt()
+        self.assertTrue(all(future.cancelled for future in futures))
+        self.assertEqual(0, self.mixer.get_busy_voices())
+
+class UserEventRouterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.router = UserEventRouter()
+        self.event_bus = Window()
+        self.engine = KeyAndFrameEngine(None, self.event_bus, NullDisplay(), self.router)
+        self.broadcast = []
+        self.event_bus.add_event_listener(PygameUserEvent.name, lambda event: self.broadcast.append(event.event_code))
+
+    def test_registered_codes_go_straight_to_their_handler(self):
+        #pylint: disable=no-member
+        handled = []
+        self.router.register(pygame.USEREVENT + 3, handled.append)
+        self.engine.inject_events([pygame.event.Event(pygame.USEREVENT + 3), pygame.event.Event(pygame.USEREVENT + 4)])
+        self.engine.iterate()
+        self.assertEqual([pygame.USEREVENT + 3], handled)
+        self.assertEqual([pygame.USEREVENT + 4], self.broadcast)
+        self.assertRaises(Exception, self.router.register, pygame.USEREVENT + 3, handled.append)
+        self.router.unregister(pygame.USEREVENT + 3)
+        self.engine.inject_events([pygame.event.Event(pygame.USEREVENT + 3)])
+        self.engine.iterate()
+        self.assertEqual([pygame.USEREVENT + 4, pygame.USEREVENT + 3], self.broadcast)
@@ -0,0 +1,122 @@
+'''
+Tests for the focus index of the focus system
+'''
+import unittest
+
+from bowser import rom, Attributes
+from bowser.rom import RomElement, Window
+from bowser.systems.event import GLOBAL_DISPATCHER
+from bowser.systems.focus import FocusSystem, FocusIndex
+from bowser.xmlparse import XmlParser
+
+class FocusIndexTest(unittest.TestCase):
+
+    DOCUMENT = ('<ram><container focusable="no"><p focusable="no"><b>one</b></p><p>two</p></container>'
+                '<container><title>Second</title><p>three</p></container>'
+                '<container focusable="no"><p focusable="no">four</p></container></ram>')
+
+    def setUp(self):
+        self.window = Window()
+        self.focus_system = FocusSystem(self.window)
+        self.parser = XmlParser(rom.create_processors_list(), RomElement)
+        self.root = self.parser.fromstring(FocusIndexTest.DOCUMENT)
+        self.window.root_element = self.root
+
+    def tearDown(self):
+        rom.release_elements(element.get_id() for element in self.root.iter())
+        GLOBAL_DISPATCHER.discard_pending_events()
+
+    @staticmethod
+    def __is_focusable(element):
+        return element.get_bool(Attributes.Focusable, default_value=True)
+
+    def __search(self, target):
+        '''
+        The search the focus index replaces
+        '''
+        result = target.dfs(self.__is_focusable)
+        if result is None:
+            result = target.find_first_ancestor(self.__is_focusable)
+        return result
+
+    def test_index_matches_search(self):
+        focus_index = FocusIndex(self.root, self.__is_focusable)
+        self.assertEqual(5, len(focus_index))
+        for element in self.root.iter():
+            self.assertTrue(focus_index.contains(element))
+            self.assertIs(self.__search(element), focus_index.find_first_focusable(element),
+                          "Wrong focus target for {0}".format(element))
+
+    def __assert_index_matches_search(self, focus_index):
+        for element in self.root.iter():
+            self.assertTrue(focus_index.contains(element))
+            self.assertIs(self.__search(element), focus_index.find_first_focusable(element),
+                          "Wrong focus target for {0}".format(element))
+
+    def __modify(self, focus_index):
+        first, second, third = self.root
+        added = self.parser.fromstring('<container><p>five</p><p focusable="no"><b>six</b></p></container>')
+        second.insert(1, added)
+        focus_index.update([second])
+        self.__assert_index_matches_search(focus_index)
+        #Moved within the document
+        third.append(first[1])
+        first[0].set(Attributes.Focusable, True)
+        focus_index.update([third, first[0]])
+        self.__assert_index_matches_search(focus_index)
+        second.remove(added)
+        focus_index.update([second, added])
+        self.__assert_index_matches_search(focus_index)
+        self.assertFalse(focus_index.contains(added[0]))
+        rom.release_elements(element.get_id() for element in added.iter())
+
+    def test_index_follows_modifications(self):
+        self.__modify(FocusIndex(self.root, self.__is_focusable))
+
+    def test_index_follows_modifications_beyond_gaps(self):
+        #Without room between positions every modification re-indexes the parent's range
+        position_gap = FocusIndex.POSITION_GAP
+        FocusIndex.POSITION_GAP = 1
+        try:
+            self.__modify(FocusIndex(self.root, self.__is_focusable))
+        finally:
+            FocusIndex.POSITION_GAP = position_gap
+
+    def test_only_modified_subtree_is_reindexed(self):
+        checked = []
+        def is_focusable(element):
+            checked.append(element)
+            return self.__is_focusable(element)
+        focus_index = FocusIndex(self.root, is_focusable)
+        del checked[:]
+        paragraph = self.root[1][1]
+        paragraph.append(self.parser.fromstring('<b>bold</b>'))
+        focus_index.update([paragraph])
+        self.assertEqual([paragraph, paragraph[0]], checked)
+        self.__assert_index_matches_search(focus_index)
+
+    def test_focus_follows_modifications(self):
+        self.window.root_element = self.parser.fromstring(
+            '<ram><container><p focusable="no"><b focusable="no">one</b></p></container></ram>')
+        container = self.window.root_element[0]
+        paragraph = container[0]
+        paragraph.focus()
+        self.assertIs(container, self.focus_system.currently_focused)
+        paragraph.set(Attributes.Focusable, True)
+        paragraph.focus()
+        self.assertIs(paragraph, self.focus_system.currently_focused)
+        paragraph.set(Attributes.Focusable, False)
+        added = self.parser.fromstring('<i>five</i>')
+        paragraph.append(added)
+        paragraph.focus()
+        self.assertIs(added, self.focus_system.currently_focused)
+        paragraph.remove(added)
+        paragraph.focus()
+        self.assertIs(container, self.focus_system.currently_focused)
+        rom.release_elements(element.get_id() for element in self.window.root_element.iter())
+
+    def test_replacing_document_rebuilds_index(self):
+        new_root = self.parser.fromstring('<ram><p>new</p></ram>')
+        self.window.root_element = new_root
+        self.assertIs(new_root[0], self.focus_system.currently_focused)
+        rom.release_elements(element.get_id() for element in new_root.iter())
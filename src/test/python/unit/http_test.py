@@ -0,0 +1,117 @@
+'''
+Tests for the pooled HTTP service
+'''
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import socket
+import threading
+import time
+import unittest
+
+from bowser.systems.http import HttpClientPool, HttpRequest, HttpService
+
+class _Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self): #pylint: disable=invalid-name
+        server = self.server
+        with server.lock:
+            server.active += 1
+            server.peak = max(server.peak, server.active)
+            server.connections.add(self.client_address)
+        try:
+            if self.path.startswith('/slow'):
+                time.sleep(0.2)
+            body = self.path.encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def log_message(self, *args): #pylint: disable=arguments-differ
+        pass
+
+class HttpClientPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self.server.daemon_threads = True
+        self.server.lock = threading.Lock()
+        self.server.active = 0
+        self.server.peak = 0
+        self.server.connections = set()
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.base = 'http://127.0.0.1:{0}'.format(self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def test_connections_are_kept_alive(self):
+        pool = HttpClientPool()
+        for index in range(5):
+            response, content = pool.request('{0}/page{1}'.format(self.base, index))
+            self.assertEqual(200, response.status)
+            self.assertEqual('/page{0}'.format(index).encode('utf-8'), content)
+        self.assertEqual(1, len(self.server.connections))
+        self.assertEqual(0.8, pool.metrics.get_reuse_rate())
+        self.assertEqual(1, pool.metrics.connections_opened)
+        pool.close()
+
+    def test_concurrency_per_host_is_bounded(self):
+        pool = HttpClientPool(max_connections_per_host=2)
+        results = []
+        def fetch(index):
+            results.append(pool.request('{0}/slow{1}'.format(self.base, index))[1])
+        threads = [threading.Thread(target=fetch, args=(index,)) for index in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(6, len(results))
+        self.assertEqual(2, self.server.peak)
+        self.assertEqual(2, pool.metrics.connections_opened)
+        self.assertGreater(pool.metrics.snapshot()['wait']['max'], 0.1)
+        pool.close()
+
+    def test_read_timeout(self):
+        pool = HttpClientPool(read_timeout=0.05)
+        self.assertRaises(socket.timeout, pool.request, self.base + '/slow')
+        #The timed out connection is not reused
+        response, _ = pool.request(self.base + '/fast')
+        self.assertEqual(200, response.status)
+        self.assertEqual(2, pool.metrics.connections_opened)
+        pool.close()
+
+    def test_hosts_are_forgotten(self):
+        pool = HttpClientPool(max_connections=2)
+        for index in range(10):
+            with pool.borrow_client('http:host{0}'.format(index)):
+                self.assertLessEqual(pool.get_host_count(), 3)
+        #Only the hosts of the idle clients are left
+        self.assertEqual(2, pool.get_host_count())
+        with self.assertRaises(ValueError):
+            with pool.borrow_client('http:failing'):
+                raise ValueError()
+        self.assertEqual(2, pool.get_host_count())
+        pool.close()
+        self.assertEqual(0, pool.get_host_count())
+
+    def test_service_uses_pool(self):
+        service = HttpService(max_connections_per_host=2)
+        done = threading.Event()
+        contents = []
+        def on_success(_, content):
+            contents.append(content)
+            if len(contents) == 4:
+                done.set()
+        for index in range(4):
+            service.get(HttpRequest('{0}/page{1}'.format(self.base, index))).success(on_success)
+        self.assertTrue(done.wait(5))
+        self.assertEqual(4, service.pool.metrics.requests)
+        self.assertLessEqual(self.server.peak, 2)
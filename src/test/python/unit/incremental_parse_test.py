@@ -0,0 +1,55 @@
+'''
+Tests for incremental parsing and publishing of partially loaded resources
+'''
+import os
+import tempfile
+import unittest
+
+from bowser import rom
+from bowser.rom import RomElement, Window
+from bowser.systems.resource import ResourceLoader
+from bowser.xmlparse import XmlParser
+
+class IncrementalParseTest(unittest.TestCase):
+
+    ITEM_COUNT = 2000
+
+    def setUp(self):
+        self.window = Window()
+        self.parser = XmlParser(rom.create_processors_list(), RomElement)
+        items = ''.join('<p>Item {0}</p>'.format(index) for index in range(IncrementalParseTest.ITEM_COUNT))
+        self.document = '<ram><container><title><p>Albums</p></title>{0}</container></ram>'.format(items)
+
+    def __describe(self, root):
+        return [(element.tag, element.text, element.get(rom.Attributes.Focusable)) for element in root.iter()]
+
+    def test_matches_complete_parse(self):
+        incremental_parse = self.parser.parse_incrementally()
+        encoded = self.document.encode('utf-8')
+        for start in range(0, len(encoded), 100):
+            incremental_parse.feed(encoded[start:start + 100])
+        incremental_parse.close()
+        complete = self.parser.fromstring(self.document)
+        self.assertEqual(self.__describe(complete), self.__describe(incremental_parse.root))
+        ids = [element.get_id() for element in incremental_parse.root.iter()]
+        self.assertEqual(sorted(ids), ids, "Ids were not assigned in document order")
+        self.assertEqual(1, len(incremental_parse.root[0].listeners['focus']), "The container was not post-processed")
+
+    def test_publishes_before_finishing(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.ram', delete=False) as page_file:
+            page_file.write(self.document)
+        try:
+            loader = ResourceLoader(self.window, self.parser, None, incremental=True, chunk_size=256, chunks_per_frame=10)
+            self.window.location = page_file.name
+            root = self.window.root_element
+            self.assertIsNotNone(root, "Nothing was published after the first chunks were parsed")
+            self.assertEqual("Albums", root[0][0][0].text)
+            self.assertLess(len(root[0]), IncrementalParseTest.ITEM_COUNT, "The whole document was parsed before publishing")
+            frames = 0
+            while len(root[0]) < IncrementalParseTest.ITEM_COUNT + 1:
+                loader.iterate()
+                frames += 1
+            self.assertGreater(frames, 1, "The rest of the document was not spread over several frames")
+            self.assertEqual("Item {0}".format(IncrementalParseTest.ITEM_COUNT - 1), root[0][-1].text)
+        finally:
+            os.remove(page_file.name)
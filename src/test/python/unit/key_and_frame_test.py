@@ -0,0 +1,27 @@
+'''
+Tests for the key and frame engine's display backends
+'''
+import os
+import unittest
+
+import pygame
+
+from bowser.systems.key_and_frame import KeyAndFrameEngine
+
+class PygameDisplayTest(unittest.TestCase):
+
+    def setUp(self):
+        #There is no need for a real display
+        os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+    def tearDown(self):
+        pygame.display.quit()
+
+    def test_default_display_initializes(self):
+        engine = KeyAndFrameEngine(None, None)
+        try:
+            engine.initialize()
+        except pygame.error as error:
+            self.skipTest("No pygame video driver is available: {0}".format(error))
+        self.assertIsNotNone(pygame.display.get_surface())
+        engine.iterate()
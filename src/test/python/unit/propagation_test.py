@@ -0,0 +1,79 @@
+'''
+Tests for the propagation path cache in the event dispatcher
+'''
+import unittest
+
+from bowser.rom import RomElement, Window
+from bowser.systems.event import GLOBAL_DISPATCHER, Event
+from bowser.xmlparse import XmlParser
+from bowser import rom
+
+class PropagationPathTest(unittest.TestCase):
+
+    DOCUMENT = '<ram><container><p>one</p><p>two</p></container><container><p>three</p></container></ram>'
+
+    def setUp(self):
+        self.window = Window()
+        self.parser = XmlParser(rom.create_processors_list(), RomElement)
+        self.root = self.parser.fromstring(PropagationPathTest.DOCUMENT)
+        self.window.root_element = self.root
+
+    def __record_path(self, target):
+        visited = []
+        def record(event):
+            visited.append(event.current_target.get_id())
+        for element in self.root.iter():
+            element.add_event_listener('record', record, use_capture=True)
+        self.window.add_event_listener('record', record, use_capture=True)
+        target.dispatch_event(Event('record', bubbles=False))
+        for element in self.root.iter():
+            element.remove_event_listener('record', record, use_capture=True)
+        self.window.remove_event_listener('record', record, use_capture=True)
+        return visited
+
+    def test_path_is_cached(self):
+        leaf = self.root[0][1]
+        first = GLOBAL_DISPATCHER.get_propagation_path(leaf)
+        second = GLOBAL_DISPATCHER.get_propagation_path(leaf)
+        self.assertIs(first, second, "The propagation path was recalculated even though the tree did not change")
+        self.assertEqual([self.window.get_id(), self.root.get_id(), self.root[0].get_id()], [target.get_id() for target in first])
+
+    def test_reparenting_invalidates_path(self):
+        leaf = self.root[0][1]
+        self.__record_path(leaf)
+        second_container = self.root[1]
+        second_container.append(leaf)
+        expected = [self.window.get_id(), self.root.get_id(), second_container.get_id(), leaf.get_id()]
+        self.assertEqual(expected, self.__record_path(leaf), "The event followed a stale propagation path after re-parenting")
+
+    def test_swapping_root_invalidates_path(self):
+        leaf = self.root[0][0]
+        GLOBAL_DISPATCHER.get_propagation_path(leaf)
+        old_root = self.root
+        self.root = self.parser.fromstring(PropagationPathTest.DOCUMENT)
+        wrapper = self.parser.fromstring('<ram></ram>')
+        wrapper.append(old_root)
+        self.window.root_element = wrapper
+        path = [target.get_id() for target in GLOBAL_DISPATCHER.get_propagation_path(leaf)]
+        self.assertEqual([self.window.get_id(), wrapper.get_id(), old_root.get_id(), old_root[0].get_id()], path)
+
+    def test_only_interested_targets_are_visited(self):
+        leaf = self.root[0][1]
+        visited = []
+        def record(event):
+            visited.append((event.event_phase, event.current_target.get_id()))
+        self.window.add_event_listener('sparse', record, use_capture=True)
+        self.root[0].add_event_listener('sparse', record, use_capture=True)
+        self.root.add_event_listener('sparse', record)
+        self.window.add_event_listener('sparse', record)
+        leaf.dispatch_event(Event('sparse'))
+        expected = [(Event.CAPTURING_PHASE, self.window.get_id()), (Event.CAPTURING_PHASE, self.root[0].get_id()),
+                    (Event.BUBBLING_PHASE, self.root.get_id()), (Event.BUBBLING_PHASE, self.window.get_id())]
+        self.assertEqual(expected, visited)
+        self.root.remove_event_listener('sparse', record)
+        del visited[:]
+        leaf.dispatch_event(Event('sparse'))
+        self.assertNotIn((Event.BUBBLING_PHASE, self.root.get_id()), visited, "A removed listener was still visited")
+        self.window.remove_event_listener('sparse', record, use_capture=True)
+        self.root[0].remove_event_listener('sparse', record, use_capture=True)
+        self.window.remove_event_listener('sparse', record)
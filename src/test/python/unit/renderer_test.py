@@ -0,0 +1,185 @@
+'''
+Tests for the text rendered by the rendering system
+'''
+import os
+import unittest
+
+from bowser import rom
+from bowser.rom import RomElement, Window
+from bowser.systems.event import GLOBAL_DISPATCHER
+from bowser.systems.audio import SoundLibrary, NullSound
+from bowser.systems.focus import FocusSystem
+from bowser.systems.renderer import RenderingSystem, split_into_chunks
+from bowser.xmlparse import XmlParser
+
+class _RecordingChannel(object):
+
+    def __init__(self):
+        self.queued = []
+        self.interrupts = 0
+
+    def interrupt(self):
+        self.interrupts += 1
+
+    def queue(self, text):
+        self.queued.append(text)
+
+    def play(self, effect):
+        self.queued.append(effect)
+
+class _RecordingAudioSystem(object):
+
+    def __init__(self):
+        self.tts_channel = _RecordingChannel()
+        self.effects_mixer = _RecordingChannel()
+
+class RenderingSystemTest(unittest.TestCase):
+
+    DOCUMENT = '<ram><container><title>Albums</title><p>One<!--skipped--></p><p>Two <b>bold</b></p></container></ram>'
+
+    def setUp(self):
+        self.window = Window()
+        self.audio_system = _RecordingAudioSystem()
+        self.focus_system = FocusSystem(self.window)
+        self.renderer = RenderingSystem(self.window, self.audio_system)
+        self.parser = XmlParser(rom.create_processors_list(), RomElement)
+        self.window.root_element = self.parser.fromstring(RenderingSystemTest.DOCUMENT)
+        self.container = self.window.root_element[0]
+
+    def tearDown(self):
+        rom.release_elements(element.get_id() for element in self.window.root_element.iter("*"))
+        GLOBAL_DISPATCHER.discard_pending_events()
+
+    def test_renders_subtree_text(self):
+        self.assertEqual('Albums One Two  bold', self.renderer.get_text_to_render(self.container))
+        self.container[1].focus()
+        self.assertEqual('One', self.audio_system.tts_channel.queued[-1])
+
+    def test_text_is_queued_in_chunks(self):
+        self.renderer.max_chunk_chars = 10
+        self.container.focus()
+        self.container[2].text = 'Two. Three four five'
+        self.container[2].focus()
+        self.assertEqual(['Two.', 'Three four', 'five bold'], self.audio_system.tts_channel.queued[-3:])
+
+    def test_text_changes_invalidate_ancestors(self):
+        self.assertEqual('Albums One Two  bold', self.renderer.get_text_to_render(self.container))
+        self.container[2][0].text = 'italic'
+        self.assertEqual('Albums One Two  italic', self.renderer.get_text_to_render(self.container))
+        self.assertEqual('Two  italic', self.renderer.get_text_to_render(self.container[2]))
+
+    def test_child_changes_invalidate_ancestors(self):
+        self.assertEqual('Two  bold', self.renderer.get_text_to_render(self.container[2]))
+        self.assertEqual('Albums One Two  bold', self.renderer.get_text_to_render(self.container))
+        self.container[2].append(self.parser.fromstring('<i>added</i>'))
+        self.assertEqual('Two  bold added', self.renderer.get_text_to_render(self.container[2]))
+        self.assertEqual('Albums One Two  bold added', self.renderer.get_text_to_render(self.container))
+        self.container.remove(self.container[1])
+        self.assertEqual('Albums Two  bold added', self.renderer.get_text_to_render(self.container))
+
+    def test_moved_children_invalidate_both_containers(self):
+        self.window.root_element = self.parser.fromstring(
+            '<ram><container><p>a1</p><p>a2</p><p>a3</p></container><container><p>b1</p></container></ram>')
+        first, second = self.window.root_element
+        self.assertEqual('a1 a2 a3', self.renderer.get_text_to_render(first))
+        self.assertEqual('b1', self.renderer.get_text_to_render(second))
+        second.append(first[2])
+        self.assertEqual('a1 a2', self.renderer.get_text_to_render(first))
+        self.assertEqual('b1 a3', self.renderer.get_text_to_render(second))
+
+    def test_max_render_chars(self):
+        self.renderer.max_render_chars = 12
+        self.assertEqual('Albums One', self.renderer.get_text_to_render(self.container))
+        self.renderer.max_render_chars = 3
+        self.assertEqual('Two', self.renderer.get_text_to_render(self.container[2]))
+        self.renderer.max_render_chars = None
+        self.assertEqual('Two  bold', self.renderer.get_text_to_render(self.container[2]))
+        self.renderer.max_render_chars = 2
+        self.assertEqual("On", self.renderer.get_text_to_render(self.container[1]))
+
+class SplitIntoChunksTest(unittest.TestCase):
+
+    def test_short_text_is_one_chunk(self):
+        self.assertEqual(['Hits of the caveman times'], split_into_chunks('  Hits of the\n caveman times ', 200))
+        self.assertEqual([], split_into_chunks(' \n ', 200))
+
+    def test_first_sentence_is_spoken_alone(self):
+        text = 'First sentence. Second one! Third? Fourth; fifth.'
+        self.assertEqual(['First sentence.', 'Second one! Third? Fourth; fifth.'], split_into_chunks(text, 200))
+        self.assertEqual(['First sentence.', 'Second one!', 'Third? Fourth;', 'fifth.'], split_into_chunks(text, 15))
+
+    def test_long_sentences_are_split_at_phrases_then_words(self):
+        text = 'one two three, four five six seven eight nine'
+        self.assertEqual(['one two three,', 'four five six', 'seven eight', 'nine'], split_into_chunks(text, 14))
+        self.assertEqual(['abcd', 'efgh'], split_into_chunks('abcdefgh', 4))
+
+    def test_chunks_are_bounded(self):
+        self.assertTrue(all(len(chunk) <= 50 for chunk in split_into_chunks('word ' * 1000, 50)))
+
+class SpeechDebounceTest(unittest.TestCase):
+
+    DOCUMENT = '<ram><container><p>One</p><p>Two</p><p>Three</p><p>Four</p></container></ram>'
+    EFFECTS_DIR = os.path.join(os.path.dirname(__file__), "../../../main/python/bowser/sounds/effects")
+
+    def setUp(self):
+        self.now = 100.0
+        self.window = Window()
+        self.audio_system = _RecordingAudioSystem()
+        self.focus_system = FocusSystem(self.window)
+        self.sound_library = SoundLibrary(SpeechDebounceTest.EFFECTS_DIR, sound_factory=NullSound)
+        self.sound_library.load()
+        self.renderer = RenderingSystem(self.window, self.audio_system, settle_interval=0.25,
+                                        sound_library=self.sound_library, clock=lambda: self.now)
+        parser = XmlParser(rom.create_processors_list(), RomElement)
+        self.window.root_element = parser.fromstring(SpeechDebounceTest.DOCUMENT)
+        self.container = self.window.root_element[0]
+        self.spoken = self.audio_system.tts_channel.queued
+        self.effects = self.audio_system.effects_mixer.queued
+
+    def tearDown(self):
+        rom.release_elements(element.get_id() for element in self.window.root_element.iter("*"))
+        GLOBAL_DISPATCHER.discard_pending_events()
+
+    def __focus(self, index, delay):
+        self.now += delay
+        self.container[index].focus()
+        self.renderer.iterate()
+
+    def test_settled_focus_is_spoken_immediately(self):
+        #Loading the document focused the first paragraph
+        self.__focus(1, 1)
+        self.__focus(2, 1)
+        self.assertEqual(['One', 'Two', 'Three'], self.spoken)
+        self.assertEqual([], self.effects)
+        self.assertEqual(3, self.renderer.metrics.spoken)
+
+    def test_rapid_focus_changes_play_effect_until_settled(self):
+        self.__focus(1, 0.125)
+        self.__focus(2, 0.125)
+        self.__focus(3, 0.125)
+        self.assertEqual(['One'], self.spoken)
+        self.assertEqual(3, len(self.effects))
+        self.now += 0.125
+        self.renderer.iterate()
+        self.assertEqual(['One'], self.spoken)
+        self.now += 0.125
+        self.renderer.iterate()
+        self.assertEqual(['One', 'Four'], self.spoken)
+        self.renderer.iterate()
+        self.assertEqual(['One', 'Four'], self.spoken)
+        snapshot = self.renderer.metrics.snapshot()
+        self.assertEqual(2, snapshot['spoken'])
+        self.assertEqual(2, snapshot['suppressed'])
+        self.assertEqual(0.5, snapshot['suppression_rate'])
+        self.assertEqual(1, snapshot['settle_delay']['count'])
+
+    def test_focus_after_burst_waits_for_settle(self):
+        self.__focus(1, 0.125)
+        #Focus changed again after the burst settled but before it was spoken
+        self.now += 0.5
+        self.container[2].focus()
+        self.renderer.iterate()
+        self.assertEqual(['One'], self.spoken)
+        self.now += 0.25
+        self.renderer.iterate()
+        self.assertEqual(['One', 'Three'], self.spoken)
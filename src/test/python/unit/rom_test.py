@@ -0,0 +1,229 @@
+'''
+Tests for the tree searches of TreeNode and RomElement
+'''
+import gc
+import sys
+import unittest
+import weakref
+
+import pygame
+
+from bowser import rom, Attributes
+from bowser.predicates import TagPredicate, BoolAttributePredicate, AttributePredicate
+from bowser.rom import RomElement, Window, LocationChangedEvent
+from bowser.systems.event import GLOBAL_DISPATCHER
+from bowser.systems.focus import FocusSystem
+from bowser.systems.key_and_frame import KeyEvent
+from bowser.xmlparse import XmlParser
+
+class TreeSearchTest(unittest.TestCase):
+
+    '''
+    The test document has the form:
+
+        ram-a-b(focusable=YES)-c
+           -d-e(focusable=no)
+             -f
+    '''
+    DOCUMENT = '<ram><a focusable="no"><b focusable="YES"><c/></b></a><d><e focusable="no"/><f/></d></ram>'
+
+    class CountingPredicate(object):
+
+        def __init__(self, tag):
+            self.tag = tag
+            self.evaluated = []
+
+        def __call__(self, node):
+            self.evaluated.append(node.tag)
+            return node.tag == self.tag
+
+    def setUp(self):
+        self.parser = XmlParser(rom.create_processors_list(), RomElement)
+        self.roots = []
+
+    def tearDown(self):
+        for root in self.roots:
+            rom.release_elements(element.get_id() for element in root.iter("*"))
+
+    def __parse(self, text):
+        root = self.parser.fromstring(text)
+        self.roots.append(root)
+        return root
+
+    def test_bfs_evaluates_each_node_once(self):
+        root = self.__parse(TreeSearchTest.DOCUMENT)
+        predicate = TreeSearchTest.CountingPredicate('f')
+        self.assertEqual('f', root.bfs(predicate).tag)
+        self.assertEqual(['ram', 'a', 'd', 'b', 'e', 'f'], predicate.evaluated)
+
+    def test_dfs_is_preorder(self):
+        root = self.__parse(TreeSearchTest.DOCUMENT)
+        predicate = TreeSearchTest.CountingPredicate('e')
+        self.assertEqual('e', root.dfs(predicate, include_self=False).tag)
+        self.assertEqual(['a', 'b', 'c', 'd', 'e'], predicate.evaluated)
+
+    def test_xpath_predicates_match_python_predicates(self):
+        root = self.__parse(TreeSearchTest.DOCUMENT)
+        focusable = BoolAttributePredicate(Attributes.Focusable, default_value=True)
+        def python_focusable(node):
+            return node.get_bool(Attributes.Focusable, default_value=True)
+        for element in root.iter():
+            self.assertEqual(python_focusable(element), focusable(element), "Mismatch on {0}".format(element))
+            for include_self in [True, False]:
+                self.assertEqual(element.dfs(python_focusable, include_self), element.dfs(focusable, include_self))
+                self.assertEqual(element.bfs(python_focusable, include_self), element.bfs(focusable, include_self))
+                self.assertEqual(element.find_first_ancestor(python_focusable, include_self),
+                                 element.find_first_ancestor(focusable, include_self))
+        self.assertEqual('d', root.bfs(focusable, include_self=False).tag, "The fast breadth first search went depth first")
+        self.assertEqual('f', root.bfs(TagPredicate('f')).tag)
+        self.assertEqual('b', root.dfs(AttributePredicate(Attributes.Focusable, 'YES')).tag)
+        self.assertIsNone(root.dfs(TagPredicate('missing')))
+
+    def test_deep_trees(self):
+        depth = sys.getrecursionlimit() * 2
+        root = self.__parse('<ram>' + '<container>' * depth + '<p/>' + '</container>' * depth + '</ram>')
+        leaf = root.dfs(lambda node: node.tag == 'p')
+        self.assertIsNotNone(leaf)
+        self.assertEqual(leaf, root.bfs(lambda node: node.tag == 'p'))
+        self.assertEqual(root, leaf.find_first_ancestor(lambda node: node.tag == 'ram'))
+        visited = []
+        root.dfs_do(lambda node: visited.append(node))
+        self.assertEqual(depth + 2, len(visited))
+
+class ElementIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = XmlParser(rom.create_processors_list(), RomElement)
+        self.window = Window()
+        self.window.root_element = self.parser.fromstring('<ram><container><p>a</p><p>b</p></container></ram>')
+
+    def tearDown(self):
+        root = self.window.root_element
+        rom.release_elements(element.get_id() for element in root.iter("*"))
+
+    def test_windows_keep_their_own_listeners(self):
+        heard = []
+        self.window.add_event_listener(LocationChangedEvent.name, heard.append)
+        other_window = Window()
+        other_window.location = 'elsewhere'
+        self.window.location = 'here'
+        self.assertEqual(['here'], [event.new_value for event in heard])
+        self.assertNotEqual(self.window.get_id(), other_window.get_id())
+        self.window.remove_event_listener(LocationChangedEvent.name, heard.append)
+
+    def test_get_element_by_id(self):
+        for element in self.window.root_element.iter():
+            self.assertIs(element, self.window.get_element_by_id(element.get_id()))
+            self.assertIs(element, self.window.get_element_by_id(element.get(Attributes.Id)))
+        self.assertIsNone(self.window.get_element_by_id(-1))
+
+    def test_ids_are_cached(self):
+        paragraph = self.window.root_element[0][0]
+        element_id = paragraph.get_id()
+        paragraph.attrib[Attributes.Id] = "garbage"
+        self.assertEqual(element_id, paragraph.get_id())
+        paragraph.set(Attributes.Id, 100000000)
+        self.assertEqual(100000000, paragraph.get_id())
+        self.assertIsNone(self.window.get_element_by_id(element_id))
+        self.assertIs(paragraph, self.window.get_element_by_id(100000000))
+
+    def test_index_follows_mutations(self):
+        container = self.window.root_element[0]
+        removed = container[0]
+        container.remove(removed)
+        self.assertIsNone(self.window.get_element_by_id(removed.get_id()))
+        container.append(removed)
+        self.assertIs(removed, self.window.get_element_by_id(removed.get_id()))
+        added = self.parser.fromstring('<container><p>c</p></container>')
+        self.assertIsNone(self.window.get_element_by_id(added[0].get_id()), "Not yet in the displayed document")
+        container.insert(0, added)
+        self.assertIs(added[0], self.window.get_element_by_id(added[0].get_id()))
+        del container[0]
+        self.assertIsNone(self.window.get_element_by_id(added[0].get_id()))
+        paragraph_id = container[0].get_id()
+        container.clear()
+        self.assertIsNone(self.window.get_element_by_id(paragraph_id))
+
+    def test_replaced_documents_are_released(self):
+        old_paragraph = weakref.ref(self.window.root_element[0][0])
+        self.window.root_element = self.parser.fromstring('<ram><p>new</p></ram>')
+        unused_paragraph = weakref.ref(self.parser.fromstring('<ram><p>unused</p></ram>')[0])
+        gc.collect()
+        self.assertIsNone(old_paragraph())
+        self.assertIsNone(unused_paragraph())
+
+    def test_documents_with_elements_without_ids_are_released(self):
+        container = self.window.root_element[0]
+        container.append(RomElement('p'))
+        self.window.root_element = self.parser.fromstring('<ram><p>new</p></ram>')
+        self.assertEqual('new', self.window.root_element[0].text)
+
+    def test_moved_elements_change_index(self):
+        container = self.window.root_element[0]
+        other_root = self.parser.fromstring('<ram><p>c</p></ram>')
+        moved = other_root[0]
+        self.assertIs(moved, other_root.get_element_index().get(moved.get_id()))
+        container.append(moved)
+        self.assertIsNone(other_root.get_element_index().get(moved.get_id()))
+        self.assertIs(moved, self.window.get_element_by_id(moved.get_id()))
+        other_root.append(moved)
+        self.assertIs(moved, other_root.get_element_index().get(moved.get_id()))
+        self.assertIsNone(self.window.get_element_by_id(moved.get_id()))
+
+class ContainerControllerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = XmlParser(rom.create_processors_list(), RomElement)
+        self.window = Window()
+        self.focus_system = FocusSystem(self.window)
+        items = ''.join('<p>{0}</p>'.format(index) for index in range(25))
+        self.window.root_element = self.parser.fromstring(
+            '<ram><container><title>Albums</title>' + items + '</container></ram>')
+        self.container = self.window.root_element[0]
+
+    def tearDown(self):
+        root = self.window.root_element
+        rom.release_elements(element.get_id() for element in root.iter("*"))
+        GLOBAL_DISPATCHER.discard_pending_events()
+
+    def __press(self, key, target=None):
+        target = target if target is not None else self.focus_system.currently_focused
+        target.dispatch_event(KeyEvent(key, 0))
+        return self.focus_system.currently_focused.text
+
+    def test_navigation_keys(self):
+        self.assertEqual('Albums', self.focus_system.currently_focused.text)
+        self.assertEqual('0', self.__press(pygame.K_RIGHT))
+        self.assertEqual('1', self.__press(pygame.K_RIGHT))
+        self.assertEqual('0', self.__press(pygame.K_LEFT))
+        self.assertEqual('0', self.__press(pygame.K_LEFT))
+        self.assertEqual('24', self.__press(pygame.K_END))
+        self.assertEqual('24', self.__press(pygame.K_RIGHT))
+        self.assertEqual('14', self.__press(pygame.K_PAGEUP))
+        self.assertEqual('4', self.__press(pygame.K_PAGEUP))
+        self.assertEqual('0', self.__press(pygame.K_PAGEUP))
+        self.assertEqual('10', self.__press(pygame.K_PAGEDOWN))
+        self.assertEqual('0', self.__press(pygame.K_HOME))
+
+    def test_children_moved_between_containers(self):
+        self.window.root_element = self.parser.fromstring(
+            '<ram><container><p>a1</p><p>a2</p><p>a3</p></container><container><p>b1</p></container></ram>')
+        first, second = self.window.root_element
+        first[0].focus()
+        self.assertEqual('a3', self.__press(pygame.K_END))
+        second.append(first[2])
+        self.assertEqual('a2', self.__press(pygame.K_END, first[0]))
+        self.assertEqual('a2', self.__press(pygame.K_RIGHT))
+        second[0].focus()
+        self.assertEqual('a3', self.__press(pygame.K_END))
+        self.assertEqual('b1', self.__press(pygame.K_LEFT))
+
+    def test_children_are_recounted_after_modification(self):
+        self.__press(pygame.K_END)
+        removed = self.container[-1]
+        self.container.remove(removed)
+        #The focused element was removed so the key goes to the container
+        self.assertEqual('23', self.__press(pygame.K_END, self.container))
+        self.container.insert(1, removed)
+        self.assertEqual('24', self.__press(pygame.K_HOME))
+        self.assertEqual('0', self.__press(pygame.K_RIGHT))
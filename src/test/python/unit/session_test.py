@@ -0,0 +1,54 @@
+'''
+Tests for recording and replaying input sessions
+'''
+import io
+import json
+import unittest
+
+import pygame
+
+from bowser.session import InputRecorder, InputReplayer
+
+class SessionTest(unittest.TestCase):
+
+    class InjectionRecorder(object):
+
+        def __init__(self):
+            self.events = []
+
+        def inject_events(self, events):
+            self.events.extend((event.key, event.mod) for event in events)
+
+    #pylint: disable=no-member
+    KEYS = [(pygame.K_DOWN, 0), (pygame.K_RIGHT, pygame.KMOD_SHIFT), (pygame.K_UP, 0)]
+
+    def __record(self):
+        session_file = io.StringIO()
+        recorder = InputRecorder(session_file)
+        recorder.start('file:///albums.ram')
+        for key, modifiers in SessionTest.KEYS:
+            recorder.record_key(key, modifiers)
+        return io.StringIO(session_file.getvalue())
+
+    def test_replay_matches_recording(self):
+        key_and_frame = SessionTest.InjectionRecorder()
+        replayer = InputReplayer(self.__record(), key_and_frame, real_time=False)
+        self.assertEqual('file:///albums.ram', replayer.location)
+        replayer.iterate()
+        self.assertEqual([], key_and_frame.events, "Events were replayed before the replayer was started")
+        replayer.start()
+        replayer.iterate()
+        self.assertTrue(replayer.finished.finished)
+        self.assertEqual(SessionTest.KEYS, key_and_frame.events)
+
+    def test_real_time_replay_waits(self):
+        session = [{'type': 'session', 'location': 'albums.ram', 'started': 0},
+                   {'type': 'key', 'time': 0, 'key': pygame.K_DOWN, 'mod': 0},
+                   {'type': 'key', 'time': 3600, 'key': pygame.K_UP, 'mod': 0}]
+        session_file = io.StringIO('\n'.join(json.dumps(record) for record in session))
+        key_and_frame = SessionTest.InjectionRecorder()
+        replayer = InputReplayer(session_file, key_and_frame, real_time=True)
+        replayer.start()
+        replayer.iterate()
+        self.assertEqual([(pygame.K_DOWN, 0)], key_and_frame.events)
+        self.assertFalse(replayer.finished.finished, "An event recorded an hour into the session was replayed immediately")
@@ -0,0 +1,109 @@
+'''
+Tests for the lazily loaded sound library and the decoded effect cache
+'''
+import os
+import shutil
+import tempfile
+import unittest
+
+import pygame
+
+from bowser.systems.audio import DecodedEffectCache, NullSound, SoundLibrary
+
+EFFECTS_DIR = os.path.join(os.path.dirname(__file__), "../../../main/python/bowser/sounds/effects")
+
+class SoundLibraryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        for name in ('one', 'two', 'three'):
+            open(os.path.join(self.folder, name + ".ogg"), 'w').close()
+        open(os.path.join(self.folder, "notes.txt"), 'w').close()
+        self.loaded = []
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def __create_sound(self, path):
+        self.loaded.append(os.path.basename(path))
+        return NullSound(path)
+
+    def test_effects_are_loaded_on_first_use(self):
+        library = SoundLibrary(self.folder, sound_factory=self.__create_sound)
+        library.load()
+        self.assertEqual([], self.loaded)
+        self.assertEqual(['one', 'three', 'two'], sorted(library.get_effect_names()))
+        effect = library.get_effect('two')
+        self.assertIs(effect, library.get_effect('two'))
+        self.assertEqual(['two.ogg'], self.loaded)
+        self.assertEqual(1, library.metrics.get_hits(SoundLibrary.MEMORY))
+        self.assertEqual(1, library.metrics.misses)
+        self.assertRaises(KeyError, library.get_effect, 'notes')
+
+    def test_least_recently_used_effects_are_evicted(self):
+        library = SoundLibrary(self.folder, sound_factory=self.__create_sound, max_memory_bytes=250,
+                               sound_bytes=lambda sound: 100)
+        library.load()
+        library.get_effect('one')
+        library.get_effect('two')
+        library.get_effect('one')
+        library.get_effect('three')
+        self.assertEqual(200, library.get_memory_bytes())
+        self.assertEqual(1, library.metrics.get_evictions(SoundLibrary.MEMORY))
+        library.get_effect('one')
+        self.assertEqual(['one.ogg', 'two.ogg', 'three.ogg'], self.loaded)
+        library.get_effect('two')
+        self.assertEqual(['one.ogg', 'two.ogg', 'three.ogg', 'two.ogg'], self.loaded)
+
+    def test_an_effect_larger_than_the_budget_is_kept_while_used(self):
+        library = SoundLibrary(self.folder, sound_factory=self.__create_sound, max_memory_bytes=50,
+                               sound_bytes=lambda sound: 100)
+        library.load()
+        library.get_effect('one')
+        library.get_effect('two')
+        self.assertEqual(100, library.get_memory_bytes())
+        library.get_effect('two')
+        self.assertEqual(['one.ogg', 'two.ogg'], self.loaded)
+
+class DecodedEffectCacheTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        #There is no need for a real audio device
+        os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+        try:
+            pygame.mixer.init(frequency=44100)
+        except pygame.error as error:
+            raise unittest.SkipTest("The pygame mixer is not available: {0}".format(error))
+
+    @classmethod
+    def tearDownClass(cls):
+        pygame.mixer.quit()
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_decoded_effect_is_reused(self):
+        path = os.path.join(EFFECTS_DIR, "chime.ogg")
+        cache = DecodedEffectCache(self.directory)
+        decoded = cache.load(path)
+        self.assertEqual(1, cache.metrics.misses)
+        self.assertEqual(1, len(os.listdir(self.directory)))
+        restarted = DecodedEffectCache(self.directory)
+        cached = restarted.load(path)
+        self.assertEqual(1, restarted.metrics.get_hits(DecodedEffectCache.DISK))
+        self.assertEqual(decoded.get_raw(), cached.get_raw())
+
+    def test_key_depends_on_contents_and_mixer_settings(self):
+        path = os.path.join(EFFECTS_DIR, "chime.ogg")
+        copy = os.path.join(self.directory, "copy.ogg")
+        shutil.copy(path, copy)
+        key = DecodedEffectCache.get_key(path, (44100, -16, 2))
+        self.assertEqual(key, DecodedEffectCache.get_key(copy, (44100, -16, 2)))
+        self.assertNotEqual(key, DecodedEffectCache.get_key(path, (22050, -16, 2)))
+        with open(copy, 'ab') as copy_file:
+            copy_file.write(b'changed')
+        self.assertNotEqual(key, DecodedEffectCache.get_key(copy, (44100, -16, 2)))
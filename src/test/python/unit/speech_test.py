@@ -0,0 +1,312 @@
+'''
+Tests for speculative speech synthesis
+'''
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from bowser import rom
+from bowser.rom import RomElement, Window
+from bowser.systems.audio import NullEffectsChannel, NullSound, NullTtsChannel, PyttsxChannel
+from bowser.systems.event import GLOBAL_DISPATCHER
+from bowser.systems.focus import FocusSystem
+from bowser.systems.renderer import RenderingSystem
+from bowser.systems.speech import SynthesizingTtsChannel, NullSynthesizer, Utterance, UtteranceCache,\
+    CachingSynthesizer
+from bowser.xmlparse import XmlParser
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+def create_null_sound(utterance):
+    return NullSound(utterance.text, utterance.get_length())
+
+class SynthesizingTtsChannelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.playback_channel = NullEffectsChannel(self.clock)
+        self.channel = SynthesizingTtsChannel('test', NullSynthesizer(latency=0.02), self.playback_channel,
+                                              sound_factory=create_null_sound, max_prefetched=2)
+        self.channel.initialize()
+
+    def tearDown(self):
+        self.channel.close()
+
+    def __wait_until_playing(self, future):
+        deadline = time.time() + 5
+        while not future.finished and time.time() < deadline:
+            self.channel._iterate()
+            self.clock.now += 1
+            time.sleep(0.001)
+
+    def test_prefetched_text_is_a_hit(self):
+        self.channel.prefetch("two words")
+        time.sleep(0.05)
+        future = self.channel.queue("two words")
+        self.__wait_until_playing(future)
+        self.assertTrue(future.finished)
+        self.assertFalse(future.cancelled)
+        self.assertEqual(1, self.channel.metrics.hits)
+        self.assertEqual(0, self.channel.metrics.misses)
+        self.assertEqual(1.0, self.channel.metrics.get_hit_rate())
+        self.assertGreater(self.channel.metrics.get_total_latency_saved(), 0)
+
+    def test_unpredicted_text_is_a_miss(self):
+        future = self.channel.queue("not predicted")
+        self.__wait_until_playing(future)
+        self.assertTrue(future.finished)
+        self.assertEqual(0, self.channel.metrics.hits)
+        self.assertEqual(1, self.channel.metrics.misses)
+
+    def test_oldest_predictions_are_wasted(self):
+        for text in ["one", "two", "three"]:
+            self.channel.prefetch(text)
+        self.assertEqual(3, self.channel.metrics.predictions)
+        self.assertEqual(1, self.channel.metrics.wasted)
+        self.channel.queue("one")
+        self.assertEqual(1, self.channel.metrics.misses)
+
+    def test_interrupt_cancels_queued_text(self):
+        first = self.channel.queue("first")
+        second = self.channel.queue("second")
+        self.channel.interrupt()
+        self.assertTrue(first.cancelled)
+        self.assertTrue(second.cancelled)
+
+    def test_utterance_wav_round_trip(self):
+        utterance = NullSynthesizer().synthesize("three little words")
+        copy = Utterance.from_wav(utterance.text, utterance.to_wav())
+        self.assertEqual(utterance.pcm, copy.pcm)
+        self.assertAlmostEqual(0.9, copy.get_length(), places=2)
+
+class _AudioSystem(object):
+
+    def __init__(self):
+        self.tts_channel = NullTtsChannel('test')
+
+class FocusPredictionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.window = Window()
+        self.focus_system = FocusSystem(self.window)
+        self.audio_system = _AudioSystem()
+        self.renderer = RenderingSystem(self.window, self.audio_system)
+        self.parser = XmlParser(rom.create_processors_list(), RomElement)
+        self.window.root_element = self.parser.fromstring(
+            '<ram><container><title>Albums</title><p>one</p><p>two</p><p>three</p></container></ram>')
+        self.container = self.window.root_element[0]
+
+    def tearDown(self):
+        rom.release_elements(element.get_id() for element in self.window.root_element.iter("*"))
+        GLOBAL_DISPATCHER.discard_pending_events()
+
+    def test_neighbours_are_prefetched(self):
+        GLOBAL_DISPATCHER.iterate()
+        self.assertEqual(['one'], self.audio_system.tts_channel.prefetched)
+        del self.audio_system.tts_channel.prefetched[:]
+        self.container[2].focus()
+        GLOBAL_DISPATCHER.iterate()
+        self.assertEqual(['three', 'one', 'Albums'], self.audio_system.tts_channel.prefetched)
+
+    def test_only_latest_prediction_is_delivered(self):
+        self.container[1].focus()
+        self.container[3].focus()
+        del self.audio_system.tts_channel.prefetched[:]
+        GLOBAL_DISPATCHER.iterate()
+        self.assertEqual(['two', 'Albums'], self.audio_system.tts_channel.prefetched)
+
+    def test_nothing_is_rendered_for_channels_without_prefetch(self):
+        self.audio_system.tts_channel.supports_prefetch = False
+        self.container[2].focus()
+        #Only the predictions are left to handle
+        rendered = []
+        self.renderer.get_chunks_to_render = rendered.append
+        GLOBAL_DISPATCHER.iterate()
+        self.assertEqual([], rendered)
+        self.assertEqual([], self.audio_system.tts_channel.prefetched)
+
+class CountingSynthesizer(NullSynthesizer):
+
+    def __init__(self, words_per_minute=200):
+        NullSynthesizer.__init__(self, words_per_minute)
+        self.synthesized = []
+
+    def synthesize(self, text):
+        self.synthesized.append(text)
+        return NullSynthesizer.synthesize(self, text)
+
+class UtteranceCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_memory_and_disk_tiers(self):
+        synthesizer = CountingSynthesizer()
+        cache = UtteranceCache(directory=self.directory)
+        caching_synthesizer = CachingSynthesizer(synthesizer, cache)
+        first = caching_synthesizer.synthesize("Albums")
+        self.assertIs(first, caching_synthesizer.synthesize("Albums"))
+        self.assertEqual(["Albums"], synthesizer.synthesized)
+        self.assertEqual(1, cache.metrics.get_hits(UtteranceCache.MEMORY))
+        self.assertEqual(1, cache.metrics.misses)
+        #A new cache (e.g. after a restart) finds the utterance on disk
+        restarted = CachingSynthesizer(synthesizer, UtteranceCache(directory=self.directory))
+        self.assertEqual(first.pcm, restarted.synthesize("Albums").pcm)
+        self.assertEqual(["Albums"], synthesizer.synthesized)
+        self.assertEqual(1, restarted.cache.metrics.get_hits(UtteranceCache.DISK))
+
+    def test_parameters_are_part_of_the_key(self):
+        cache = UtteranceCache(directory=self.directory)
+        CachingSynthesizer(CountingSynthesizer(words_per_minute=200), cache).synthesize("Albums")
+        slower = CountingSynthesizer(words_per_minute=100)
+        CachingSynthesizer(slower, cache).synthesize("Albums")
+        self.assertEqual(["Albums"], slower.synthesized)
+
+    def test_least_recently_used_are_evicted(self):
+        synthesizer = NullSynthesizer()
+        one_word = len(synthesizer.synthesize("one").pcm)
+        cache = UtteranceCache(max_memory_bytes=2 * one_word, directory=self.directory, max_disk_bytes=2 * one_word + 100)
+        parameters = synthesizer.get_parameters()
+        for text in ["one", "two"]:
+            cache.put(text, parameters, synthesizer.synthesize(text))
+        cache.get("one", parameters)
+        cache.put("three", parameters, synthesizer.synthesize("three"))
+        self.assertEqual(1, cache.metrics.get_evictions(UtteranceCache.MEMORY))
+        self.assertEqual(1, cache.metrics.get_evictions(UtteranceCache.DISK))
+        self.assertEqual(2, len(os.listdir(self.directory)))
+        self.assertIsNotNone(cache.get("one", parameters))
+        self.assertIsNone(cache.get("two", parameters))
+
+    def test_memory_hits_do_not_wait_for_disk(self):
+        synthesizer = NullSynthesizer()
+        parameters = synthesizer.get_parameters()
+        cache = UtteranceCache(directory=self.directory)
+        cache.put("one", parameters, synthesizer.synthesize("one"))
+        writing = threading.Event()
+        release = threading.Event()
+        slow = synthesizer.synthesize("two")
+        def slow_to_wav(to_wav=slow.to_wav):
+            writing.set()
+            release.wait(5)
+            return to_wav()
+        slow.to_wav = slow_to_wav
+        writer = threading.Thread(target=cache.put, args=("two", parameters, slow))
+        writer.start()
+        try:
+            self.assertTrue(writing.wait(5))
+            self.assertIsNotNone(cache.get("one", parameters))
+            self.assertTrue(writer.is_alive(), "The write finished before the hit")
+        finally:
+            release.set()
+            writer.join()
+        self.assertEqual(2, len(os.listdir(self.directory)))
+
+class LookaheadTest(unittest.TestCase):
+
+    class BlockingSynthesizer(NullSynthesizer):
+
+        def __init__(self):
+            NullSynthesizer.__init__(self)
+            self.started = []
+            self.release = threading.Event()
+
+        def synthesize(self, text):
+            self.started.append(text)
+            self.release.wait(5)
+            return NullSynthesizer.synthesize(self, text)
+
+    def test_only_lookahead_texts_are_synthesized(self):
+        synthesizer = LookaheadTest.BlockingSynthesizer()
+        channel = SynthesizingTtsChannel('test', synthesizer, NullEffectsChannel(FakeClock()),
+                                         sound_factory=create_null_sound, workers=4, lookahead=2)
+        try:
+            futures = [channel.queue("chunk {0}".format(index)) for index in range(10)]
+            time.sleep(0.05)
+            self.assertEqual(["chunk 0", "chunk 1", "chunk 2"], sorted(synthesizer.started))
+            channel.interrupt()
+            self.assertTrue(all(future.cancelled for future in futures))
+            synthesizer.release.set()
+            time.sleep(0.05)
+            self.assertEqual(3, len(synthesizer.started), "Interrupted chunks were synthesized")
+        finally:
+            synthesizer.release.set()
+            channel.close()
+
+    def test_synthesis_follows_playback(self):
+        synthesizer = CountingSynthesizer()
+        clock = FakeClock()
+        channel = SynthesizingTtsChannel('test', synthesizer, NullEffectsChannel(clock),
+                                         sound_factory=create_null_sound, workers=4, lookahead=2)
+        try:
+            futures = [channel.queue("word {0}".format(index)) for index in range(20)]
+            self.__iterate(channel)
+            #The first text is playing and the next two are ready
+            self.assertEqual(3, len(synthesizer.synthesized))
+            clock.now += 0.6
+            self.__iterate(channel)
+            self.assertTrue(futures[0].finished)
+            self.assertFalse(futures[1].finished)
+            self.assertEqual(4, len(synthesizer.synthesized))
+        finally:
+            channel.close()
+
+    @staticmethod
+    def __iterate(channel):
+        #Synthesis happens on the pool, give it a chance to finish between iterations
+        for _ in range(10):
+            channel._iterate() #pylint: disable=protected-access
+            time.sleep(0.01)
+
+class PyttsxChannelTest(unittest.TestCase):
+
+    class FakeEngine(object):
+
+        def __init__(self):
+            self.said = []
+
+        def say(self, text, name):
+            self.said.append((text, name))
+
+        def stop(self):
+            pass
+
+    def setUp(self):
+        self.channel = PyttsxChannel('test')
+        self.channel.engine = PyttsxChannelTest.FakeEngine()
+
+    def __finish(self, index, completed=True):
+        _, name = self.channel.engine.said[index]
+        #pylint: disable=protected-access
+        self.channel._PyttsxChannel__on_utterance_finished(name=name, completed=completed)
+
+    def test_futures_complete_in_order(self):
+        first = self.channel.queue("first")
+        second = self.channel.queue("second")
+        self.__finish(0)
+        self.assertTrue(first.finished)
+        self.assertFalse(second.finished)
+        self.__finish(1)
+        self.assertTrue(second.finished)
+
+    def test_interrupt_cancels_unfinished(self):
+        first = self.channel.queue("first")
+        self.channel.interrupt()
+        self.assertTrue(first.cancelled)
+        #The engine reports the stopped utterance after the interrupt
+        self.__finish(0, completed=False)
+        third = self.channel.queue("third")
+        self.__finish(1)
+        self.assertTrue(third.finished)
+        self.assertFalse(third.cancelled)
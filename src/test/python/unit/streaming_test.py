@@ -0,0 +1,139 @@
+'''
+Tests for the streaming audio channel
+'''
+import io
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import pygame
+
+from bowser.systems.key_and_frame import UserEventRouter
+from bowser.systems.streaming import StreamingChannel
+
+class FakeMusic(object):
+    '''
+    Stands in for pygame.mixer.music, records what is played
+    '''
+
+    def __init__(self):
+        self.end_event = None
+        self.loaded = None
+        self.played = []
+        self.contents = []
+        self.stops = 0
+
+    def set_endevent(self, code):
+        self.end_event = code
+
+    def load(self, path):
+        if not os.path.exists(path):
+            raise pygame.error("No such file")
+        self.loaded = path
+        with open(path, 'rb') as played_file:
+            self.contents.append(played_file.read())
+
+    def play(self):
+        self.played.append(self.loaded)
+
+    def stop(self):
+        self.stops += 1
+
+    def unload(self):
+        self.loaded = None
+
+class FakeResponse(io.BytesIO):
+
+    def __init__(self, body, reads):
+        io.BytesIO.__init__(self, body)
+        self.reads = reads
+
+    def read(self, size=-1):
+        self.reads.append(size)
+        return io.BytesIO.read(self, size)
+
+class StreamingChannelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.spool_directory = tempfile.mkdtemp()
+        self.router = UserEventRouter()
+        self.music = FakeMusic()
+        self.bodies = {}
+        self.reads = []
+        self.channel = StreamingChannel('test', self.router, self.music, opener=self.__open, chunk_size=4,
+                                        max_download_bytes=16, spool_directory=self.spool_directory)
+        self.channel.initialize()
+
+    def tearDown(self):
+        self.channel.close()
+        shutil.rmtree(self.spool_directory)
+
+    def __open(self, url):
+        return FakeResponse(self.bodies[url], self.reads)
+
+    def __finish_playing(self):
+        self.router.get_handler(self.music.end_event)(self.music.end_event)
+
+    def __iterate_until(self, condition):
+        deadline = time.time() + 5
+        while not condition() and time.time() < deadline:
+            self.channel._iterate() #pylint: disable=protected-access
+            time.sleep(0.001)
+        self.assertTrue(condition())
+
+    def test_streams_play_in_order(self):
+        self.bodies['http://example.com/song.ogg'] = b'0123456789'
+        first = self.channel.queue('/music/local.ogg')
+        second = self.channel.queue('http://example.com/song.ogg')
+        self.assertRaises(pygame.error, self.music.load, '/music/local.ogg')
+        #The local file does not exist, so it is skipped
+        self.__iterate_until(lambda: self.music.played)
+        self.assertTrue(first.cancelled)
+        self.assertEqual([b'0123456789'], self.music.contents)
+        self.assertEqual([4, 4, 4, 4], self.reads)
+        self.assertFalse(second.finished)
+        self.__finish_playing()
+        self.assertTrue(second.finished and not second.cancelled)
+        self.assertEqual([], os.listdir(self.spool_directory))
+
+    def test_oversized_bodies_are_abandoned(self):
+        self.bodies['http://example.com/big.ogg'] = b'x' * 17
+        self.bodies['http://example.com/small.ogg'] = b'small'
+        big = self.channel.queue('http://example.com/big.ogg')
+        small = self.channel.queue('http://example.com/small.ogg')
+        self.__iterate_until(lambda: big.finished and self.music.played)
+        self.assertTrue(big.cancelled)
+        self.assertEqual([b'small'], self.music.contents)
+        self.__finish_playing()
+        self.assertTrue(small.finished and not small.cancelled)
+        self.assertEqual([], os.listdir(self.spool_directory))
+
+    def test_interrupt(self):
+        self.bodies['http://example.com/one.ogg'] = b'one'
+        self.bodies['http://example.com/two.ogg'] = b'two'
+        one = self.channel.queue('http://example.com/one.ogg')
+        two = self.channel.queue('http://example.com/two.ogg')
+        self.__iterate_until(lambda: self.music.played)
+        self.channel.interrupt()
+        self.assertTrue(one.cancelled and two.cancelled)
+        self.assertEqual(1, self.music.stops)
+        self.bodies['http://example.com/three.ogg'] = b'three'
+        three = self.channel.queue('http://example.com/three.ogg')
+        self.__iterate_until(lambda: len(self.music.played) == 2)
+        #The end event caused by stopping the first stream does not finish the new one
+        self.__finish_playing()
+        self.assertFalse(three.finished)
+        self.__finish_playing()
+        self.assertTrue(three.finished and not three.cancelled)
+        self.__iterate_until(lambda: not os.listdir(self.spool_directory))
+
+    def test_requires_pygame_2(self):
+        #pylint: disable=no-member
+        numevents = pygame.NUMEVENTS
+        pygame.NUMEVENTS = 32 #As in pygame 1
+        try:
+            self.assertRaises(Exception, StreamingChannel, 'old', UserEventRouter(), self.music)
+        finally:
+            pygame.NUMEVENTS = numevents
@@ -0,0 +1,77 @@
+'''
+Tests for the out of process TTS channel
+'''
+import os
+import time
+import unittest
+
+from bowser.systems.tts_process import ProcessTtsChannel
+
+class FakeEngine(object):
+    '''
+    Finishes one utterance per iteration, exits the worker when told to say "crash"
+    '''
+
+    def __init__(self, on_finished):
+        self.on_finished = on_finished
+        self.pending = []
+
+    def say(self, text, name):
+        if text == 'crash':
+            os._exit(3) #pylint: disable=protected-access
+        self.pending.append(name)
+
+    def stop(self):
+        stopped, self.pending = self.pending, []
+        for name in stopped:
+            self.on_finished(name, False)
+
+    def iterate(self):
+        if self.pending:
+            self.on_finished(self.pending.pop(0), True)
+
+class SlowEngine(FakeEngine):
+    '''
+    Never finishes an utterance on its own
+    '''
+
+    def iterate(self):
+        time.sleep(0.01)
+
+def wait_for(future, timeout=10):
+    deadline = time.time() + timeout
+    while not future.finished and time.time() < deadline:
+        time.sleep(0.01)
+    return future.finished
+
+class ProcessTtsChannelTest(unittest.TestCase):
+
+    def tearDown(self):
+        self.channel.close()
+
+    def test_utterances_complete(self):
+        self.channel = ProcessTtsChannel('test', FakeEngine)
+        self.channel.initialize()
+        first = self.channel.queue("first")
+        second = self.channel.queue("second")
+        self.assertTrue(wait_for(second))
+        self.assertTrue(first.finished)
+        self.assertFalse(first.cancelled or second.cancelled)
+
+    def test_interrupt_cancels_unfinished(self):
+        self.channel = ProcessTtsChannel('test', SlowEngine)
+        self.channel.initialize()
+        futures = [self.channel.queue("text") for _ in range(3)]
+        self.channel.interrupt()
+        self.assertTrue(all(future.cancelled for future in futures))
+
+    def test_worker_is_restarted_after_a_crash(self):
+        self.channel = ProcessTtsChannel('test', FakeEngine, restart_delay=0)
+        self.channel.initialize()
+        lost = self.channel.queue("crash")
+        self.assertTrue(wait_for(lost))
+        self.assertTrue(lost.cancelled)
+        self.assertEqual(1, self.channel.restarts)
+        after = self.channel.queue("after")
+        self.assertTrue(wait_for(after))
+        self.assertFalse(after.cancelled)
@@ -0,0 +1,59 @@
+'''
+Tests for the post-processing performed by the XmlParser
+'''
+import sys
+import unittest
+
+from bowser import rom
+from bowser.rom import RomElement, TagProcessor, Window
+from bowser.systems.event import SubtreeModifiedEvent
+from bowser.xmlparse import XmlParser
+
+class XmlParserTest(unittest.TestCase):
+
+    class CountingProcessor(TagProcessor):
+
+        def __init__(self, tag_name):
+            TagProcessor.__init__(self, tag_name)
+            self.processed = []
+
+        def _do_process(self, element):
+            self.processed.append(element.get_id())
+
+    def setUp(self):
+        self.roots = []
+
+    def tearDown(self):
+        #The documents are never attached to a window so their listeners must be released here
+        for root in self.roots:
+            rom.release_elements(element.get_id() for element in root.iter("*"))
+
+    def __parse(self, parser, text):
+        root = parser.fromstring(text)
+        self.roots.append(root)
+        return root
+
+    def test_processors_only_see_their_tags(self):
+        counter = XmlParserTest.CountingProcessor('p')
+        parser = XmlParser(rom.create_processors_list() + [counter], RomElement)
+        root = self.__parse(parser, '<ram><!-- a comment --><container><title><p>a</p></title><p>b</p></container></ram>')
+        self.assertEqual([element.get_id() for element in root.iter('p')], counter.processed)
+        self.assertEqual('False', root.get(rom.Attributes.Focusable), "The ram processor did not run")
+
+    def test_document_is_notified_once(self):
+        window = Window()
+        modified = []
+        window.add_event_listener(SubtreeModifiedEvent.name, modified.append)
+        parser = XmlParser(rom.create_processors_list(), RomElement)
+        root = self.__parse(parser, '<ram><container><ram/><ram/></container><ram/></ram>')
+        window.remove_event_listener(SubtreeModifiedEvent.name, modified.append)
+        self.assertEqual(['False'] * 4, [element.get(rom.Attributes.Focusable) for element in root.iter('ram')])
+        self.assertEqual([root], [event.target for event in modified])
+
+    def test_deep_documents(self):
+        depth = sys.getrecursionlimit() * 2
+        counter = XmlParserTest.CountingProcessor('container')
+        parser = XmlParser(rom.create_processors_list() + [counter], RomElement)
+        root = self.__parse(parser, '<ram>' + '<container>' * depth + '<p>deep</p>' + '</container>' * depth + '</ram>')
+        self.assertEqual(depth, len(counter.processed))
+        self.assertEqual(depth + 1, root.find('.//p').get_id() - root.get_id())